@@ -0,0 +1,92 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-02
+
+Concurrent request fan-out to the members of a group.
+
+Every member is sent the same framed request from a bounded pool of workers, and the whole fan-out is cut off at an
+overall deadline, so greeting a group costs about one round trip (or the deadline) instead of the sum of them.
+"""
+import collections
+import concurrent.futures
+import socket
+import time
+
+import framing
+
+MAX_WORKERS = 32  # most members contacted at once
+PEER_TIMEOUT = 1.5  # seconds allowed for any one member
+DEADLINE = 3.0  # seconds allowed for the whole fan-out
+
+Result = collections.namedtuple('Result', 'member reply error latency')
+Result.__doc__ = """
+Outcome of contacting one member: reply is the reply payload (None on failure), error is the exception or
+'deadline' (None on success), latency is seconds from start of the fan-out to the reply or failure.
+"""
+
+
+def member_address(member):
+    """
+    Default way to get an address out of a member entry.
+
+    >>> member_address({'host': 'localhost', 'port': 23015})
+    ('localhost', 23015)
+
+    :param member: {'host': host, 'port': port}
+    :return: (host, port)
+    """
+    return member['host'], member['port']
+
+
+def fan_out(members, request, address=member_address, max_workers=MAX_WORKERS, peer_timeout=PEER_TIMEOUT,
+            deadline=DEADLINE):
+    """
+    Send the request to every member concurrently and collect their replies.
+
+    :param members: sequence of member entries
+    :param request: framed request payload (bytes) to send to each
+    :param address: function member -> (host, port)
+    :param max_workers: most members contacted at once
+    :param peer_timeout: seconds allowed for any one member (connect and reply)
+    :param deadline: seconds allowed for the whole fan-out; members not done by then are reported as 'deadline'
+    :return: list of Result, in the same order as members
+    """
+    start = time.monotonic()
+    cutoff = start + deadline
+    results = [None] * len(members)
+    if not members:
+        return results
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(members)))
+    futures = {executor.submit(contact, address(member), request, peer_timeout, start, cutoff): i
+               for i, member in enumerate(members)}
+    done, not_done = concurrent.futures.wait(futures, timeout=max(0.0, cutoff - time.monotonic()))
+    for future in not_done:
+        future.cancel()
+    executor.shutdown(wait=False)  # stragglers give up on their own at the cutoff
+
+    for future, i in futures.items():
+        if future in done:
+            reply, error, latency = future.result()
+        else:
+            reply, error, latency = None, 'deadline', deadline
+        results[i] = Result(members[i], reply, error, latency)
+    return results
+
+
+def contact(address, request, peer_timeout, start, cutoff):
+    """
+    Send the request to one member and wait for its reply (runs in a worker thread).
+
+    :return: (reply payload or None, exception or None, seconds since start)
+    """
+    timeout = min(peer_timeout, cutoff - time.monotonic())
+    if timeout <= 0:
+        return None, 'deadline', time.monotonic() - start
+    try:
+        with socket.create_connection(address, timeout=timeout) as peer:
+            reply = framing.request(peer, request)
+    except Exception as err:
+        return None, err, time.monotonic() - start
+    return reply, None, time.monotonic() - start
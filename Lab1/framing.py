@@ -0,0 +1,261 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-02
+
+Length-prefixed framing for the request/response exchanges over TCP.
+
+Each message is a 4-byte big-endian payload length followed by the payload. Receivers reassemble the payload
+straight into a buffer sized from the announced length, so a message of any size arrives in one round trip
+(instead of whatever happened to fit in a single recv) and several messages can be pipelined on one connection.
+The buffer starts at no more than PREALLOC bytes and doubles as the payload actually arrives, so a header on its own
+cannot make us reserve max_frame bytes. Servers answering small requests also pass a max_frame of MAX_REQUEST.
+
+This module is duplicated in Lab1, Lab2 and Lab4 so that each lab stays runnable on its own; keep the copies identical.
+"""
+import collections
+import struct
+
+HEADER = struct.Struct('!I')  # payload length, network byte order
+MAX_FRAME = 64 * 1024 * 1024  # refuse to allocate for anything bigger than this
+MAX_REQUEST = 64 * 1024  # limit for requests to the servers (JOINs, HEARTBEATs, RPCs are all far smaller)
+PREALLOC = 64 * 1024  # most bytes reserved for a payload before any of it has arrived
+IOV_MAX = 512  # most buffers handed to one sendmsg call
+
+
+def pack_frame(payload):
+    """
+    Frame the given payload as a single bytes object.
+
+    >>> pack_frame(b'JOIN')
+    b'\\x00\\x00\\x00\\x04JOIN'
+
+    :param payload: bytes-like message body
+    :return: header + payload
+    """
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_frame(sock, payload):
+    """
+    Send the payload as one frame on a blocking socket.
+    The header and payload go out in a single gathered write, so the payload is not copied.
+
+    :param sock: connected socket
+    :param payload: bytes-like message body
+    """
+    header = HEADER.pack(len(payload))
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(header + payload)
+        return
+    sent = sock.sendmsg([header, payload])
+    if sent < len(header):
+        sock.sendall(header[sent:])
+        sent = len(header)
+    if sent < len(header) + len(payload):
+        sock.sendall(memoryview(payload)[sent - len(header):])
+
+
+def recv_into_exactly(sock, view):
+    """
+    Fill the given buffer from a blocking socket.
+
+    :param sock: connected socket
+    :param view: writable memoryview to fill
+    :return: number of bytes received (less than len(view) only if the peer closed the connection)
+    """
+    filled = 0
+    while filled < len(view):
+        n = sock.recv_into(view[filled:])
+        if n == 0:
+            break
+        filled += n
+    return filled
+
+
+def recv_frame(sock, max_frame=MAX_FRAME):
+    """
+    Receive one frame from a blocking socket.
+
+    :param sock: connected socket
+    :param max_frame: largest payload we are willing to accept
+    :return: the payload (a bytearray), or None if the peer closed the connection before starting a new frame
+    :raises ConnectionError: if the peer closed the connection part way through a frame
+    :raises ValueError: if the announced payload is larger than max_frame
+    """
+    header = bytearray(HEADER.size)
+    n = recv_into_exactly(sock, memoryview(header))
+    if n == 0:
+        return None
+    if n < HEADER.size:
+        raise ConnectionError('connection closed in frame header')
+    length, = HEADER.unpack(header)
+    if length > max_frame:
+        raise ValueError('frame of {} bytes exceeds limit of {}'.format(length, max_frame))
+    payload = bytearray(min(length, PREALLOC))
+    filled = 0
+    while True:
+        view = memoryview(payload)
+        filled += recv_into_exactly(sock, view[filled:])
+        view.release()  # so the payload can grow
+        if filled < len(payload):
+            raise ConnectionError('connection closed in frame payload')
+        if filled == length:
+            return payload
+        payload += bytes(min(filled, length - filled))
+
+
+def recv_frames(sock, max_frame=MAX_FRAME):
+    """
+    Generate the frames pipelined on a blocking socket until the peer closes it.
+
+    :param sock: connected socket
+    :param max_frame: largest payload we are willing to accept
+    """
+    while True:
+        payload = recv_frame(sock, max_frame)
+        if payload is None:
+            return
+        yield payload
+
+
+def request(sock, payload):
+    """
+    Send one frame and wait for the framed reply.
+
+    :param sock: connected, blocking socket
+    :param payload: bytes-like request body
+    :return: reply payload
+    :raises ConnectionError: if the peer closed the connection without replying
+    """
+    send_frame(sock, payload)
+    reply = recv_frame(sock)
+    if reply is None:
+        raise ConnectionError('connection closed before reply')
+    return reply
+
+
+class FrameReader(object):
+    """
+    Incremental frame reassembly for non-blocking sockets.
+
+    The header is read into a small fixed buffer; once the length is known the payload is read directly into
+    a buffer that grows (by doubling, from PREALLOC bytes at most) to exactly that size, so there is no
+    intermediate copy or concatenation of what was read.
+
+    >>> import socket
+    >>> ours, theirs = socket.socketpair()
+    >>> ours.setblocking(False)
+    >>> reader = FrameReader()
+    >>> theirs.sendall(HEADER.pack(MAX_FRAME))  # a header alone only reserves PREALLOC bytes
+    >>> reader.read_from(ours), len(reader.payload)
+    (([], False), 65536)
+    >>> theirs.sendall(b'x' * 100_000)
+    >>> reader.read_from(ours), len(reader.payload)
+    (([], False), 131072)
+    >>> theirs.close(); ours.close()
+    """
+
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self.header = bytearray(HEADER.size)
+        self.payload = None  # bytearray being filled, or None while reading a header
+        self.length = 0  # announced size of the payload being read
+        self.view = memoryview(self.header)
+        self.filled = 0
+
+    def read_from(self, sock):
+        """
+        Read everything the socket has ready.
+
+        :param sock: non-blocking socket
+        :return: (list of completed payloads, True if the peer has closed the connection)
+        :raises ConnectionError: if the peer closed the connection part way through a frame
+        :raises ValueError: if an announced payload is larger than max_frame
+        """
+        frames = []
+        while True:
+            try:
+                n = sock.recv_into(self.view[self.filled:])
+            except (BlockingIOError, InterruptedError):
+                return frames, False
+            if n == 0:
+                if self.payload is not None or self.filled > 0:
+                    raise ConnectionError('connection closed mid-frame')
+                return frames, True
+            self.filled += n
+            if self.filled < len(self.view):
+                continue
+            if self.payload is None:
+                length, = HEADER.unpack(self.header)
+                if length > self.max_frame:
+                    raise ValueError('frame of {} bytes exceeds limit of {}'.format(length, self.max_frame))
+                self.length = length
+                self.payload = bytearray(min(length, PREALLOC))
+                self.view = memoryview(self.payload)
+                self.filled = 0
+                if length > 0:
+                    continue
+            elif self.filled < self.length:
+                self.view.release()  # so the payload can grow
+                self.payload += bytes(min(self.filled, self.length - self.filled))
+                self.view = memoryview(self.payload)
+                continue
+            frames.append(self.payload)
+            self.payload = None
+            self.view = memoryview(self.header)
+            self.filled = 0
+
+
+class FrameWriter(object):
+    """
+    Outbound frame queue for non-blocking sockets.
+
+    Queued payloads are referenced, not copied, and written with gathered sendmsg calls.
+    """
+
+    def __init__(self):
+        self.buffers = collections.deque()  # memoryviews still to be written, in order
+
+    def __len__(self):
+        return sum(len(buf) for buf in self.buffers)
+
+    def __bool__(self):
+        return bool(self.buffers)
+
+    def queue(self, payload):
+        """
+        Queue the payload to go out as one frame.
+
+        :param payload: bytes-like message body (must not be mutated until written)
+        """
+        self.buffers.append(memoryview(HEADER.pack(len(payload))))
+        if len(payload) > 0:
+            self.buffers.append(memoryview(payload))
+
+    def write_to(self, sock):
+        """
+        Write as much as the socket will take.
+
+        :param sock: non-blocking socket
+        :return: True if everything queued has been written
+        :raises OSError: on a socket error other than would-block
+        """
+        while self.buffers:
+            try:
+                if hasattr(sock, 'sendmsg'):
+                    sent = sock.sendmsg([self.buffers[i] for i in range(min(len(self.buffers), IOV_MAX))])
+                else:
+                    sent = sock.send(self.buffers[0])
+            except (BlockingIOError, InterruptedError):
+                return False
+            while sent > 0:
+                head = self.buffers[0]
+                if sent >= len(head):
+                    sent -= len(head)
+                    self.buffers.popleft()
+                else:
+                    self.buffers[0] = head[sent:]
+                    sent = 0
+        return True
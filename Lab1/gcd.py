@@ -4,11 +4,12 @@ This is free and unencumbered software released into the public domain.
 :Authors: Kevin Lundeen
 :Version: f19-02
 """
-import pickle
 import socketserver
 import sys
 
-BUF_SZ = 1024  # tcp receive buffer size
+import framing
+import wire
+from selector_server import READ_TIMEOUT, SelectorServer
 
 
 class GroupCoordinatorDaemon(socketserver.BaseRequestHandler):
@@ -24,26 +25,60 @@ class GroupCoordinatorDaemon(socketserver.BaseRequestHandler):
 
     def handle(self):
         """
-        Handles the incoming messages - expects only 'JOIN' messages
+        Handles one incoming message - expects only 'JOIN' messages. The socketserver is serial, so we answer one
+        request and hang up rather than let a client that keeps its connection open hold up everyone else.
         """
-        raw = self.request.recv(BUF_SZ)  # self.request is the TCP socket connected to the client
-        print(self.client_address)
+        self.request.settimeout(READ_TIMEOUT)  # self.request is the TCP socket connected to the client
         try:
-            message = pickle.loads(raw)
-        except (pickle.PickleError, KeyError):
-            response = bytes('Expected a pickled message, got ' + str(raw)[:100] + '\n', 'utf-8')
+            raw = framing.recv_frame(self.request, framing.MAX_REQUEST)
+            if raw is not None:
+                framing.send_frame(self.request, self.respond(raw, self.client_address))
+        except (OSError, ValueError) as err:
+            print('dropped {}: {}'.format(self.client_address, err))
+
+    @classmethod
+    def respond(cls, raw, client_address):
+        """
+        Builds the response to a raw request (shared by the socketserver and selector serving modes).
+
+        :param raw: bytes received from the client
+        :param client_address: (host, port) of the client
+        :return: bytes to send back to the client (in the same encoding as the request)
+        """
+        print(client_address)
+        binary = wire.is_binary(raw)
+        try:
+            message = wire.decode(raw)
+        except ValueError:
+            response = bytes('Expected a wire-encoded message, got ' + str(raw)[:100] + '\n', 'utf-8')
         else:
             if message != 'JOIN':
-                response = pickle.dumps('Unexpected message: ' + str(message))
+                response = wire.encode('Unexpected message: ' + str(message), binary)
             else:
-                response = pickle.dumps(self.JOIN_RESPONSE)
-        self.request.sendall(response)
+                response = wire.encode(cls.JOIN_RESPONSE, binary)
+        return response
+
+
+def serve(port, mode='serial'):
+    """
+    Run the GCD on the given port.
+
+    :param port: port to listen on
+    :param mode: 'serial' for one-request-at-a-time socketserver, 'select' for the event-driven server
+    """
+    if mode == 'select':
+        with SelectorServer(('', port), GroupCoordinatorDaemon.respond) as server:
+            server.serve_forever()
+    else:
+        with socketserver.TCPServer(('', port), GroupCoordinatorDaemon) as server:
+            server.serve_forever()
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python gcd.py GCDPORT")
+    args = [arg for arg in sys.argv if arg != '--allow-pickle']
+    if len(args) < 2 or args[2:] not in ([], ['serial'], ['select']):
+        print("Usage: python gcd.py GCDPORT [serial|select] [--allow-pickle]")
         exit(1)
-    port = int(sys.argv[1])
-    with socketserver.TCPServer(('', port), GroupCoordinatorDaemon) as server:
-        server.serve_forever()
+    wire.ALLOW_PICKLE = len(args) < len(sys.argv)  # unpickling network data is unsafe: opt-in
+    port = int(args[1])
+    serve(port, *args[2:])
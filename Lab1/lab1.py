@@ -5,7 +5,9 @@
 
 import socket
 import sys
-import pickle
+
+import fanout
+import wire
 
 # alert for incorrect usage
 if len(sys.argv) != 3:
@@ -18,35 +20,20 @@ port = int(sys.argv[2])
 # ask the gcd for members via protocol
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
     sock.connect((host, port))
-    sock.send(pickle.dumps("JOIN"))
-    
     print("JOIN ('" + host + "', " + str(port) + ")")
     
-    response = pickle.loads(sock.recv(1024))
-    sock.disconnect()
+    response = wire.request(sock, "JOIN")
 
 members = list(response)
 
 for member in members:
-	
-	m_host = member['host']
-	m_port = int(member['port'])
-
-	with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-		
-		sock.settimeout(1.5)
-
-		# make sure we are able to connect
-		try:
-			sock.connect((m_host, m_port))
-		except Exception as e:
-			print("Failed to connect: " + str(e))
-		
-		# connecting went smoothly
-		else:
-			sock.send(pickle.dumps("HELLO"))
-
-			print("HELLO to " + str(member))
-			m_response = pickle.loads(sock.recv(1024))
-			print(m_response)
-			sock.disconnect()
\ No newline at end of file
+	print("HELLO to " + str(member))
+
+# greet everyone at once, giving up on stragglers after fanout.DEADLINE seconds
+results = fanout.fan_out(members, wire.encode("HELLO"))
+
+for result in results:
+	if result.error is not None:
+		print("Failed to connect to " + str(result.member) + ": " + str(result.error))
+	else:
+		print(wire.decode(result.reply), "({:.3f}s)".format(result.latency))
@@ -4,10 +4,12 @@ This is free and unencumbered software released into the public domain.
 :Authors: Kevin Lundeen
 :Version: f19-02
 """
-import pickle
 import socket
 import sys
 
+import fanout
+import wire
+
 
 class Lab1(object):
     """
@@ -25,6 +27,8 @@ class Lab1(object):
         self.port = int(gcd_port)
         self.members = []
         self.peer_timeout = 1.5  # seconds
+        self.meet_deadline = 3.0  # seconds to greet the whole group
+        self.max_concurrency = 32  # most members greeted at once
 
     def join_group(self):
         """
@@ -36,37 +40,36 @@ class Lab1(object):
             print('JOIN {}'.format(address))
             gcd.connect(address)
             self.members = self.message(gcd, 'JOIN')
-            self.meet_members()
+        self.meet_members()  # after hanging up, so a serial GCD can serve other clients meanwhile
 
     def meet_members(self):
         """
-        Sends a HELLO to all the group members.
+        Sends a HELLO to all the group members at once and reports each one's reply and latency.
         Also verbosely prints out what it is doing.
+
+        :return: list of fanout.Result, one per member
         """
         for member in self.members:
             print('HELLO to {}'.format(member))
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as peer:
-                peer.settimeout(self.peer_timeout)
-                try:
-                    peer.connect((member['host'], member['port']))
-                except Exception as err:
-                    print('failed to connect: {}', err)
-                else:
-                    message = self.message(peer, 'HELLO')
-                    print(message)
+        results = fanout.fan_out(self.members, wire.encode('HELLO'), max_workers=self.max_concurrency,
+                                 peer_timeout=self.peer_timeout, deadline=self.meet_deadline)
+        for result in results:
+            if result.error is not None:
+                print('{} failed after {:.3f}s: {}'.format(result.member, result.latency, result.error))
+            else:
+                print('{} replied after {:.3f}s: {}'.format(result.member, result.latency, wire.decode(result.reply)))
+        return results
 
     @staticmethod
-    def message(sock, send_data, buffer_size=1024):
+    def message(sock, send_data):
         """
-        Pickles and sends the given message to the given socket and unpickles the returned value and returns it.
+        Encodes and sends the given message to the given socket and decodes the returned value and returns it.
 
         :param sock: socket to message/recv
-        :param send_data: message data (anything pickle-able)
-        :param buffer_size: number of bytes in receive buffer
-        :return: message response (unpickled--pickled data must fit in buffer_size bytes)
+        :param send_data: message data (anything wire.encode can handle)
+        :return: message response (decoded, of any size--both directions are length-prefixed frames)
         """
-        sock.sendall(pickle.dumps(send_data))
-        return pickle.loads(sock.recv(buffer_size))
+        return wire.request(sock, send_data)
 
 
 if __name__ == '__main__':
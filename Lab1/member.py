@@ -4,11 +4,12 @@ This is free and unencumbered software released into the public domain.
 :Authors: Kevin Lundeen
 :Version: f19-02
 """
-import pickle
 import socketserver
 import sys
 
-BUF_SZ = 1024  # tcp receive buffer size
+import framing
+import wire
+from selector_server import READ_TIMEOUT, SelectorServer
 
 class GroupMember(socketserver.BaseRequestHandler):
     """
@@ -19,26 +20,60 @@ class GroupMember(socketserver.BaseRequestHandler):
 
     def handle(self):
         """
-        Handles the incoming messages - expects only 'HELLO' messages
+        Handles one incoming message - expects only 'HELLO' messages. The socketserver is serial, so we answer one
+        request and hang up rather than let a client that keeps its connection open hold up everyone else.
         """
-        raw = self.request.recv(BUF_SZ)  # self.request is the TCP socket connected to the client
+        self.request.settimeout(READ_TIMEOUT)  # self.request is the TCP socket connected to the client
         try:
-            message = pickle.loads(raw)
-        except (pickle.PickleError, KeyError):
-            response = bytes('Expected a pickled message, got ' + str(raw)[:100] + '\n', 'utf-8')
+            raw = framing.recv_frame(self.request, framing.MAX_REQUEST)
+            if raw is not None:
+                framing.send_frame(self.request, self.respond(raw, self.client_address))
+        except (OSError, ValueError) as err:
+            print('dropped {}: {}'.format(self.client_address, err))
+
+    @staticmethod
+    def respond(raw, client_address):
+        """
+        Builds the response to a raw request (shared by the socketserver and selector serving modes).
+
+        :param raw: bytes received from the peer
+        :param client_address: (host, port) of the peer
+        :return: bytes to send back to the peer (in the same encoding as the request)
+        """
+        binary = wire.is_binary(raw)
+        try:
+            message = wire.decode(raw)
+        except ValueError:
+            response = bytes('Expected a wire-encoded message, got ' + str(raw)[:100] + '\n', 'utf-8')
         else:
             if message != 'HELLO':
-                response = pickle.dumps('Unexpected message: ' + str(message))
+                response = wire.encode('Unexpected message: ' + str(message), binary)
             else:
-                message = ('OK', 'Happy to meet you, {}'.format(self.client_address))
-                response = pickle.dumps(message)
-        self.request.sendall(response)
+                message = ('OK', 'Happy to meet you, {}'.format(client_address))
+                response = wire.encode(message, binary)
+        return response
+
+
+def serve(port, mode='serial'):
+    """
+    Run the group member on the given port.
+
+    :param port: port to listen on
+    :param mode: 'serial' for one-request-at-a-time socketserver, 'select' for the event-driven server
+    """
+    if mode == 'select':
+        with SelectorServer(('', port), GroupMember.respond) as server:
+            server.serve_forever()
+    else:
+        with socketserver.TCPServer(('', port), GroupMember) as server:
+            server.serve_forever()
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python member.py PORT")
+    args = [arg for arg in sys.argv if arg != '--allow-pickle']
+    if len(args) < 2 or args[2:] not in ([], ['serial'], ['select']):
+        print("Usage: python member.py PORT [serial|select] [--allow-pickle]")
         exit(1)
-    port = int(sys.argv[1])
-    with socketserver.TCPServer(('', port), GroupMember) as server:
-        server.serve_forever()
+    wire.ALLOW_PICKLE = len(args) < len(sys.argv)  # unpickling network data is unsafe: opt-in
+    port = int(args[1])
+    serve(port, *args[2:])
@@ -0,0 +1,437 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-02
+
+Compact binary encoding for the messages exchanged by the labs, in the spirit of fxp_bytes.
+
+A binary payload starts with MAGIC and is followed by one tagged value. Values the protocols use all the time have
+fixed struct layouts: a process id (days_to_birthday, su_id) is 6 bytes, an (ipv4, port) address is 6 bytes, and a
+peer map {process_id: address} is a count followed by 12-byte records that are decoded in bulk with iter_unpack.
+Everything else (strings, ints, tuples, lists, dicts, ...) gets a small generic tagged layout.
+
+Encoding dispatches on the exact type and decoding on the tag, through tables. The fixed layouts are packed and
+unpacked in bulk and run within about 1-2x of C pickle; generic values are handled one at a time in Python and cost
+several times what pickle does (Lab1's list of {'host', 'port'} dicts is the worst case), which is still microseconds
+against a network round trip. The trade is CPU for safety: decoding never runs code, and peer maps are a quarter
+smaller than pickled ones.
+
+Pickle is only understood when ALLOW_PICKLE is turned on (unpickling data from the network can run arbitrary code, so
+the servers only do it when started with --allow-pickle): then a framed payload that starts with a pickle opcode is
+unpickled, servers reply in whichever encoding the request came in, and request() retries with pickle if the peer does
+not answer in binary. Unframed pickle, as sent before framing was introduced, is not understood either way.
+
+This module is duplicated in Lab1, Lab2 and Lab4 so that each lab stays runnable on its own; keep the copies identical.
+"""
+import pickle
+import socket
+import struct
+
+import framing
+
+MAGIC = 0xB1  # first byte of every binary payload
+PICKLE = pickle.PROTO[0]  # first byte of every pickle (protocol 2 and up)
+ALLOW_PICKLE = False  # accept (framed) pickled payloads, for peers that only speak pickle; opt-in, it is unsafe
+
+# tags (byte values)
+NONE, TRUE, FALSE = b'NTF'
+INT, BIG_INT, FLOAT = b'iId'
+STR, BYTES, TUPLE, LIST, DICT = b'sbtlm'
+PROCESS_ID, ADDRESS, PEER_MAP = b'PAG'
+
+# fixed layouts
+INT64 = struct.Struct('!q')
+FLOAT64 = struct.Struct('!d')
+LENGTH = struct.Struct('!I')
+PROCESS_ID_LAYOUT = struct.Struct('!HI')  # days_to_birthday, su_id
+ADDRESS_LAYOUT = struct.Struct('!4sH')  # ipv4, port
+PEER_LAYOUT = struct.Struct('!HI4sH')  # process id then address
+
+# memos (the same few hosts and short strings turn up in nearly every message)
+MEMO_LIMIT = 4096  # entries before a memo is cleared
+MEMO_STRING = 64  # longest string worth memoizing
+packed_hosts = {}  # host -> packed IPv4 bytes, or None if host is not a dotted quad
+encoded_strings = {}  # short str -> its tagged encoding
+decoded_strings = {}  # short encoded str -> str
+
+
+def encode(message, binary=True):
+    """
+    Encode a message for the wire.
+
+    >>> encode('JOIN')
+    b'\\xb1s\\x00\\x00\\x00\\x04JOIN'
+    >>> len(encode({(10, 1000000): ('127.0.0.1', 5000), (20, 2000000): ('127.0.0.1', 5001)}))
+    30
+    >>> decode(encode(('ELECTION', ((10, 1000000), {(10, 1000000): ('127.0.0.1', 5000)}))))
+    ('ELECTION', ((10, 1000000), {(10, 1000000): ('127.0.0.1', 5000)}))
+
+    :param message: None, bool, int, float, str, bytes, or tuples, lists and dicts of those
+    :param binary: False to pickle instead (for peers that only speak pickle)
+    :return: payload bytes
+    :raises TypeError: if the message contains something we cannot encode
+    """
+    if not binary:
+        return pickle.dumps(message)
+    out = bytearray([MAGIC])
+    encode_value(message, out)
+    return bytes(out)
+
+
+def decode(payload, allow_pickle=None):
+    """
+    Decode a payload from the wire, whichever encoding it is in.
+
+    :param payload: bytes-like, as received
+    :param allow_pickle: override ALLOW_PICKLE
+    :return: the message
+    :raises ValueError: if the payload is malformed, or pickled when pickle is not allowed
+    """
+    view = payload if type(payload) is bytes else bytes(payload)
+    if len(view) == 0:
+        raise ValueError('empty payload')
+    if view[0] == MAGIC:
+        try:
+            message, offset = decode_value(view, 1)
+        except (struct.error, IndexError, TypeError, UnicodeDecodeError, RecursionError) as err:
+            raise ValueError('malformed payload: {}'.format(err))
+        if offset != len(view):
+            raise ValueError('{} bytes of trailing garbage'.format(len(view) - offset))
+        return message
+    if view[0] == PICKLE:
+        if not (ALLOW_PICKLE if allow_pickle is None else allow_pickle):
+            raise ValueError('pickled payloads are not accepted')
+        try:
+            return pickle.loads(view)
+        except Exception as err:
+            raise ValueError('malformed pickle: {}'.format(err))
+    raise ValueError('unknown encoding')
+
+
+def is_binary(payload):
+    """
+    :param payload: bytes-like, as received
+    :return: True if the payload is in the binary encoding (so the reply should be too)
+    """
+    return len(payload) > 0 and payload[0] == MAGIC
+
+
+def request(sock, message, binary=True):
+    """
+    Send a message as one frame and decode the framed reply.
+    If the peer answers a binary request with something other than binary, ask again with pickle (if ALLOW_PICKLE).
+
+    :param sock: connected, blocking socket
+    :param message: the request
+    :param binary: False to go straight to pickle
+    :return: the decoded reply
+    :raises ValueError: if the reply cannot be decoded
+    """
+    reply = framing.request(sock, encode(message, binary))
+    if binary and not is_binary(reply) and ALLOW_PICKLE:
+        reply = framing.request(sock, encode(message, False))
+    return decode(reply)
+
+
+def packed_ipv4(host):
+    """
+    :return: the 4 packed bytes if host is a dotted-quad IPv4 address, otherwise None
+    """
+    try:
+        return packed_hosts[host]
+    except (KeyError, TypeError):
+        pass
+    if type(host) is not str or host.count('.') != 3:
+        return None
+    try:
+        packed = socket.inet_aton(host)
+    except OSError:
+        packed = None
+    if packed is not None and socket.inet_ntoa(packed) != host:
+        packed = None  # e.g. '1.2.3.04' would not come back the same
+    if len(packed_hosts) >= MEMO_LIMIT:
+        packed_hosts.clear()
+    packed_hosts[host] = packed
+    return packed
+
+
+def is_process_id(value):
+    """ Does value fit the fixed process id layout? """
+    return (type(value) is tuple and len(value) == 2 and type(value[0]) is int and type(value[1]) is int and
+            0 <= value[0] < 1 << 16 and 0 <= value[1] < 1 << 32)
+
+
+def is_address(value):
+    """ Does value fit the fixed (ipv4, port) address layout? """
+    return (type(value) is tuple and len(value) == 2 and type(value[1]) is int and 0 <= value[1] < 1 << 16 and
+            packed_ipv4(value[0]) is not None)
+
+
+def encode_value(value, out):
+    """
+    Append the tagged encoding of value to out.
+
+    :param value: value to encode
+    :param out: bytearray to append to
+    :raises TypeError: if value contains something we cannot encode
+    """
+    try:
+        ENCODERS[type(value)](value, out)
+    except KeyError as err:
+        if type(err.args[0]) is not type:
+            raise
+        raise TypeError('cannot encode {}'.format(err.args[0].__name__))
+
+
+def encode_items(items, out):
+    """ Append a count and the tagged encoding of each item. """
+    out += LENGTH.pack(len(items))
+    encoders = ENCODERS
+    for item in items:
+        encoders[type(item)](item, out)
+
+
+def encode_str(value, out):
+    raw = encoded_strings.get(value)
+    if raw is None:
+        raw = value.encode('utf-8')
+        raw = bytes([STR]) + LENGTH.pack(len(raw)) + raw
+        if len(value) <= MEMO_STRING:
+            if len(encoded_strings) >= MEMO_LIMIT:
+                encoded_strings.clear()
+            encoded_strings[value] = raw
+    out += raw
+
+
+def encode_int(value, out):
+    if -(1 << 63) <= value < 1 << 63:
+        out.append(INT)
+        out += INT64.pack(value)
+    else:
+        raw = value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True)
+        out.append(BIG_INT)
+        out += LENGTH.pack(len(raw))
+        out += raw
+
+
+def encode_tuple(value, out):
+    if len(value) == 2 and type(value[1]) is int:  # the shape of a process id and of an address
+        first, second = value
+        if type(first) is int and 0 <= first < 1 << 16 and 0 <= second < 1 << 32:
+            out.append(PROCESS_ID)
+            out += PROCESS_ID_LAYOUT.pack(first, second)
+            return
+        if type(first) is str and 0 <= second < 1 << 16:
+            ip = packed_ipv4(first)
+            if ip is not None:
+                out.append(ADDRESS)
+                out += ADDRESS_LAYOUT.pack(ip, second)
+                return
+    out.append(TUPLE)
+    encode_items(value, out)
+
+
+def encode_list(value, out):
+    out.append(LIST)
+    encode_items(value, out)
+
+
+def encode_dict(value, out):
+    if value and type(next(iter(value))) is tuple and encode_peer_map(value, out):
+        return
+    out.append(DICT)
+    out += LENGTH.pack(len(value))
+    encoders = ENCODERS
+    for k, v in value.items():
+        encoders[type(k)](k, out)
+        encoders[type(v)](v, out)
+
+
+def encode_none(value, out):
+    out.append(NONE)
+
+
+def encode_bool(value, out):
+    out.append(TRUE if value else FALSE)
+
+
+def encode_float(value, out):
+    out.append(FLOAT)
+    out += FLOAT64.pack(value)
+
+
+def encode_bytes(value, out):
+    out.append(BYTES)
+    out += LENGTH.pack(len(value))
+    out += value
+
+
+ENCODERS = {str: encode_str, int: encode_int, tuple: encode_tuple, list: encode_list, dict: encode_dict,
+            type(None): encode_none, bool: encode_bool, float: encode_float, bytes: encode_bytes,
+            bytearray: encode_bytes}  # by exact type, so subclasses (which pickle would keep) are refused
+
+
+def encode_peer_map(peers, out):
+    """
+    Append a {process_id: (ipv4, port)} map as a count and fixed-size records, if it is one.
+
+    :return: False (with nothing appended) if peers does not fit the fixed layout
+    """
+    pack = PEER_LAYOUT.pack
+    hosts = packed_hosts
+    records = []
+    try:
+        for (days, su_id), address in peers.items():
+            if not (type(days) is int and type(su_id) is int and type(address) is tuple):
+                return False
+            host, port = address
+            ip = hosts.get(host) or packed_ipv4(host)
+            if ip is None or type(port) is not int:
+                return False
+            records.append(pack(days, su_id, ip, port))  # struct.error if a number is out of range
+    except (TypeError, ValueError, struct.error):
+        return False
+    out.append(PEER_MAP)
+    out += LENGTH.pack(len(peers))
+    out += b''.join(records)
+    return True
+
+
+def decode_value(view, offset):
+    """
+    Decode one tagged value.
+
+    :param view: the payload bytes
+    :param offset: where the value's tag is
+    :return: (value, offset just past it)
+    """
+    return DECODERS[view[offset]](view, offset + 1)
+
+
+def decode_items(view, offset):
+    """ Decode a count and that many tagged values into a list. """
+    length, = LENGTH.unpack_from(view, offset)
+    offset += LENGTH.size
+    decoders = DECODERS
+    items = []
+    for _ in range(length):
+        item, offset = decoders[view[offset]](view, offset + 1)
+        items.append(item)
+    return items, offset
+
+
+def decode_raw(view, offset):
+    """ :return: (the length-prefixed bytes at offset, offset just past them) """
+    length, = LENGTH.unpack_from(view, offset)
+    offset += LENGTH.size
+    end = offset + length
+    if end > len(view):
+        raise IndexError('value runs past end of payload')
+    return view[offset:end], end
+
+
+def decode_str(view, offset):
+    length, = LENGTH.unpack_from(view, offset)
+    offset += LENGTH.size
+    end = offset + length
+    if end > len(view):
+        raise IndexError('value runs past end of payload')
+    raw = view[offset:end]
+    if length > MEMO_STRING:
+        return str(raw, 'utf-8'), end
+    text = decoded_strings.get(raw)
+    if text is None:
+        text = str(raw, 'utf-8')
+        if len(decoded_strings) >= MEMO_LIMIT:
+            decoded_strings.clear()
+        decoded_strings[raw] = text
+    return text, end
+
+
+def decode_bytes(view, offset):
+    return decode_raw(view, offset)
+
+
+def decode_big_int(view, offset):
+    raw, end = decode_raw(view, offset)
+    return int.from_bytes(raw, 'big', signed=True), end
+
+
+def decode_int(view, offset):
+    return INT64.unpack_from(view, offset)[0], offset + INT64.size
+
+
+def decode_float(view, offset):
+    return FLOAT64.unpack_from(view, offset)[0], offset + FLOAT64.size
+
+
+def decode_none(view, offset):
+    return None, offset
+
+
+def decode_true(view, offset):
+    return True, offset
+
+
+def decode_false(view, offset):
+    return False, offset
+
+
+def decode_process_id(view, offset):
+    return PROCESS_ID_LAYOUT.unpack_from(view, offset), offset + PROCESS_ID_LAYOUT.size
+
+
+def decode_address(view, offset):
+    ip, port = ADDRESS_LAYOUT.unpack_from(view, offset)
+    return (socket.inet_ntoa(ip), port), offset + ADDRESS_LAYOUT.size
+
+
+def decode_tuple(view, offset):
+    items, offset = decode_items(view, offset)
+    return tuple(items), offset
+
+
+def decode_list(view, offset):
+    return decode_items(view, offset)
+
+
+def decode_dict(view, offset):
+    length, = LENGTH.unpack_from(view, offset)
+    offset += LENGTH.size
+    decoders = DECODERS
+    result = {}
+    for _ in range(length):
+        k, offset = decoders[view[offset]](view, offset + 1)
+        v, offset = decoders[view[offset]](view, offset + 1)
+        result[k] = v
+    return result, offset
+
+
+def decode_peer_map(view, offset):
+    length, = LENGTH.unpack_from(view, offset)
+    offset += LENGTH.size
+    end = offset + length * PEER_LAYOUT.size
+    if end > len(view):
+        raise IndexError('peer map runs past end of payload')
+    ips = {}
+    peers = {}
+    for days, su_id, ip, port in PEER_LAYOUT.iter_unpack(view[offset:end]):
+        host = ips.get(ip)
+        if host is None:
+            host = ips[ip] = socket.inet_ntoa(ip)
+        peers[(days, su_id)] = (host, port)
+    return peers, end
+
+
+def decode_unknown(view, offset):
+    raise ValueError('unknown tag {!r}'.format(view[offset - 1:offset]))
+
+
+DECODERS = [decode_unknown] * 256  # indexed by tag
+for tag, decoder in ((NONE, decode_none), (TRUE, decode_true), (FALSE, decode_false), (INT, decode_int),
+                     (BIG_INT, decode_big_int), (FLOAT, decode_float), (STR, decode_str), (BYTES, decode_bytes),
+                     (TUPLE, decode_tuple), (LIST, decode_list), (DICT, decode_dict),
+                     (PROCESS_ID, decode_process_id), (ADDRESS, decode_address), (PEER_MAP, decode_peer_map)):
+    DECODERS[tag] = decoder
+del tag, decoder
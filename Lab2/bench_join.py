@@ -0,0 +1,74 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Benchmark of JOIN handling in gcd2 against groups of various sizes, with and without the cached group snapshot.
+
+Each JOIN is a member re-joining with its existing listener (the common case while a large group reforms), so the
+group does not change and the cached reply can be reused. The "uncached" runs throw the cache away before every
+JOIN, which is what the coordinator used to do (encode the whole group on every request).
+
+Usage: python bench_join.py [GROUP_SIZE ...]
+"""
+import sys
+import time
+
+from gcd2 import GroupCoordinatorDaemon
+from groups import DEFAULT_GROUP, Groups
+import wire
+
+GROUP_SIZES = (10, 1_000, 100_000)
+MIN_SECONDS = 1.0  # run each case at least this long
+
+
+def populate(size):
+    """
+    Install a fresh group of the given size in the GCD, with one real localhost member we can JOIN as.
+
+    :param size: number of members
+    :return: (encoded JOIN request for the localhost member, the group's Membership)
+    """
+    GroupCoordinatorDaemon.groups = Groups()
+    group = GroupCoordinatorDaemon.groups.get(DEFAULT_GROUP, time.monotonic(), create=True)
+    for i in range(size - 1):
+        group.join((1 + i % 365, 1_000_000 + i), ('10.{}.{}.{}'.format(i >> 16 & 255, i >> 8 & 255, i & 255), 5000))
+    message = ('JOIN', ((1, 9_999_999), ('localhost', 5000)))
+    GroupCoordinatorDaemon.respond(wire.encode(message), None)  # first join adds us
+    return wire.encode(message), group
+
+
+def run(size, cached):
+    """
+    Time repeated JOINs against a group of the given size.
+
+    :param size: number of members
+    :param cached: False to discard the encoded snapshot before every JOIN
+    :return: (joins per second, reply size in bytes)
+    """
+    raw, group = populate(size)
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < MIN_SECONDS:
+        for _ in range(10):
+            if not cached:
+                group.encoded_version = None
+            reply = GroupCoordinatorDaemon.respond(raw, None)
+        count += 10
+        elapsed = time.perf_counter() - start
+    return count / elapsed, len(reply)
+
+
+def main(sizes):
+    print('{:>10} {:>12} {:>16} {:>16} {:>8}'.format('members', 'reply bytes', 'uncached JOIN/s', 'cached JOIN/s',
+                                                     'speedup'))
+    for size in sizes:
+        before, reply_size = run(size, cached=False)
+        after, _ = run(size, cached=True)
+        print('{:>10} {:>12} {:>16.0f} {:>16.0f} {:>7.1f}x'.format(size, reply_size, before, after, after / before))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or GROUP_SIZES)
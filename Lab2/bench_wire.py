@@ -0,0 +1,80 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-02
+
+Microbenchmark of the binary wire encoding against pickle for the messages the labs actually send.
+
+For each message prints the encoded size and the encode and decode times per message in each encoding.
+
+Usage: python bench_wire.py [GROUP_SIZE]
+"""
+import sys
+import time
+
+import wire
+
+GROUP_SIZE = 1_000  # members in the peer maps sent around by the coordinator and in elections
+MIN_SECONDS = 0.2  # run each case at least this long
+
+
+def peer_map(size):
+    """
+    :return: {process_id: (ip, port)} of the given size, like the coordinator hands out
+    """
+    return {(1 + i % 365, 1_000_000 + i): ('127.0.0.1', 10_000 + i % 50_000) for i in range(size)}
+
+
+def messages(size):
+    """
+    :return: list of (name, message) covering the Lab1, Lab2 and Lab4 protocols
+    """
+    identity = (42, 4_000_000)
+    peers = peer_map(size)
+    return [
+        ('lab1 JOIN', 'JOIN'),
+        ('lab1 HELLO', 'HELLO'),
+        ('lab1 group reply', [{'host': 'localhost', 'port': 10_000 + i} for i in range(size)]),
+        ('lab2 JOIN', ('JOIN', (identity, ('127.0.0.1', 23_456), 17))),
+        ('lab2 HEARTBEAT', ('HEARTBEAT', (identity, 17))),
+        ('lab2 group reply', peers),
+        ('lab2 SNAPSHOT', ('SNAPSHOT', 18, peers)),
+        ('lab2 DELTA', ('DELTA', 18, {identity: ('127.0.0.1', 23_456)}, [(41, 4_000_001)])),
+        ('lab2 ELECTION', ('ELECTION', peers)),
+        ('lab2 OK', ('OK', None)),
+        ('lab2 COORDINATOR', ('COORDINATOR', peers)),
+        ('lab4 RPC', ('find_successor', 17, None)),
+        ('lab4 reply', 23),
+    ]
+
+
+def per_call(function, argument):
+    """
+    :return: seconds per call of function(argument)
+    """
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < MIN_SECONDS:
+        for _ in range(10):
+            function(argument)
+        count += 10
+        elapsed = time.perf_counter() - start
+    return elapsed / count
+
+
+def main(size):
+    print('{:<18} {:>9} {:>9} {:>11} {:>11} {:>11} {:>11}'.format(
+        'message', 'pickle B', 'wire B', 'pickle enc', 'wire enc', 'pickle dec', 'wire dec'))
+    for name, message in messages(size):
+        pickled, binary = wire.encode(message, False), wire.encode(message)
+        assert wire.decode(binary) == message, name
+        print('{:<18} {:>9} {:>9} {:>10.2f}u {:>10.2f}u {:>10.2f}u {:>10.2f}u'.format(
+            name, len(pickled), len(binary),
+            per_call(lambda m: wire.encode(m, False), message) * 1e6, per_call(wire.encode, message) * 1e6,
+            per_call(lambda b: wire.decode(b, allow_pickle=True), pickled) * 1e6, per_call(wire.decode, binary) * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else GROUP_SIZE)
@@ -0,0 +1,316 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Deterministic, in-process simulator for the Lab2 election.
+
+Runs any number of real Lab2 state machines in virtual time over an in-memory transport, with configurable message
+latency, jitter and loss and a schedule of crashes, and reports how long the group took to settle on the right
+leader, and how many messages and bytes that took. No sockets, threads or GCD are involved, and the same seed always
+gives the same run, so protocol changes can be compared offline at sizes nobody would launch as real processes.
+
+Messages between a pair of peers are delivered in the order they were sent (as over the engine's persistent TCP
+connections) unless they are lost. A message to a crashed peer is not delivered; the sender is told the peer is
+unreachable one round trip later, like a refused connection.
+
+Since the leader keeps sending ALIVE messages, a run ends once every crash has happened and the group has agreed on
+the right leader for QUIET seconds. With crashes, failover_ms is how long after the last one that agreement came.
+
+Usage: python election_sim.py [--nodes N ...] [--mode bully|modified ...] [--scenario startup|one] [--latency S]
+                              [--jitter S] [--loss P]
+                              [--dead K] [--crash T ...] [--seed N] [--until S] [--max-messages N]
+"""
+import argparse
+import collections
+import heapq
+import itertools
+import json
+import random
+
+import wire
+from framing import HEADER
+from lab2 import ELECTION_MODES, Lab2, State
+from peer_engine import Timer
+
+LATENCY = 0.001  # seconds for a message to reach its peer
+JITTER = 0.0005  # up to this much more, at random
+UNTIL = 60.0  # seconds of virtual time to simulate at most
+MAX_MESSAGES = 250_000  # messages to simulate at most (the plain bully storm grows much faster than n squared)
+QUIET = 2.0  # seconds the group must stay settled on the right leader before a run ends
+
+
+class Network(object):
+    """
+    Virtual clock, event queue and message delivery shared by all the simulated peers.
+    """
+
+    def __init__(self, latency=LATENCY, jitter=JITTER, loss=0.0, seed=0):
+        """
+        :param latency: seconds for a message to reach its peer
+        :param jitter: up to this many seconds more, at random
+        :param loss: probability that a message is lost
+        :param seed: seed for the jitter and loss
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.events = []  # heap of (when, sequence, Timer)
+        self.sequence = itertools.count()
+        self.nodes = {}  # Lab2 indexed by identity
+        self.crashed = set()
+        self.arrivals = {}  # time the latest message from sender to receiver arrives, indexed by (sender, receiver)
+        self.messages = 0
+        self.bytes = 0
+        self.by_protocol = collections.Counter()
+        self.lost = 0
+        self.sizes = {}  # message size by (protocol, peer map size)
+        self.on_change = None  # called with the identity of every node after it has handled an event
+
+    def schedule(self, delay, identity, callback, *args):
+        """
+        Run callback(*args) for the given node after delay seconds of virtual time (unless it has crashed by then).
+
+        :return: Timer that can be cancelled
+        """
+        timer = Timer(self.now + delay, callback, args)
+        timer.identity = identity
+        heapq.heappush(self.events, (timer.when, next(self.sequence), timer))
+        return timer
+
+    def send(self, sender, receiver, message):
+        """
+        Carry a message from one node to another.
+        """
+        if sender in self.crashed:
+            return
+        self.messages += 1
+        self.bytes += self.size(message)
+        self.by_protocol[message[0]] += 1
+        if receiver in self.crashed or receiver not in self.nodes:
+            self.schedule(2 * self.latency, sender, self.nodes[sender].peer_unreachable, receiver)
+            return
+        if self.loss and self.random.random() < self.loss:
+            self.lost += 1
+            return
+        arrival = self.now + self.latency + self.jitter * self.random.random()
+        arrival = max(arrival, self.arrivals.get((sender, receiver), 0.0))  # the connection keeps them in order
+        self.arrivals[(sender, receiver)] = arrival
+        self.schedule(arrival - self.now, receiver, self.nodes[receiver].handle_message, message)
+
+    def size(self, message):
+        """
+        Bytes the message takes on the wire (frame header included). Peer maps encode to 12 bytes a member, so
+        each shape of message is only encoded once.
+        """
+        protocol, (sender, data) = message
+        if type(data) is not dict:
+            return HEADER.size + len(wire.encode(message))
+        key = (protocol, len(data))
+        if key not in self.sizes:
+            self.sizes[key] = HEADER.size + len(wire.encode((protocol, (sender, data))))
+        return self.sizes[key]
+
+    def crash(self, identity):
+        """
+        Stop a node: it handles nothing more and sends nothing more.
+        """
+        self.crashed.add(identity)
+
+    def run(self, until=UNTIL, max_messages=MAX_MESSAGES, done=None):
+        """
+        Process events in time order until there are none left, the virtual clock passes until, max_messages
+        have been sent, or done() says there is nothing more to see.
+
+        :return: False if it stopped because of max_messages
+        """
+        while self.events and self.events[0][0] <= until:
+            if self.messages >= max_messages:
+                return False
+            if done is not None and done():
+                return True
+            when, _, timer = heapq.heappop(self.events)
+            if timer.cancelled or timer.identity in self.crashed:
+                continue
+            self.now = when
+            timer.callback(*timer.args)
+            if self.on_change is not None and timer.identity is not None:
+                self.on_change(timer.identity)
+        return True
+
+
+class SimTransport(object):
+    """
+    The part of PeerEngine that Lab2 uses, delivering through a Network instead of sockets.
+    """
+
+    def __init__(self, network, identity, address):
+        self.network = network
+        self.identity = identity
+        self.address = address
+
+    def send(self, identity, address, message):
+        self.network.send(self.identity, identity, message)
+
+    def call_soon(self, callback, *args):
+        self.network.schedule(0.0, self.identity, callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        return self.network.schedule(delay, self.identity, callback, *args)
+
+    def time(self):
+        return self.network.now
+
+    def start(self):
+        pass
+
+
+class Simulation(object):
+    """
+    One election among n simulated peers.
+
+    >>> result = Simulation(10, seed=1).run()
+    >>> result['converged'], result['leader'] == result['expected_leader']
+    (True, True)
+    >>> result = Simulation(100, scenario='one', dead=3, election_mode='modified').run()
+    >>> result['converged'], result['messages_by_type']  # the three dead peers are skipped, one after the other
+    (True, {'ALIVE': 396, 'COORDINATOR': 99, 'ELECTION': 4, 'GRANT': 1, 'OK': 1})
+    >>> result = Simulation(100, election_mode='modified').run()  # every peer starts an election at once
+    >>> counts = result['messages_by_type']
+    >>> result['converged'], counts['ELECTION'], sum(counts.values()) - counts['ALIVE'] < 6 * 100  # not ~100**2 / 2
+    (True, 99, True)
+    >>> result = Simulation(10, scenario='one', crashes=[1.0], election_mode='modified').run()
+    >>> result['converged'], result['leader'] == result['expected_leader'], result['failover_ms'] < 1500
+    (True, True, True)
+    """
+
+    def __init__(self, n, scenario='startup', dead=0, crashes=(), latency=LATENCY, jitter=JITTER, loss=0.0, seed=0,
+                 election_mode='bully'):
+        """
+        :param n: number of peers
+        :param scenario: 'startup' for every peer starting an election within the first 10 ms (as when the group
+                         forms), 'one' for just the weakest peer starting one (as when it notices the leader is gone)
+        :param dead: number of the strongest peers that are down from the start (but still in everyone's peers)
+        :param crashes: virtual times at which the strongest peer still up crashes
+        :param latency, jitter, loss, seed: see Network
+        :param election_mode: 'bully' or 'modified' (see Lab2.start_election)
+        """
+        Lab2.verbose = False
+        self.network = Network(latency, jitter, loss, seed)
+        self.network.on_change = self.changed
+        rng = random.Random(seed)
+        days = rng.sample(range(1, 366), min(n, 365)) + [rng.randint(1, 365) for _ in range(n - 365)]
+        peers = {(days[i], 1_000_000 + i): ('127.0.0.1', 10_000 + i) for i in range(n)}
+        for identity, address in peers.items():
+            node = Lab2(None, 0, identity[0], identity[1], SimTransport(self.network, identity, address), election_mode)
+            node.set_peers(peers)
+            node.group_version = 0
+            self.network.nodes[identity] = node
+        self.ranked = sorted(peers)  # strongest first
+        for identity in self.ranked[:dead]:
+            self.network.crash(identity)
+        for when in crashes:
+            self.network.schedule(when, None, self.crash_strongest)
+        self.last_crash = max(crashes, default=0.0)  # time of the last scheduled crash
+        self.crashed_at = None  # time of the latest crash so far
+        nodes = [identity for identity in self.ranked if identity not in self.network.crashed]
+        if scenario == 'startup':
+            for identity in nodes:
+                self.network.schedule(0.01 * rng.random(), identity, self.network.nodes[identity].start_election)
+        else:
+            self.network.schedule(0.0, nodes[-1], self.network.nodes[nodes[-1]].start_election)
+        self.scenario = scenario
+        self.expected = None
+        self.unsettled = set()
+        self.settled_at = None
+        self.expect()
+
+    def expect(self):
+        """
+        Work out who should win now, and which live nodes do not agree yet.
+        """
+        live = [identity for identity in self.ranked if identity not in self.network.crashed]
+        self.expected = live[0] if live else None
+        self.unsettled = {identity for identity in live if not self.settled(identity)}
+        self.settled_at = self.network.now if not self.unsettled else None
+
+    def settled(self, identity):
+        node = self.network.nodes[identity]
+        return node.state == State.IDLE and node.leader == self.expected
+
+    def changed(self, identity):
+        """
+        Keep track of when the last live node came to agree on the expected leader.
+        """
+        if identity in self.network.crashed:
+            return
+        if self.settled(identity):
+            self.unsettled.discard(identity)
+            if not self.unsettled and self.settled_at is None:
+                self.settled_at = self.network.now
+        else:
+            self.unsettled.add(identity)
+            self.settled_at = None
+
+    def crash_strongest(self):
+        live = [identity for identity in self.ranked if identity not in self.network.crashed]
+        if live:
+            self.network.crash(live[0])
+        self.crashed_at = self.network.now
+        self.expect()
+
+    def done(self):
+        """
+        :return: True once every crash has happened and the group has agreed on the right leader for QUIET seconds
+        """
+        now = self.network.now
+        return now >= self.last_crash and self.settled_at is not None and now - self.settled_at >= QUIET
+
+    def run(self, until=UNTIL, max_messages=MAX_MESSAGES):
+        """
+        :return: dict of results
+        """
+        finished = self.network.run(until, max_messages, self.done)
+        network = self.network
+        leaders = collections.Counter(network.nodes[identity].leader for identity in network.nodes
+                                      if identity not in network.crashed)
+        leader = leaders.most_common(1)[0][0] if leaders else None
+        converged = finished and self.settled_at is not None
+        failover = None
+        if converged and self.crashed_at is not None:
+            failover = round((self.settled_at - self.crashed_at) * 1000, 3)
+        return {'nodes': len(network.nodes), 'scenario': self.scenario, 'crashed': len(network.crashed),
+                'finished': finished, 'converged': converged, 'expected_leader': self.expected, 'leader': leader,
+                'time_to_leader_ms': round(self.settled_at * 1000, 3) if converged else None, 'failover_ms': failover,
+                'messages': network.messages, 'bytes': network.bytes, 'lost': network.lost,
+                'messages_by_type': dict(sorted(network.by_protocol.items()))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate Lab2 elections in virtual time.')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 20], help='group sizes to simulate')
+    parser.add_argument('--mode', choices=ELECTION_MODES, nargs='+', default=['bully'], help='election modes')
+    parser.add_argument('--scenario', choices=('startup', 'one'), default='startup')
+    parser.add_argument('--latency', type=float, default=LATENCY, help='seconds for a message to arrive')
+    parser.add_argument('--jitter', type=float, default=JITTER, help='up to this many seconds more')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability a message is lost')
+    parser.add_argument('--dead', type=int, default=0, help='strongest peers down from the start')
+    parser.add_argument('--crash', type=float, nargs='*', default=[], help='times to crash the strongest live peer')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-messages', type=int, default=MAX_MESSAGES, help='give up after this many messages')
+    parser.add_argument('--until', type=float, default=UNTIL, help='seconds of virtual time to simulate at most')
+    args = parser.parse_args()
+    results = []
+    for mode in args.mode:
+        for n in args.nodes:
+            result = Simulation(n, args.scenario, args.dead, args.crash, args.latency, args.jitter, args.loss,
+                                args.seed, mode).run(args.until, args.max_messages)
+            results.append(dict(mode=mode, **result))
+    print(json.dumps(results, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Phi accrual failure detector (Hayashibara et al.), used by Lab2 peers to notice that the leader has died.
+
+Instead of a fixed timeout, the detector learns the distribution of the times between heartbeats and reports a
+suspicion level phi: the -log10 of the probability that a heartbeat this late would still arrive. phi = 1 means a 10%
+chance that we are wrong to give up on the peer, phi = 8 about one in a hundred million. A slow, jittery network
+raises the mean and spread of the intervals and so the detection time, a fast, steady one lowers it, with the same
+threshold.
+"""
+import collections
+import math
+
+WINDOW = 100  # most recent heartbeat intervals to learn from
+THRESHOLD = 8.0  # phi above which the peer is considered dead
+MIN_STD = 0.1  # seconds; floor on the standard deviation so a perfectly regular peer is not suspected instantly
+ACCEPTABLE_PAUSE = 0.0  # seconds of extra lateness always tolerated (e.g. for garbage collection pauses)
+
+
+class PhiAccrualDetector(object):
+    """
+    Suspicion level for one monitored peer, from its heartbeat arrival times.
+
+    >>> detector = PhiAccrualDetector(first_interval=1.0)
+    >>> for t in range(10):
+    ...     detector.heartbeat(float(t))
+    >>> detector.phi(9.5) < 1.0, detector.available(10.2), detector.available(12.0)
+    (True, True, False)
+    """
+
+    def __init__(self, first_interval, window=WINDOW, threshold=THRESHOLD, min_std=MIN_STD,
+                 acceptable_pause=ACCEPTABLE_PAUSE):
+        """
+        :param first_interval: expected seconds between heartbeats, used until real ones have been seen
+        :param window: most recent heartbeat intervals to learn from
+        :param threshold: phi above which the peer is considered dead
+        :param min_std: floor on the standard deviation of the intervals
+        :param acceptable_pause: seconds of extra lateness always tolerated
+        """
+        self.threshold = threshold
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        self.intervals = collections.deque(maxlen=window)
+        self.total = 0.0  # sum of self.intervals
+        self.squares = 0.0  # sum of their squares
+        self.last = None  # time of the latest heartbeat
+        # seed with a plausible spread so the first few heartbeats do not make phi jumpy
+        self.record(first_interval - first_interval / 4)
+        self.record(first_interval + first_interval / 4)
+
+    def record(self, interval):
+        if len(self.intervals) == self.intervals.maxlen:
+            old = self.intervals[0]
+            self.total -= old
+            self.squares -= old * old
+        self.intervals.append(interval)
+        self.total += interval
+        self.squares += interval * interval
+
+    def heartbeat(self, now):
+        """
+        A heartbeat from the peer arrived.
+
+        :param now: arrival time (on the same clock phi is asked about)
+        """
+        if self.last is not None:
+            self.record(now - self.last)
+        self.last = now
+
+    def start(self, now):
+        """
+        Start the clock without counting an interval (e.g. when we begin monitoring a new peer).
+        """
+        self.last = now
+
+    def phi(self, now):
+        """
+        :param now: current time
+        :return: suspicion level; 0 before the first heartbeat
+        """
+        if self.last is None:
+            return 0.0
+        n = len(self.intervals)
+        mean = self.total / n
+        std = max(self.min_std, math.sqrt(max(0.0, self.squares / n - mean * mean)))
+        y = (now - self.last - mean - self.acceptable_pause) / std
+        # logistic approximation of the normal distribution's tail, accurate to about 1e-4 (as used by Akka)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if y > 0:
+            return -math.log10(e / (1.0 + e)) if e > 1e-300 else float('inf')
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+    def available(self, now):
+        """
+        :return: False once phi has passed the threshold
+        """
+        return self.phi(now) < self.threshold
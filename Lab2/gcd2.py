@@ -4,12 +4,16 @@ This is free and unencumbered software released into the public domain.
 :Authors: Kevin Lundeen
 :Version: f19-02
 """
-import pickle
+import itertools
 import socket
 import socketserver
 import sys
+import time
 
-BUF_SZ = 1024  # tcp receive buffer size
+import framing
+import wire
+from groups import DEFAULT_GROUP, Groups
+from selector_server import READ_TIMEOUT, SelectorServer
 
 
 class GroupCoordinatorDaemon(socketserver.BaseRequestHandler):
@@ -17,47 +21,127 @@ class GroupCoordinatorDaemon(socketserver.BaseRequestHandler):
     A Group Coordinator Daemon (GCD) which will respond with a list of potential group members to a text message JOIN
     with list of group members to contact.
 
-    We respond with a dictionary of group members.
+    We respond with a dictionary of group members, or, to members that tell us which version of the group they
+    already have, with just the changes since then.
+
+    One GCD serves any number of independent groups; a JOIN may name the group to join (otherwise it joins
+    DEFAULT_GROUP). Each group has its own lock, so requests for different groups do not wait on each other.
+
+    Members must send a HEARTBEAT at least every LEASE_TIME seconds to stay in the group, so the lists we hand out
+    only contain live listeners.
     """
 
-    # global group data structures
-    listeners_by_pid = {}  # listener address indexed by process id (as returned from JOIN message)
-    pids_by_listener = {}  # process ids indexed by listener address (only one pid for each unique (host, port))
-    pids_by_student = {}  # process ids indexed by student id (each student only allowed one at a time)
+    # global registry of groups (each with its membership indexes and versioned change log)
+    groups = Groups()
 
     # we want to restrict all listeners to be on the same host as the GCD
     localhost_ip = socket.gethostbyname('localhost')
 
     def handle(self):
         """
-        Handles the incoming messages - expects only 'JOIN' messages
+        Handles the incoming messages - expects only 'JOIN' and 'HEARTBEAT' messages. With a thread per connection
+        we answer as many as the client pipelines; the serial server answers one and hangs up, so a client that keeps
+        its connection open cannot hold up everyone else.
         """
         #print(self.request.getsockname())
-        raw = self.request.recv(BUF_SZ)  # self.request is the TCP socket connected to the client
+        self.request.settimeout(READ_TIMEOUT)  # self.request is the TCP socket connected to the client
+        frames = framing.recv_frames(self.request, framing.MAX_REQUEST)
+        if not isinstance(self.server, socketserver.ThreadingMixIn):
+            frames = itertools.islice(frames, 1)
+        try:
+            for raw in frames:
+                framing.send_frame(self.request, self.respond(raw, self.client_address))
+        except (OSError, ValueError) as err:
+            print('dropped {}: {}'.format(self.client_address, err))
+        self.request.shutdown(socket.SHUT_RDWR)
+        self.request.close()
+
+    @staticmethod
+    def respond(raw, client_address):
+        """
+        Builds the response to a raw request (shared by the socketserver and selector serving modes).
+
+        :param raw: bytes received from the client
+        :param client_address: (host, port) of the client
+        :return: bytes to send back to the client (in the same encoding as the request)
+        """
+        binary = wire.is_binary(raw)
         try:
-            message = pickle.loads(raw)
-        except Exception:
-            response = bytes('Expected a pickled message, got ' + str(raw)[:100] + '\n', 'utf-8')
+            message = wire.decode(raw)
+        except ValueError:
+            response = bytes('Expected a wire-encoded message, got ' + str(raw)[:100] + '\n', 'utf-8')
         else:
             try:
-                response_data = self.handle_join(message)
+                response = GroupCoordinatorDaemon.handle_message(message, binary)
             except ValueError as err:
-                response_data = str(err)
-            response = pickle.dumps(response_data)
-        self.request.sendall(response)
-        self.request.shutdown(socket.SHUT_RDWR)
-        self.request.close()
+                response = wire.encode(str(err), binary)
+        return response
+
+    @staticmethod
+    def handle_message(message, binary=True):
+        """
+        Process this JOIN or HEARTBEAT message.
+
+        :param message: ('JOIN', ...) or ('HEARTBEAT', ...)
+        :param binary: reply in the binary wire encoding (False to pickle)
+        :return: encoded response
+        :raises ValueError: if the message cannot be validated
+        """
+        now = time.monotonic()
+        if type(message) is tuple and len(message) == 2 and message[0] == 'HEARTBEAT':
+            return GroupCoordinatorDaemon.handle_heartbeat(message[1], now, binary)
+        return GroupCoordinatorDaemon.handle_join(message, now, binary)
+
+    @staticmethod
+    def handle_heartbeat(message_data, now, binary=True):
+        """
+        Renew a member's lease and bring it up to date with any changes to the group.
+
+        :param message_data: ((days_to_bd, su_id), since_version) or ((days_to_bd, su_id), since_version, group_name)
+        :param now: time.monotonic() of the request
+        :param binary: reply in the binary wire encoding (False to pickle)
+        :return: encoded ('SNAPSHOT', version, listeners_by_pid) or ('DELTA', version, added, evicted)
+        :raises ValueError: if the message cannot be validated or the sender is no longer a member
+        """
+        try:
+            if len(message_data) == 3:
+                process_id, since_version, group_name = message_data
+            else:
+                process_id, since_version = message_data
+                group_name = DEFAULT_GROUP
+            days_to_birthday, student_id = process_id
+        except (ValueError, TypeError):
+            raise ValueError('Malformed message data, expected ((days_to_bd, su_id), since_version)')
+        if not (type(days_to_birthday) is int and type(student_id) is int):
+            raise ValueError('Malformed process id, expected (days_to_next_birthday, student_id)')
+        process_id = (days_to_birthday, student_id)
+        if not (since_version is None or type(since_version) is int):
+            raise ValueError('Malformed group version, expected an int or None')
+        with GroupCoordinatorDaemon.groups.locked(group_name, now) as group:
+            if group is not None:
+                GroupCoordinatorDaemon.expire(group, group_name, now)
+            if group is None or not group.renew(process_id, now):
+                raise ValueError('Not a member (lease lapsed?), JOIN again')
+            return group.encoded_reply(since_version, binary=binary)
 
     @staticmethod
-    def handle_join(message):
+    def handle_join(message, now=None, binary=True):
         """
-        Process this JOIN message by adding new member into the group data structures.
+        Process this JOIN message by adding new member into the group data structures (creating the group if need be).
         Also do some validation:
         - of the right form
-        - listener is on localhost (or equivalent)
-
-        :param message: ('JOIN', ((days_to_bd, su_id), (host, port)))
-        :return: GroupCoordinatorDaemon.listeners_by_pid
+        - listener is on localhost or its IPv4 address (names other than localhost are not looked up)
+
+        A member that sends the group version it last received gets back only the changes since then.
+        The member is given a fresh lease.
+
+        :param message: ('JOIN', ((days_to_bd, su_id), (host, port))) or
+                        ('JOIN', ((days_to_bd, su_id), (host, port), since_version)) or
+                        ('JOIN', ((days_to_bd, su_id), (host, port), since_version, group_name))
+        :param now: time.monotonic() of the request, if the caller already has it
+        :param binary: reply in the binary wire encoding (False to pickle)
+        :return: encoded listeners_by_pid of the group when no since_version was given, otherwise
+                 encoded ('SNAPSHOT', version, listeners_by_pid) or ('DELTA', version, added, evicted)
         :raises ValueError: if the message cannot be validated
         """
         try:
@@ -71,7 +155,15 @@ class GroupCoordinatorDaemon(socketserver.BaseRequestHandler):
 
         # pull apart message_data
         try:
-            process_id, listener = message_data
+            if len(message_data) == 4:
+                process_id, listener, since_version, group_name = message_data
+                versioned = True
+            elif len(message_data) == 3:
+                process_id, listener, since_version = message_data
+                group_name, versioned = DEFAULT_GROUP, True
+            else:
+                process_id, listener = message_data
+                since_version, group_name, versioned = None, DEFAULT_GROUP, False
             listen_host, listen_port = listener
             days_to_birthday, student_id = process_id
         except (ValueError, TypeError):
@@ -79,46 +171,75 @@ class GroupCoordinatorDaemon(socketserver.BaseRequestHandler):
         if not (type(days_to_birthday) is int and type(student_id) is int and
                 0 < days_to_birthday < 366 and 1_000_000 <= student_id < 10_000_000):
             raise ValueError('Malformed process id, expected (days_to_next_birthday, student_id)')
-
-        # make sure that listen_host is localhost or equivalent
-        try:
-            listen_ip = socket.gethostbyname(listen_host)
-        except Exception as err:
-            raise ValueError(str(err))
+        if not (since_version is None or type(since_version) is int):
+            raise ValueError('Malformed group version, expected an int or None')
+
+        # make sure that listen_host is localhost or equivalent, without a DNS lookup to hold up the other clients
+        if listen_host == 'localhost':
+            listen_ip = GroupCoordinatorDaemon.localhost_ip
+        elif wire.packed_ipv4(listen_host) is not None:
+            listen_ip = listen_host
+        else:
+            raise ValueError('Listener host must be localhost or a dotted-quad IPv4 address')
         if not (type(listen_port) is int and 0 < listen_port < 65_536):
             raise ValueError('Invalid port number')
         if listen_ip != GroupCoordinatorDaemon.localhost_ip:
             raise ValueError('Only local group members currently allowed')
         listener = (listen_ip, listen_port)
 
-        # aliases for global dictionaries
-        students = GroupCoordinatorDaemon.pids_by_student
-        group = GroupCoordinatorDaemon.listeners_by_pid
-        listeners = GroupCoordinatorDaemon.pids_by_listener
+        now = time.monotonic() if now is None else now
+        with GroupCoordinatorDaemon.groups.locked(group_name, now, create=True) as group:
+            GroupCoordinatorDaemon.expire(group, group_name, now)
+            group.join(process_id, listener, now)
+            return group.encoded_reply(since_version, versioned, binary)
+
+    @staticmethod
+    def expire(group, group_name, now):
+        """
+        Evict members of the group whose lease has lapsed. Caller must hold group.lock.
+        """
+        evicted = group.expire(now)
+        if evicted:
+            print('lease lapsed for {} in group {!r}'.format(evicted, group_name))
+
 
-        # remove any old memberships for the same student
-        if student_id in students and students[student_id] != process_id:
-            old_pid = students[student_id]
-            del group[old_pid]
-        students[student_id] = process_id
+class ThreadedServer(socketserver.ThreadingTCPServer):
+    """
+    Thread-per-connection server with a listen backlog big enough for a burst of JOINs.
+    """
+    request_queue_size = 1024  # socketserver's default of 5 drops connections when many members JOIN at once
+    daemon_threads = True
 
-        # add this entry into group membership
-        group[process_id] = listener
 
-        # also remove any old memberships which claimed this same listener (host, port) pair
-        if listener in listeners and listeners[listener] != process_id:
-            old_pid = listeners[listener]
-            if old_pid in group:
-                del group[old_pid]
-        listeners[listener] = process_id
+def serve(port, mode='serial', state_dir=None):
+    """
+    Run the GCD on the given port.
 
-        return group
+    :param port: port to listen on
+    :param mode: 'serial' for one-request-at-a-time socketserver, 'threaded' for a thread per connection,
+                 'select' for the event-driven server
+    :param state_dir: directory to persist the group in (and restore it from at startup), if any
+    """
+    if state_dir is not None:
+        GroupCoordinatorDaemon.groups = Groups(state_dir)
+        print('restored {} members in {} groups from {}'.format(GroupCoordinatorDaemon.groups.members(),
+                                                               len(GroupCoordinatorDaemon.groups), state_dir))
+    if mode == 'select':
+        with SelectorServer(('', port), GroupCoordinatorDaemon.respond) as server:
+            server.serve_forever()
+    elif mode == 'threaded':
+        with ThreadedServer(('', port), GroupCoordinatorDaemon) as server:
+            server.serve_forever()
+    else:
+        with socketserver.TCPServer(('', port), GroupCoordinatorDaemon) as server:
+            server.serve_forever()
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python gcd2.py GCDPORT")
+    args = [arg for arg in sys.argv if arg != '--allow-pickle']
+    if not 2 <= len(args) <= 4 or args[2:3] not in ([], ['serial'], ['threaded'], ['select']):
+        print("Usage: python gcd2.py GCDPORT [serial|threaded|select [STATE_DIR]] [--allow-pickle]")
         exit(1)
-    port = int(sys.argv[1])
-    with socketserver.TCPServer(('', port), GroupCoordinatorDaemon) as server:
-        server.serve_forever()
+    wire.ALLOW_PICKLE = len(args) < len(sys.argv)  # unpickling network data is unsafe: opt-in
+    port = int(args[1])
+    serve(port, *args[2:])
@@ -0,0 +1,189 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Load test for the group coordinators (Lab1/gcd.py and Lab2/gcd2.py).
+
+Starts the chosen coordinator on localhost in the chosen serving mode, drives it with concurrent synthetic JOIN clients
+(each JOIN on its own connection, like a real member) and prints throughput, latency percentiles and error counts as
+JSON, so serving modes and encodings can be compared on the same footing.
+
+With --groups N (gcd2 only) the clients are spread round-robin over N named groups, to compare a coordinator
+serving one busy group with one serving many independent groups.
+
+With --encoding pickle the coordinator is started with --allow-pickle, since it refuses pickle otherwise.
+
+Usage: python gcd_loadtest.py [--coordinator gcd|gcd2] [--mode serial|threaded|select] [--encoding binary|pickle]
+                              [--clients N] [--joins N] [--groups N]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import wire
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COORDINATORS = {'gcd': os.path.join(HERE, '..', 'Lab1', 'gcd.py'), 'gcd2': os.path.join(HERE, 'gcd2.py')}
+STARTUP_TIMEOUT = 10.0  # seconds to wait for the coordinator to start listening
+REQUEST_TIMEOUT = 10.0  # seconds before a JOIN counts as an error
+
+errors_lock = threading.Lock()  # clients all count their errors in the same dict
+
+
+def join_message(coordinator, client, attempt, groups=0):
+    """
+    A valid JOIN for the given coordinator from the given synthetic client.
+
+    :param coordinator: 'gcd' or 'gcd2'
+    :param client: client number (each gets its own student id and listener port)
+    :param attempt: JOIN number for this client
+    :param groups: number of named groups the clients are spread over (0 to not name a group)
+    :return: JOIN message
+    """
+    if coordinator == 'gcd':
+        return 'JOIN'
+    process_id = (1 + (client + attempt) % 365, 1_000_000 + client)
+    if groups:
+        return 'JOIN', (process_id, ('localhost', 10_000 + client), None, 'group{}'.format(client % groups))
+    return 'JOIN', (process_id, ('localhost', 10_000 + client))
+
+
+def client(address, coordinator, number, joins, latencies, errors, binary=True, groups=0):
+    """
+    One synthetic member sending its JOINs back to back (runs in its own thread).
+
+    :param binary: use the binary wire encoding (False to pickle, like an old member)
+    :param groups: number of named groups the clients are spread over (0 to not name a group)
+    :param latencies: list to append each successful JOIN's latency (seconds) to
+    :param errors: dict of error name -> count to add failures to
+    """
+    for attempt in range(joins):
+        message = join_message(coordinator, number, attempt, groups)
+        start = time.perf_counter()
+        try:
+            with socket.create_connection(address, timeout=REQUEST_TIMEOUT) as sock:
+                reply = wire.request(sock, message, binary)
+            if type(reply) is str:
+                raise ValueError(reply)
+        except Exception as err:
+            name = type(err).__name__
+            with errors_lock:
+                errors[name] = errors.get(name, 0) + 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile.
+
+    >>> percentile([1, 2, 3, 4], 0.5)
+    2
+    >>> percentile([1, 2, 3, 4], 0.99)
+    4
+
+    :param ordered: sorted, non-empty list
+    :param fraction: 0 < fraction <= 1
+    """
+    rank = max(1, -(-len(ordered) * fraction // 1))  # ceiling
+    return ordered[int(rank) - 1]
+
+
+def start_coordinator(coordinator, mode, port, allow_pickle=False):
+    """
+    Launch the coordinator and wait until it accepts connections.
+
+    :param allow_pickle: start it with --allow-pickle
+
+    :return: the subprocess.Popen
+    :raises RuntimeError: if it does not start listening in time
+    """
+    script = COORDINATORS[coordinator]
+    process = subprocess.Popen([sys.executable, os.path.basename(script), str(port), mode] +
+                               (['--allow-pickle'] if allow_pickle else []),
+                               cwd=os.path.dirname(script), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('{} exited with status {}'.format(coordinator, process.returncode))
+        try:
+            socket.create_connection(('localhost', port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('{} did not start listening on port {}'.format(coordinator, port))
+
+
+def free_port():
+    """
+    :return: a port number nobody is listening on right now
+    """
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def run(coordinator, mode, clients, joins, port=None, encoding='binary', groups=0):
+    """
+    Run one load test.
+
+    :return: dict of results
+    """
+    port = port or free_port()
+    binary = encoding == 'binary'
+    wire.ALLOW_PICKLE = not binary  # so we can read the coordinator's pickled replies
+    process = start_coordinator(coordinator, mode, port, allow_pickle=not binary)
+    latencies, errors = [], {}
+    threads = [threading.Thread(target=client,
+                                args=(('localhost', port), coordinator, n, joins, latencies, errors, binary, groups))
+               for n in range(clients)]
+    try:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies.sort()
+    result = {'coordinator': coordinator, 'mode': mode, 'encoding': encoding, 'groups': groups, 'clients': clients,
+              'joins_per_client': joins, 'elapsed_s': round(elapsed, 4), 'ok': len(latencies), 'errors': sum(errors.values()),
+              'errors_by_type': errors, 'throughput_per_s': round(len(latencies) / elapsed, 1)}
+    if latencies:
+        for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+            result[name + '_ms'] = round(percentile(latencies, fraction) * 1000, 3)
+        result['max_ms'] = round(latencies[-1] * 1000, 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test a group coordinator on localhost.')
+    parser.add_argument('--coordinator', choices=sorted(COORDINATORS), default='gcd2')
+    parser.add_argument('--mode', choices=('serial', 'threaded', 'select'), default='serial')
+    parser.add_argument('--encoding', choices=('binary', 'pickle'), default='binary')
+    parser.add_argument('--clients', type=int, default=100, help='concurrent synthetic members')
+    parser.add_argument('--joins', type=int, default=10, help='JOINs sent by each member')
+    parser.add_argument('--groups', type=int, default=0, help='named groups to spread the members over (gcd2 only)')
+    parser.add_argument('--port', type=int, help='port for the coordinator (default: any free port)')
+    args = parser.parse_args()
+    if args.coordinator == 'gcd' and args.mode == 'threaded':
+        parser.error('gcd has no threaded mode')
+    if args.coordinator == 'gcd' and args.groups:
+        parser.error('gcd has no named groups')
+    print(json.dumps(run(args.coordinator, args.mode, args.clients, args.joins, args.port, args.encoding, args.groups),
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Registry of the independent, named groups one Group Coordinator Daemon looks after.
+
+Each group is its own Membership with its own lock, so JOINs to different groups never wait on each other; the
+registry's lock is only held for the dictionary lookup. Memory stays bounded: a group nobody has sent anything to for
+IDLE_TIME seconds (longer than a lease, so all its members have lapsed) is dropped, and at most MAX_GROUPS groups
+exist at once. With a state directory, a dropped group's journal is deleted too (so a restart does not bring it back),
+and since every live group keeps its journal open, the number of groups is also capped below the open file limit.
+
+A dropped group that comes back starts in a new epoch (see membership), so members still holding the old group are
+sent a full snapshot instead of a delta against a group that no longer exists.
+"""
+import collections
+import contextlib
+import os
+import re
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+from journal import Journal
+from membership import LEASE_TIME, Membership
+
+DEFAULT_GROUP = 'default'  # group for JOINs that do not name one
+MAX_GROUPS = 10_000  # groups that may exist at once
+IDLE_TIME = 2 * LEASE_TIME  # seconds without a request after which an (empty) group is dropped
+GROUPS_DIR = 'groups'  # subdirectory of the state directory holding the journals of named groups
+NAME = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}')  # also safe to use as a directory name
+SPARE_FILES = 256  # file descriptors kept free of journals, for client connections and the like
+
+
+def journal_limit():
+    """
+    :return: most group journals we can keep open at once, or None if there is no way to tell
+    """
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return max(1, soft - SPARE_FILES)
+
+
+class Groups(object):
+    """
+    Named Membership groups with per-group locks, dropped when idle.
+
+    >>> groups = Groups()
+    >>> with groups.locked('red', now=0.0, create=True) as red:
+    ...     red.join((10, 1000000), ('127.0.0.1', 5000), now=0.0)
+    ...     red.join((20, 2000000), ('127.0.0.1', 5001), now=0.0)
+    >>> with groups.locked('blue', now=1.0, create=True) as blue:
+    ...     blue.join((10, 1000000), ('127.0.0.1', 5000), now=1.0)
+    >>> sorted(groups.groups), red.version & 0xffffffff, blue.version & 0xffffffff
+    (['blue', 'red'], 2, 1)
+    >>> groups.get('blue', now=IDLE_TIME + 0.5) is blue  # red has now been idle long enough to be dropped
+    True
+    >>> sorted(groups.groups), red.retired, red.version & 0xffffffff  # both of its members lapsed first
+    (['blue'], True, 4)
+    >>> with groups.locked('red', now=IDLE_TIME + 0.5, create=True) as new_red:  # a new red in a new epoch
+    ...     new_red.changes_since(red.version) is None
+    True
+    """
+
+    def __init__(self, state_dir=None, max_groups=MAX_GROUPS, idle_time=IDLE_TIME, lease_time=LEASE_TIME):
+        """
+        :param state_dir: directory to persist the groups in (and restore them from), if any
+        :param max_groups: groups that may exist at once (fewer with a state_dir, if the open file limit is lower)
+        :param idle_time: seconds without a request after which an empty group is dropped
+        :param lease_time: seconds a JOIN or HEARTBEAT keeps a member in its group
+        """
+        self.state_dir = state_dir
+        self.max_groups = max_groups
+        if state_dir is not None and journal_limit() is not None:
+            self.max_groups = min(max_groups, journal_limit())
+        self.idle_time = idle_time
+        self.lease_time = lease_time
+        self.groups = collections.OrderedDict()  # Membership by name, least recently used first
+        self.last_used = {}  # time.monotonic() of the latest request indexed by group name
+        self.lock = threading.Lock()  # guards the registry itself, never held while waiting for a group's lock
+        if state_dir is not None:
+            self.restore()
+
+    def restore(self):
+        """
+        Load every group persisted in the state directory.
+        """
+        now = time.monotonic()
+        names = [DEFAULT_GROUP]
+        groups_dir = os.path.join(self.state_dir, GROUPS_DIR)
+        if os.path.isdir(groups_dir):
+            names += sorted(name for name in os.listdir(groups_dir) if NAME.fullmatch(name) and name != DEFAULT_GROUP)
+        for name in names[:self.max_groups]:
+            self.groups[name] = self.create(name)
+            self.last_used[name] = now
+
+    def directory(self, name):
+        """
+        :return: directory holding the journal of the named group (the default group keeps the original layout)
+        """
+        if name == DEFAULT_GROUP:
+            return self.state_dir
+        return os.path.join(self.state_dir, GROUPS_DIR, name)
+
+    def create(self, name):
+        """
+        :return: a new Membership for the named group, restored from its journal if we keep one
+        """
+        journal = Journal(self.directory(name)) if self.state_dir is not None else None
+        return Membership(journal=journal, lease_time=self.lease_time)
+
+    def get(self, name, now, create=False):
+        """
+        Look up a group, dropping idle ones along the way.
+
+        :param name: group name
+        :param now: time.monotonic() of the request
+        :param create: make the group if it does not exist
+        :return: the group's Membership, or None if it does not exist and create is False
+        :raises ValueError: if the name is invalid or there are already max_groups groups
+        """
+        if type(name) is not str:
+            raise ValueError('Invalid group name, expected a str')
+        with self.lock:
+            self.drop_idle(now)
+            group = self.groups.get(name)
+            if group is None:
+                if not create:
+                    return None
+                if not NAME.fullmatch(name):
+                    raise ValueError('Invalid group name, expected up to 64 letters, digits, "_", "-" or "."')
+                if len(self.groups) >= self.max_groups:
+                    raise ValueError('Too many groups, try again later')
+                try:
+                    group = self.groups[name] = self.create(name)
+                except OSError as err:  # e.g. out of file descriptors after all; refuse this JOIN, keep serving
+                    raise ValueError('Cannot create group: {}'.format(err))
+            else:
+                self.groups.move_to_end(name)
+            self.last_used[name] = now
+            return group
+
+    @contextlib.contextmanager
+    def locked(self, name, now, create=False):
+        """
+        Hold the named group's lock (only that group's) for the body of a with statement.
+
+        :param name: group name
+        :param now: time.monotonic() of the request
+        :param create: make the group if it does not exist
+        :return: context manager giving the group's Membership, or None if it does not exist and create is False
+        :raises ValueError: as for get()
+        """
+        while True:
+            group = self.get(name, now, create)
+            if group is None:
+                yield None
+                return
+            with group.lock:
+                if not group.retired:  # otherwise it was dropped after we looked it up, so look again
+                    yield group
+                    return
+
+    def drop_idle(self, now):
+        """
+        Drop the least recently used groups that have been idle for idle_time and no longer have any members.
+        Caller must hold self.lock.
+
+        :param now: current time.monotonic()
+        """
+        while self.groups:
+            name, group = next(iter(self.groups.items()))
+            if now - self.last_used[name] < self.idle_time or not group.lock.acquire(blocking=False):
+                return  # everything after this was used more recently (or someone is using it right now)
+            try:
+                group.expire(now)
+                if group.listeners_by_pid:
+                    self.groups.move_to_end(name)  # still has members (only with a lease longer than idle_time)
+                    self.last_used[name] = now
+                    return
+                group.retired = True
+                if group.journal is not None:
+                    group.journal.remove()  # nothing left worth restoring
+                del self.groups[name]
+                del self.last_used[name]
+            finally:
+                group.lock.release()
+
+    def __len__(self):
+        return len(self.groups)
+
+    def members(self):
+        """
+        :return: total number of members across all groups (for reporting; not synchronized)
+        """
+        return sum(len(group.listeners_by_pid) for group in list(self.groups.values()))
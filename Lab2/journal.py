@@ -0,0 +1,238 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Crash-safe persistence of the coordinator's group membership.
+
+Every change to the group is appended to a journal of fixed-size, checksummed records as it happens. Every so often
+the whole group is written out as a compact snapshot (to a temporary file that is then renamed into place) and the
+journal is started afresh. At startup both files are memory-mapped and replayed in bulk, so a restarted coordinator is
+serving the full group again almost immediately instead of waiting for every member to re-JOIN at once.
+
+A torn record at the end of the journal (from a crash part way through a write) is detected by its checksum and cut off.
+"""
+import mmap
+import os
+import socket
+import struct
+import zlib
+
+JOURNAL_FILE = 'gcd2.journal'
+SNAPSHOT_FILE = 'gcd2.snapshot'
+COMPACT_EVERY = 10_000  # journal records between snapshots
+
+# journal record: version, op (1 = add, 0 = evict), days_to_birthday, student_id, ipv4, port, crc32 of the rest
+RECORD = struct.Struct('!QBHI4sHI')
+ADD, EVICT = 1, 0
+# snapshot: header (magic, version, member count), member records, crc32 of everything before it
+SNAPSHOT_HEADER = struct.Struct('!8sQI')
+SNAPSHOT_MAGIC = b'GCDSNAP1'
+MEMBER = struct.Struct('!HI4sH')
+CRC = struct.Struct('!I')
+
+
+class IpStrings(dict):
+    """
+    Memo of packed IPv4 address -> dotted string (members overwhelmingly share a handful of addresses).
+    """
+
+    def __missing__(self, packed):
+        ip = self[packed] = socket.inet_ntoa(packed)
+        return ip
+
+
+class Journal(object):
+    """
+    Append-only membership journal plus periodic snapshots, kept in one directory.
+
+    >>> import tempfile
+    >>> from membership import Membership
+    >>> directory = tempfile.mkdtemp()
+    >>> group = Membership(journal=Journal(directory))
+    >>> group.join((10, 1000000), ('127.0.0.1', 5000))
+    >>> group.join((11, 1000000), ('127.0.0.1', 5001))
+    >>> group.journal.close()
+    >>> restored = Membership(journal=Journal(directory))  # carries on in the same epoch, so deltas still apply
+    >>> restored.version == group.version, restored.listeners_by_pid
+    (True, {(11, 1000000): ('127.0.0.1', 5001)})
+    """
+
+    def __init__(self, directory, sync=False, compact_every=COMPACT_EVERY):
+        """
+        :param directory: where to keep the journal and snapshot (created if need be)
+        :param sync: fsync after every record (survives power loss, not just a crash of the process)
+        :param compact_every: number of journal records after which to take a snapshot
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.sync = sync
+        self.compact_every = compact_every
+        self.records = 0  # records in the journal since the last snapshot
+        self.file = None
+
+    def replay(self, membership):
+        """
+        Load the snapshot and the journal written since it into the given (empty) membership,
+        then open the journal for appending.
+
+        :param membership: Membership to restore into
+        """
+        members, version = self.read_snapshot()
+        for process_id, listener in members:
+            membership.listeners_by_pid[process_id] = listener
+        good_length = 0
+        for record_version, op, process_id, listener, end in self.read_journal():
+            good_length = end
+            self.records += 1
+            if record_version <= version:
+                continue  # already in the snapshot (we crashed between writing it and truncating the journal)
+            version = record_version
+            if op == ADD:
+                membership.listeners_by_pid[process_id] = listener
+            else:
+                membership.listeners_by_pid.pop(process_id, None)
+        for process_id, listener in membership.listeners_by_pid.items():
+            membership.pids_by_student[process_id[1]] = process_id
+            membership.pids_by_listener[listener] = process_id
+        if version:  # carry on with the persisted history (and its epoch); otherwise keep the new one we were given
+            membership.version = version
+        membership.first_version = membership.version + 1
+
+        self.file = open(self.journal_path, 'ab', buffering=0)
+        if self.file.tell() != good_length:
+            self.file.truncate(good_length)  # cut off a torn record
+            self.file.seek(good_length)
+
+    def read_snapshot(self):
+        """
+        :return: (list of (process_id, listener), version) from the snapshot file, or ([], 0) if there is none
+        :raises ValueError: if the snapshot is corrupt
+        """
+        if not os.path.exists(self.snapshot_path) or os.path.getsize(self.snapshot_path) == 0:
+            return [], 0
+        with open(self.snapshot_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                magic, version, count = SNAPSHOT_HEADER.unpack_from(view)
+                end = SNAPSHOT_HEADER.size + count * MEMBER.size
+                if magic != SNAPSHOT_MAGIC or len(view) != end + CRC.size or \
+                        CRC.unpack_from(view, end)[0] != zlib.crc32(view[:end]):
+                    raise ValueError('corrupt snapshot {}'.format(self.snapshot_path))
+                ips = IpStrings()
+                members = [((days, student), (ips[ip], port))
+                           for days, student, ip, port in MEMBER.iter_unpack(view[SNAPSHOT_HEADER.size:end])]
+            finally:
+                view.release()
+        return members, version
+
+    def read_journal(self):
+        """
+        Generate the intact records in the journal file.
+
+        :return: generator of (version, op, process_id, listener, offset just past the record)
+        """
+        if not os.path.exists(self.journal_path) or os.path.getsize(self.journal_path) < RECORD.size:
+            return
+        with open(self.journal_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                ips = IpStrings()
+                whole = len(view) - len(view) % RECORD.size
+                body = RECORD.size - CRC.size
+                for i, (version, op, days, student, ip, port, crc) in enumerate(RECORD.iter_unpack(view[:whole])):
+                    start = i * RECORD.size
+                    if crc != zlib.crc32(view[start:start + body]):
+                        return
+                    yield version, op, (days, student), (ips[ip], port), start + RECORD.size
+            finally:
+                view.release()
+
+    def append(self, version, process_id, listener, membership):
+        """
+        Append one change to the journal, taking a snapshot if it is time to.
+
+        :param version: group version the change produced
+        :param process_id: member that changed
+        :param listener: its new listener, or None if it was evicted
+        :param membership: the Membership the change was made to (for snapshots)
+        """
+        ip, port = listener if listener is not None else ('0.0.0.0', 0)
+        op = ADD if listener is not None else EVICT
+        record = bytearray(RECORD.size)
+        RECORD.pack_into(record, 0, version, op, process_id[0], process_id[1], socket.inet_aton(ip), port, 0)
+        CRC.pack_into(record, RECORD.size - CRC.size, zlib.crc32(memoryview(record)[:RECORD.size - CRC.size]))
+        self.file.write(record)
+        if self.sync:
+            os.fsync(self.file.fileno())
+        self.records += 1
+        if self.records >= self.compact_every:
+            self.compact(membership)
+
+    def compact(self, membership):
+        """
+        Write the whole group out as a snapshot and start a new, empty journal.
+
+        :param membership: the Membership to snapshot
+        """
+        group = membership.listeners_by_pid
+        buffer = bytearray(SNAPSHOT_HEADER.size + len(group) * MEMBER.size + CRC.size)
+        SNAPSHOT_HEADER.pack_into(buffer, 0, SNAPSHOT_MAGIC, membership.version, len(group))
+        offset = SNAPSHOT_HEADER.size
+        for (days, student), (ip, port) in group.items():
+            MEMBER.pack_into(buffer, offset, days, student, socket.inet_aton(ip), port)
+            offset += MEMBER.size
+        CRC.pack_into(buffer, offset, zlib.crc32(memoryview(buffer)[:offset]))
+
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        self.sync_directory()
+
+        # the snapshot now covers everything in the journal, so it can start over
+        self.file.truncate(0)
+        self.file.seek(0)
+        os.fsync(self.file.fileno())
+        self.records = 0
+
+    def sync_directory(self):
+        """
+        Make the snapshot rename durable.
+        """
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """
+        Close the journal file.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        """
+        Close the journal and delete it and the snapshot (and the directory, if nothing else is in it), for a group
+        that is gone for good.
+        """
+        self.close()
+        for path in (self.journal_path, self.snapshot_path, self.snapshot_path + '.tmp'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass  # e.g. the state directory, which also holds the named groups
@@ -5,20 +5,29 @@ This is free and unencumbered software released into the public domain.
 :Version: f19-01
 """
 
+import atexit
 from datetime import datetime
 from enum import Enum
-import random
+import signal
 import socket
 import sys
-import pickle
 import time
 import threading
-import traceback
 
-BUFFER_SIZE = 1024	# how many bytes to accept
-MAX_NUM_CONNECTIONS = 5 # how many people to handle at once
-TIMEOUT_LIMIT = 1.5	# seconds to wait for a socket to send/recv
-WAIT_FOR_COORD = 2	# seconds to wait for a COORDINATOR message
+import wire
+from failure_detector import PhiAccrualDetector
+from peer_digest import PeerDigest
+from peer_engine import PeerEngine
+from tracer import Tracer
+
+TIMEOUT_LIMIT = 1.5	# seconds to wait for a socket to send/recv, and for an OK after sending ELECTION
+WAIT_FOR_COORD = 2	# seconds to wait for a COORDINATOR message after an OK (or GRANT) before starting over
+LEADER_HEARTBEAT = 0.5	# seconds between the leader's ALIVE messages
+CHECK_INTERVAL = LEADER_HEARTBEAT / 4	# seconds between checks on whether the leader is still alive
+HEARTBEAT_INTERVAL = 10	# seconds between HEARTBEATs to the GCD (which evicts us after 30 seconds of silence)
+ELECTION_MODES = ('bully', 'modified')	# see Lab2.start_election
+MAX_TOMBSTONES = 1024	# most peers the GCD evicted that we remember, so gossip does not bring them back
+TRACE_FILE = 'lab2-trace-{}-{}.json'	# where the tracer is dumped (on SIGUSR1 and at exit), by days_to_birthday and su_id
 
 class State(Enum):
 	"""
@@ -30,214 +39,498 @@ class State(Enum):
 	WAITING_FOR_VICTOR = 'WAIT_VICTOR'	# once an OK is received
 
 class Lab2(object):
+	"""
+	A peer in the bully election. All peer-to-peer messaging and the election state machine run on the
+	transport's loop thread (see peer_engine), so the state here is only ever touched by that one thread.
+	"""
+	
+	verbose = True	# print progress with pr_time (the election simulator turns this off)
 	
-	def __init__(self, gcd_host, gcd_port, days_to_birthday, su_id):
+	def __init__(self, gcd_host, gcd_port, days_to_birthday, su_id, transport=None, election_mode='bully'):
 		"""
 		Constructs a Lab2 object to communicate with the Group Coordinator Daemon.
 		:param gcd_host: GCD hostname
 		:param gcd_port: GCD port
 		:param days_to_birthday: number of days until next birthday
 		:param su_id: SeattleU student ID
+		:param transport: PeerEngine to message peers with (default: one listening on a free port), or anything
+			with the same send, call_soon, call_later and time methods (see election_sim)
+		:param election_mode: 'bully' or 'modified' (see start_election)
 		"""
+		if election_mode not in ELECTION_MODES:
+			raise ValueError("election_mode must be one of {}".format(ELECTION_MODES))
 		self.gcd_host = gcd_host
 		self.gcd_port = int(gcd_port)
 		self.identity = (int(days_to_birthday), int(su_id))
-		self.peers = []
-		self.connections = {}
+		self.peers = {}	# only changed through set_peers and add_peer/remove_peer, which keep self.digest up to date
+		self.digest = PeerDigest()	# constant-size summary of self.peers sent with our messages instead of the whole thing
+		self.pulled_for = set()	# peer list summaries we have already asked somebody for the difference from
+		self.group_version = None	# version of the GCD's group that self.peers reflects
+		self.tombstones = {}	# group version indexed by peers the GCD evicted, oldest first (see update_peers)
+		self.transport = transport
 		self.leader = None
 		self.state = State.IDLE
+		self.election_mode = election_mode
+		self.waiting_for = set()	# stronger peers sent an ELECTION that have neither answered nor proved unreachable
+		self.candidates = []	# stronger peers still to ask, weakest first (modified mode)
+		self.responders = set()	# stronger peers that answered OK (modified mode)
+		self.granted = None	# responder we handed the election to (modified mode)
+		self.timer = None	# pending election timeout
+		self.leader_detector = None	# PhiAccrualDetector fed by the leader's ALIVE messages (when it is not us)
+		self.alive_timer = None	# next ALIVE to send (when we are the leader)
+		self.check_timer = None	# next check on the leader (when it is not us)
+		self.tracer = Tracer(clock=transport.time if transport is not None else PeerEngine.time, state=self.state.value)
 		
 	def run(self):
 		"""
-		Set up the listener thread, then join peers via the GCD.
+		Set up the listener, then join peers via the GCD.
 		After we have a list of peers, start an election.
 		"""
 		self.start_listener()
 		self.join_peers()
-		self.start_election()
+		self.start_heartbeat()
+		self.transport.call_soon(self.start_election)
 		
 	def start_listener(self):
 		"""
-		Start a listener thread on a random port (1025-2025)
+		Start the peer engine, listening on a free port
 		"""
 		self.host = "localhost"
-		self.port = random.randint(1025,2026)
-		
-		listener = threading.Thread(target=self.thr_listener)
-		listener.start()
+		if self.transport is None:
+			self.transport = PeerEngine(self.host, 0, self.handle_message, self.peer_unreachable)
+		self.port = self.transport.address[1]
+		self.transport.start()
+		self.pr_time("Listening on port {}".format(self.port), "listener")
 		
 	def join_peers(self):
 		"""
-		Send a JOIN request to the GCD.
+		Send a JOIN request to the GCD, telling it which version of the group we already have
+		so it only needs to send back what changed.
 		"""
-		with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as gcd:
-			address = (self.gcd_host, self.gcd_port)
-			self.pr_time("JOIN {}".format(address))
-			gcd.connect(address)
-			self.peers = self.message(gcd, 'JOIN', (self.host, self.port))
-			self.pr_time("Recieved list of {} peers from the GCD".format(len(self.peers)))
+		address = (self.gcd_host, self.gcd_port)
+		self.pr_time("JOIN {}".format(address))
+		with socket.create_connection(address, TIMEOUT_LIMIT) as gcd:
+			data = ('JOIN', (self.identity, (self.host, self.port), self.group_version))
+			self.transport.call_soon(self.apply_group_update, wire.request(gcd, data))
+	
+	def apply_group_update(self, update):
+		"""
+		Bring our peers up to date with a JOIN response from the GCD.
+		:param update: ('SNAPSHOT', version, peers) or ('DELTA', version, added, evicted)
+		"""
+		if type(update) is str: # the GCD rejected our JOIN
+			self.pr_time(update, "gcd error")
+			return
+		
+		if update[0] == 'SNAPSHOT':
+			evicted = [peer for peer in self.peers if peer not in update[2]]
+			self.set_peers(update[2])
+		else:
+			evicted = update[3]
+			self.update_peers(update[2])
+			for peer in evicted:
+				self.remove_peer(peer)
+		for peer in update[2]:
+			self.tombstones.pop(peer, None)
+		for peer in evicted:
+			self.bury(peer, update[1])
+		
+		self.group_version = update[1]
+		self.pr_time("Group version {} from the GCD, {} peers".format(self.group_version, len(self.peers)))
+	
+	def start_heartbeat(self):
+		"""
+		Start a thread that keeps our GCD lease alive (and our list of peers fresh).
+		"""
+		heartbeat = threading.Thread(target=self.thr_heartbeat, daemon=True)
+		heartbeat.start()
+	
+	def thr_heartbeat(self):
+		"""
+		Send a HEARTBEAT to the GCD every HEARTBEAT_INTERVAL seconds, joining again if our lease has lapsed.
+		"""
+		while True:
+			time.sleep(HEARTBEAT_INTERVAL)
+			try:
+				with socket.create_connection((self.gcd_host, self.gcd_port), timeout=TIMEOUT_LIMIT) as gcd:
+					data = ('HEARTBEAT', (self.identity, self.group_version))
+					reply = wire.request(gcd, data)
+				
+				if type(reply) is str: # no longer a member
+					self.pr_time(reply, "heartbeat")
+					self.join_peers()
+				else:
+					self.transport.call_soon(self.apply_group_update, reply)
+			except Exception as e: # try again next time round rather than let our lease lapse for good
+				self.pr_time(e, "heartbeat error")
 	
 	def start_election(self):
 		"""
 		Start an election among known peers who are "stronger", let them know who we know
 		by sending our list of known peers.
-		"""
-		self.state = State.WAITING_FOR_OK # put ourself into an election state
-		the_greatest = True
 		
-		for peer in self.peers:
-			identity = peer
-			address = self.peers[peer]
-			if identity[0] < self.identity[0] or (identity[0] == self.identity[0] and identity[1] < self.identity[1]):
-				the_greatest = False
-				sender = threading.Thread(target=self.thr_send, args=((identity, address), 'ELECTION', self.peers))
-				sender.start()
+		In 'bully' mode every stronger peer that answers goes on to hold an election of its own, which costs
+		O(n^2) messages or more. In 'modified' mode we ask the stronger peers one at a time, strongest first, and
+		hand the election (GRANT) to the first that answers OK, which declares victory. Peers that are down are
+		skipped as soon as they prove unreachable (a hung one costs an OK timeout). With the strongest peer up,
+		each election costs a constant number of messages plus the one COORDINATOR broadcast, so the group
+		still settles in O(n) messages when every peer starts an election at once.
+		"""
+		self.set_state(State.WAITING_FOR_OK) # put ourself into an election state
+		stronger = [peer for peer in self.peers if self.is_stronger(peer)]
+		self.waiting_for = set()
+		self.responders = set()
+		self.granted = None
 		
 		# nobody is a bigger bully than we are, send a message to all peers that we are in charge
-		if the_greatest:
+		if not stronger:
 			self.declare_victory()
+			return
+		
+		if self.election_mode == 'modified':
+			self.candidates = sorted(stronger, reverse=True)	# so the strongest comes off the end first
+			self.ask_next()
+			return
+		
+		self.waiting_for = set(stronger)
+		self.set_timer(TIMEOUT_LIMIT, self.ok_timed_out)
+		for peer in stronger:
+			self.send(peer, 'ELECTION', self.announcement())
+	
+	def ask_next(self):
+		"""
+		Send our ELECTION to the strongest peer we have not yet asked (modified mode), or declare victory if
+		none are left.
+		"""
+		self.set_state(State.WAITING_FOR_OK)
+		while self.candidates:
+			peer = self.candidates.pop()
+			if peer in self.peers:
+				self.waiting_for = {peer}
+				self.set_timer(TIMEOUT_LIMIT, self.ok_timed_out)	# before sending, which may report it unreachable
+				self.send(peer, 'ELECTION', self.announcement())
+				return
+		self.waiting_for = set()
+		self.declare_victory()
 			
 	def declare_victory(self):
 		"""
 		Method to send a coordinator method to all known peers, tell myself that I am the leader
 		"""
+		self.set_timer(None)
 		for peer in self.peers:
 			if not peer == self.identity:
-				if peer in self.connections:
-					self.connections[peer][0].close()
-					del self.connections[peer]
-				identity = peer
-				address = self.peers[peer]
-				sender = threading.Thread(target=self.thr_send, args=((identity, address), 'COORDINATOR', self.peers))
-				sender.start()
+				self.send(peer, 'COORDINATOR', self.announcement())
 		self.leader = self.identity
-		self.state = State.IDLE
+		self.set_state(State.IDLE)
+		self.pr_time("I am the leader now.", self.identity)
+		self.watch_leader()
 	
-	def message(self, sock, protocol, message, buffer_size=BUFFER_SIZE, care_for_response=True):
+	def is_stronger(self, peer):
 		"""
-		Package the message, send it over the socket and return the response.
-		:param sock: the socket to send the message over
+		:return: True if the peer would win an election against us
+		"""
+		return peer[0] < self.identity[0] or (peer[0] == self.identity[0] and peer[1] < self.identity[1])
+	
+	def set_state(self, state):
+		"""
+		Move to a new election state (tracing the transition).
+		"""
+		if state != self.state:
+			self.tracer.transition(state.value)
+			self.state = state
+	
+	def send(self, peer, protocol, message):
+		"""
+		Package the message and queue it for the given peer.
+		:param peer: identity of the peer to send to
 		:param protocol: the protocol to indicate in the message header
 		:param message: the actual message data
-		:param buffer_size: the size of message to expect/accept as a response
-		:param care_for_response: indicator of whether or not to wait for a response (default: True)
 		"""
-		data = (protocol, (self.identity, message))
-		
-		try:
-			sock.sendall(pickle.dumps(data))
-			if care_for_response:
-				return pickle.loads(sock.recv(buffer_size))
-		except Exception as e:
-			self.pr_time(e, "msg error")
-			return 500
-		
-	def thr_send(self, peer, protocol, msg):
+		address = self.peers.get(peer)
+		if address is None:
+			return
+		self.tracer.sent(protocol, peer)
+		self.transport.send(peer, address, (protocol, (self.identity, message)))
+	
+	def set_timer(self, delay, callback=None):
 		"""
-		Helper function for multi-threading the delivery of messages.
-		:param sock: socket to send data through
-		:param msg: the message to be sent
+		Replace the pending election timeout (if any).
+		:param delay: seconds until callback runs, or None to just cancel the pending one
+		:param callback: what to run
 		"""
-		sock = self.get_connection(peer)[0]
-		
-		print("Sending", protocol)
-		send_resp = self.message(sock, protocol, msg, care_for_response=(protocol != 'COORDINATOR'))
-		
-		if send_resp and send_resp == 500: # if we get a connection error, set the socket flag
-			self.connections[peer[0]][1] = True
-		
-		elif protocol == 'ELECTION' and send_resp == 500:
-			done = True
-			for conn in self.connections:
-				if not self.connections[conn][1]:
-					done = False
-			
-			if done:
-				for conn in self.connections:
-					self.connections[conn][1] = False
-				self.declare_victory()
-		
-		elif protocol == 'ELECTION' and send_resp and send_resp[0] == 'OK':
-			self.pr_time("Received OK from a peer. Waiting for victor.")
-			self.state = State.WAITING_FOR_VICTOR
-				
-	def thr_listener(self):
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+		if delay is not None:
+			self.timer = self.transport.call_later(delay, callback)
+	
+	def ok_timed_out(self):
 		"""
-		Method for listener to run in a separate thread.
+		No (more) stronger peers answered our ELECTION in time: we win, or in modified mode ask the next one.
 		"""
-		host_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		host_socket.bind((self.host, self.port))
-		host_socket.listen(MAX_NUM_CONNECTIONS)
-		
-		self.pr_time("Listening on port {}".format(self.port), "listener")
-		
-		# constantly wait for connections
-		while True:
-			try:
-				peer_sock, peer_addr = host_socket.accept()
-				self.pr_time("Accepted connection", "listener")
-				peer_thread = threading.Thread(target=self.thr_peer, args=(peer_sock, peer_addr))
-				peer_thread.start()
-			except Exception as e:
-				self.pr_time(e, "error")
+		self.timer = None
+		if self.state != State.WAITING_FOR_OK:
+			return
+		if self.election_mode == 'modified':
+			self.ask_next()
+		else:
+			self.finish_collecting()
 	
-	def thr_peer(self, socket, address):
+	def finish_collecting(self):
+		"""
+		Every stronger peer we asked has answered or been given up on. Hand the election to the strongest
+		responder (modified mode), or declare victory if nobody stronger is left.
+		"""
+		self.set_timer(None)
+		if not self.responders:
+			self.declare_victory()
+			return
+		self.granted = min(self.responders)
+		self.set_state(State.WAITING_FOR_VICTOR)
+		self.send(self.granted, 'GRANT', None)
+		self.set_timer(WAIT_FOR_COORD, self.victor_timed_out)
+	
+	def victor_timed_out(self):
+		"""
+		A stronger peer took over the election but never declared victory (it may have died), so start over.
+		"""
+		self.timer = None
+		if self.state == State.WAITING_FOR_VICTOR:
+			self.pr_time("No COORDINATOR in time, starting a new election.")
+			self.start_election()
+	
+	def watch_leader(self):
+		"""
+		Once there is a leader: if it is us, keep sending ALIVE to everyone, otherwise keep an eye on its ALIVEs.
+		"""
+		for timer in (self.alive_timer, self.check_timer):
+			if timer is not None:
+				timer.cancel()
+		self.alive_timer = self.check_timer = self.leader_detector = None
+		if self.leader == self.identity:
+			self.alive_timer = self.transport.call_later(LEADER_HEARTBEAT, self.send_alive)
+		elif self.leader is not None:
+			self.leader_detector = PhiAccrualDetector(LEADER_HEARTBEAT)
+			self.leader_detector.start(self.transport.time())
+			self.check_timer = self.transport.call_later(CHECK_INTERVAL, self.check_leader)
+	
+	def send_alive(self):
+		"""
+		Let everyone know we are still the leader.
+		"""
+		self.alive_timer = None
+		if self.leader != self.identity:
+			return
+		for peer in self.peers:
+			if peer != self.identity:
+				self.send(peer, 'ALIVE', self.announcement())
+		self.alive_timer = self.transport.call_later(LEADER_HEARTBEAT, self.send_alive)
+	
+	def check_leader(self):
+		"""
+		Start an election if the failure detector has given up on the leader.
+		"""
+		self.check_timer = None
+		if self.leader is None or self.leader == self.identity or self.leader_detector is None:
+			return
+		if self.state == State.IDLE and not self.leader_detector.available(self.transport.time()):
+			self.pr_time("Leader {} is not responding, starting an election.".format(self.leader))
+			self.leader = self.leader_detector = None
+			self.start_election()
+			return
+		self.check_timer = self.transport.call_later(CHECK_INTERVAL, self.check_leader)
+	
+	def peer_unreachable(self, peer):
+		"""
+		The transport could not deliver to a peer. A stronger peer that is down will never answer our ELECTION,
+		so once none are left to hear from we win without waiting out the timeout.
+		:param peer: identity of the peer
+		"""
+		self.tracer.unreachable(peer)
+		asked = peer in self.waiting_for
+		self.waiting_for.discard(peer)
+		self.responders.discard(peer)
+		if self.election_mode == 'modified':
+			if (self.state == State.WAITING_FOR_OK and asked) or \
+					(self.state == State.WAITING_FOR_VICTOR and peer == self.granted):
+				self.ask_next()	# it is down (or went down before taking over), try the next strongest
+		elif self.state == State.WAITING_FOR_OK and asked and not self.waiting_for:
+			self.finish_collecting()
+	
+	def handle_message(self, msg):
 		"""
 		A method for handling an incoming message from a peer node.
-		:param socket: the socket object to use for communication
-		:param address: the address identifier for the socket
+		:param msg: (protocol, (sender identity, data))
 		"""
-		msg = pickle.loads(socket.recv(BUFFER_SIZE))
-		
-		protocol = msg[0]
-		data = msg[1]
-		
-		self.update_peers(data[1])
+		try:
+			protocol, (sender, data) = msg
+		except (TypeError, ValueError):
+			sender = None
+		if not wire.is_process_id(sender):
+			self.pr_time("Received invalid message", "error")
+			return
+		started = self.tracer.now()
+		self.dispatch(protocol, sender, data)
+		self.tracer.received(protocol, sender, started)
+	
+	def dispatch(self, protocol, sender, data):
+		"""
+		Act on one message from a peer.
+		:param protocol: the message type
+		:param sender: identity of the peer it came from
+		:param data: the rest of the message
+		"""
+		if protocol in ('ELECTION', 'OK', 'COORDINATOR', 'ALIVE'):
+			self.compare_peers(sender, data)
 		
 		# someone else has started an election
 		if protocol == 'ELECTION':
-			self.pr_time("ELECTION message from {}. Sending OK.".format(address))
-			self.message(socket, 'OK', None, care_for_response=False)
+			self.send(sender, 'OK', self.announcement())
 			
-			# if we aren't currently in an election, let's start one
-			print(self.state)
-			if self.state != State.WAITING_FOR_OK:
+			# if we aren't currently in an election, let's start one (in modified mode the sender will hand over)
+			if self.election_mode == 'bully' and self.state != State.WAITING_FOR_OK:
 				self.start_election()
-				
+		
+		# a stronger peer is taking over the election
+		elif protocol == 'OK':
+			asked = sender in self.waiting_for
+			self.waiting_for.discard(sender)
+			if self.state != State.WAITING_FOR_OK:
+				return
+			if self.election_mode == 'bully':
+				self.set_timer(WAIT_FOR_COORD, self.victor_timed_out)
+				self.set_state(State.WAITING_FOR_VICTOR)
+			elif asked:	# not a late answer to a peer we have since moved on from
+				self.responders.add(sender)
+				self.finish_collecting()
+		
+		# a peer whose list differs from ours wants our entries in the buckets that differ
+		elif protocol == 'PULL':
+			if type(data) is tuple:
+				self.send(sender, 'PUSH', {peer: self.peers[peer] for bucket in self.digest.differing(data)
+						for peer in self.digest.members[bucket]})
+		
+		# the entries we asked for
+		elif protocol == 'PUSH':
+			if type(data) is dict:
+				self.update_peers(data, gossip=True)
+		
+		# a weaker peer has found nobody stronger than us alive, so we win
+		elif protocol == 'GRANT':
+			if self.leader == self.identity and self.state == State.IDLE:
+				self.send(sender, 'COORDINATOR', self.announcement())	# already won, just tell the one who asked
+			else:
+				self.declare_victory()
+		
 		# someone has declared themselves the winner
 		elif protocol == 'COORDINATOR':
-			self.state = State.IDLE
-			self.pr_time("I am the leader now.", data[0])
-			self.leader = data[0]
-			
-		socket.close()
+			self.set_timer(None)
+			self.set_state(State.IDLE)
+			if sender != self.leader:
+				self.pr_time("{} is the leader now.".format(sender), sender)
+			self.leader = sender
+			self.watch_leader()
+		
+		# the leader is still there
+		elif protocol == 'ALIVE':
+			if sender == self.leader and self.leader_detector is not None:
+				self.leader_detector.heartbeat(self.transport.time())
+			elif self.state == State.IDLE and (self.leader is None or sender < self.leader):
+				self.leader = sender	# a stronger leader than ours (e.g. after a partition heals), go with it
+				self.watch_leader()
+	
+	def announcement(self):
+		"""
+		What we send with ELECTION, OK and COORDINATOR instead of our whole peer list.
+		:return: (our listener address, number of peers we know, hash of our peer list)
+		"""
+		return (self.transport.address,) + self.digest.summary()
+	
+	def compare_peers(self, sender, announcement):
+		"""
+		Learn the sender's address from its announcement and, if its peer list differs from ours, ask it for
+		the entries in the buckets that differ.
+		:param sender: identity of the peer the announcement came from
+		:param announcement: (address, count, hash) as made by announcement()
+		"""
+		try:
+			address, count, digest = announcement
+		except (TypeError, ValueError):
+			return
+		if not self.add_peer(sender, address):
+			return
+		self.tombstones.pop(sender, None)	# it is evidently up, whatever the GCD last said
+		summary = (count, digest)
+		if summary != self.digest.summary() and summary not in self.pulled_for:
+			if len(self.pulled_for) > 1024:
+				self.pulled_for.clear()
+			self.pulled_for.add(summary)
+			self.send(sender, 'PULL', tuple(self.digest.buckets))
+	
+	def set_peers(self, peers):
+		"""
+		Replace our peers list.
+		:param peers: {identity: address}
+		"""
+		self.peers = {}
+		self.digest = PeerDigest()
+		self.update_peers(peers)
 	
-	def update_peers(self, new_peers):
+	def update_peers(self, new_peers, gossip=False):
 		"""
-		Add or update our peers list with one we have received from another peer.
+		Add or update our peers list with one we have received from the GCD or another peer.
+		
+		Another peer's list may still have members the GCD has since evicted, so entries from gossip are skipped
+		for peers we have a tombstone for. (A live peer gets its tombstone removed once the GCD lists it again or
+		it messages us itself.)
 		:param new_peers: the peer list that was received
+		:param gossip: True if it came from a peer rather than the GCD
 		"""
 		for peer in new_peers:
-			self.peers[peer] = new_peers[peer]
+			if not (gossip and self.is_buried(peer)):
+				self.add_peer(peer, new_peers[peer])
 	
-	def get_connection(self, peer):
+	def add_peer(self, peer, address):
 		"""
-		Keep track of open sockets, open a new socket if one does not exist
-		:param peer: tuple of identity and address
+		Add or update one peer.
+		:return: False if the entry was malformed (and so ignored)
 		"""
-		if not peer[0] in self.connections or self.connections[peer[0]][1]:
-			peer_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			peer_sock.settimeout(TIMEOUT_LIMIT)
-			
-			try:
-				peer_sock.connect(peer[1])
-			except Exception as e:
-				self.pr_time(e, "conn error")
-				pass
-			
-			self.connections[peer[0]] = [peer_sock, False]
-		
-		return self.connections[peer[0]]
+		if not (wire.is_process_id(peer) and wire.is_address(address)):
+			return False
+		old = self.peers.get(peer)
+		if old == address:
+			return True
+		if old is not None:
+			self.digest.remove(peer, old)
+		self.peers[peer] = address
+		self.digest.add(peer, address)
+		return True
+	
+	def remove_peer(self, peer):
+		"""
+		Forget one peer (if we know it).
+		"""
+		address = self.peers.pop(peer, None)
+		if address is not None:
+			self.digest.remove(peer, address)
+	
+	def bury(self, peer, version):
+		"""
+		Remember that the GCD evicted a peer, forgetting the oldest such peer if there are too many.
+		:param peer: identity of the peer
+		:param version: group version in which it was evicted
+		"""
+		self.tombstones.pop(peer, None)
+		self.tombstones[peer] = version
+		if len(self.tombstones) > MAX_TOMBSTONES:
+			del self.tombstones[next(iter(self.tombstones))]
+	
+	def is_buried(self, peer):
+		"""
+		:return: True if the GCD has evicted the peer and has not listed it since
+		"""
+		return peer in self.tombstones
 	
 	@staticmethod
 	def pr_time(msg, label="main"):
@@ -246,17 +539,31 @@ class Lab2(object):
 		:param msg: the content to print
 		:param label: who/what is sending the message
 		"""
+		if not Lab2.verbose:
+			return
 		time_now = datetime.now().strftime("[%H:%M:%S.%f]")
 		print(time_now, "<"+str(label)+">", msg)
 
 if __name__ == "__main__":
-	if len(sys.argv) != 5:
-		print("Usage:\tpython3 lab2.py [host] [port] [days_to_birthday] [su_id]")
+	if len(sys.argv) not in (5, 6) or sys.argv[5:] not in ([], ['bully'], ['modified']):
+		print("Usage:\tpython3 lab2.py [host] [port] [days_to_birthday] [su_id] [bully|modified]")
 		exit(1)
 		
 	host, port = sys.argv[1:3]
 	days_to_birthday = sys.argv[3]
 	su_id = sys.argv[4]
     
-	lab2 = Lab2(host, port, days_to_birthday, su_id)
-	lab2.run()
+	lab2 = Lab2(host, port, days_to_birthday, su_id, election_mode=(sys.argv[5:] or ['bully'])[0])
+	trace_file = TRACE_FILE.format(days_to_birthday, su_id)
+	atexit.register(lab2.tracer.dump, trace_file)
+	signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))	# so a plain kill still dumps the trace
+	if hasattr(signal, 'SIGUSR1'):
+		signal.signal(signal.SIGUSR1, lambda *_: lab2.tracer.dump(trace_file))
+	try:
+		lab2.run()
+		lab2.transport.thread.join()	# wait here, since signal handlers only run on the main thread
+	except KeyboardInterrupt:
+		pass
+	finally:
+		if lab2.transport is not None:
+			lab2.transport.stop()
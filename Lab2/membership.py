@@ -0,0 +1,243 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Group membership kept by the Group Coordinator Daemon, with a versioned log of its changes.
+
+Every add or eviction bumps the group version and is appended to the log, so a member that already holds the group
+as of some version can be sent just what changed since then instead of the whole group. The top bits of a version are
+a random epoch picked when the group's history starts (a new group, or a coordinator restarted without its journal),
+so a version from some other history never matches ours and its holder is sent a full snapshot instead of a delta.
+Full-group replies are encoded once per version and the same bytes are handed to every JOIN until the group changes.
+
+Membership is leased: a JOIN or HEARTBEAT grants LEASE_TIME seconds, and members whose lease lapses are evicted. Leases
+are indexed by a heap of expiry times so finding and evicting the k lapsed members costs O(k log n).
+"""
+import heapq
+import random
+import threading
+import time
+
+import wire
+
+LOG_LIMIT = 10_000  # most recent changes kept for delta responses
+LEASE_TIME = 30.0  # seconds a JOIN or HEARTBEAT keeps a member in the group
+EPOCH_SHIFT = 32  # a version is epoch << EPOCH_SHIFT | number of changes in the epoch
+EPOCH_BITS = 31  # so versions still fit the wire's signed 64-bit ints
+
+
+def new_epoch():
+    """
+    :return: the version of an empty group at the start of a new, random epoch
+    """
+    return random.getrandbits(EPOCH_BITS) << EPOCH_SHIFT
+
+
+class Membership(object):
+    """
+    Membership indexes for one group plus the change log used for delta JOIN responses.
+
+    All methods expect the caller to hold self.lock.
+
+    >>> group = Membership(start_version=0)
+    >>> group.join((10, 1000000), ('127.0.0.1', 5000))
+    >>> group.join((20, 2000000), ('127.0.0.1', 5001))
+    >>> group.version
+    2
+    >>> group.join((11, 1000000), ('127.0.0.1', 5002))  # same student, new process id replaces the old one
+    >>> group.changes_since(2)
+    ({(11, 1000000): ('127.0.0.1', 5002)}, [(10, 1000000)])
+    >>> group.changes_since(5) is None  # version from the future
+    True
+    >>> group.changes_since(new_epoch() + 2) is None  # from another epoch (a restarted coordinator, say)
+    True
+    >>> group.renew((20, 2000000), now=time.monotonic() + 100)
+    True
+    >>> group.expire(time.monotonic() + LEASE_TIME + 1)  # only the member that renewed is left
+    [(11, 1000000)]
+    >>> list(group.listeners_by_pid), group.pids_by_student, group.pids_by_listener  # no trace of the lapsed one
+    ([(20, 2000000)], {2000000: (20, 2000000)}, {('127.0.0.1', 5001): (20, 2000000)})
+    """
+
+    def __init__(self, log_limit=LOG_LIMIT, journal=None, lease_time=LEASE_TIME, start_version=None):
+        """
+        :param log_limit: number of changes to keep; clients further behind than this get a full snapshot
+        :param journal: optional journal.Journal to restore the group from and record every change to
+        :param lease_time: seconds a JOIN or HEARTBEAT keeps a member in the group
+        :param start_version: version of the empty group (a new random epoch if None), unless the journal has one
+        """
+        if start_version is None:
+            start_version = new_epoch()
+        self.listeners_by_pid = {}  # listener address indexed by process id (as returned from JOIN message)
+        self.pids_by_listener = {}  # process ids indexed by listener address (only one pid for each (host, port))
+        self.pids_by_student = {}  # process ids indexed by student id (each student only allowed one at a time)
+        self.lock = threading.Lock()  # guards everything here against concurrent JOINs
+        self.version = start_version  # bumped on every change to listeners_by_pid
+        self.log = []  # (process_id, listener or None if evicted); log[i] made version first_version + i
+        self.first_version = start_version + 1
+        self.log_limit = log_limit
+        self.encoded = {}  # cached encoded full-group replies by (kind, binary), valid while encoded_version == version
+        self.encoded_version = None
+        self.lease_time = lease_time
+        self.leases = {}  # lease expiry (time.monotonic) indexed by process id
+        self.expiries = []  # heap of (expiry, process_id); entries no longer matching self.leases are stale
+        self.retired = False  # set once the group has been dropped from its registry (see groups.Groups)
+        self.journal = journal
+        if journal is not None:
+            journal.replay(self)
+            now = time.monotonic()  # restored members get a fresh lease to check back in
+            for process_id in self.listeners_by_pid:
+                self.renew(process_id, now)
+
+    def join(self, process_id, listener, now=None):
+        """
+        Add a member (with a fresh lease), evicting any older memberships for the same student or the same listener.
+
+        :param process_id: (days_to_birthday, student_id)
+        :param listener: validated (ip, port) of the member's listening socket
+        :param now: time.monotonic() of the JOIN, if the caller already has it
+        """
+        student_id = process_id[1]
+
+        # remove any old memberships for the same student
+        if student_id in self.pids_by_student and self.pids_by_student[student_id] != process_id:
+            self.evict(self.pids_by_student[student_id])
+        self.pids_by_student[student_id] = process_id
+
+        # add this entry into group membership
+        old_listener = self.listeners_by_pid.get(process_id)
+        if old_listener != listener:
+            if self.pids_by_listener.get(old_listener) == process_id:
+                del self.pids_by_listener[old_listener]  # moved
+            self.listeners_by_pid[process_id] = listener
+            self.record(process_id, listener)
+
+        # also remove any old memberships which claimed this same listener (host, port) pair
+        if listener in self.pids_by_listener and self.pids_by_listener[listener] != process_id:
+            self.evict(self.pids_by_listener[listener])
+        self.pids_by_listener[listener] = process_id
+        self.renew(process_id, now)
+
+    def renew(self, process_id, now=None):
+        """
+        Extend a member's lease.
+
+        :param process_id: (days_to_birthday, student_id)
+        :param now: time.monotonic() of the request, if the caller already has it
+        :return: False if the process is not a member (and so must JOIN again)
+        """
+        if process_id not in self.listeners_by_pid:
+            return False
+        expiry = (time.monotonic() if now is None else now) + self.lease_time
+        self.leases[process_id] = expiry
+        heapq.heappush(self.expiries, (expiry, process_id))
+        if len(self.expiries) > 2 * len(self.leases) + 64:  # mostly superseded entries, so rebuild
+            self.expiries = [(expiry, process_id) for process_id, expiry in self.leases.items()]
+            heapq.heapify(self.expiries)
+        return True
+
+    def expire(self, now=None):
+        """
+        Evict every member whose lease has lapsed.
+
+        :param now: current time.monotonic(), if the caller already has it
+        :return: list of the process ids evicted
+        """
+        now = time.monotonic() if now is None else now
+        evicted = []
+        while self.expiries and self.expiries[0][0] <= now:
+            expiry, process_id = heapq.heappop(self.expiries)
+            if self.leases.get(process_id) == expiry:
+                self.evict(process_id)
+                evicted.append(process_id)
+        return evicted
+
+    def evict(self, process_id):
+        """
+        Remove a member from the group (if it is still in it).
+
+        :param process_id: (days_to_birthday, student_id)
+        """
+        self.leases.pop(process_id, None)
+        if self.pids_by_student.get(process_id[1]) == process_id:
+            del self.pids_by_student[process_id[1]]
+        if process_id in self.listeners_by_pid:
+            listener = self.listeners_by_pid.pop(process_id)
+            if self.pids_by_listener.get(listener) == process_id:
+                del self.pids_by_listener[listener]
+            self.record(process_id, None)
+
+    def record(self, process_id, listener):
+        """
+        Log a change to the group and bump its version.
+
+        :param process_id: member that changed
+        :param listener: its new listener, or None if it was evicted
+        """
+        self.version += 1
+        if self.journal is not None:
+            self.journal.append(self.version, process_id, listener, self)
+        self.log.append((process_id, listener))
+        if len(self.log) > 2 * self.log_limit:  # trim in bulk so appends stay amortized O(1)
+            excess = len(self.log) - self.log_limit
+            del self.log[:excess]
+            self.first_version += excess
+
+    def changes_since(self, version):
+        """
+        Net changes to the group after the given version.
+
+        :param version: group version the caller already has
+        :return: ({process_id: listener} added or moved, [process_id] evicted), or None if the log no longer
+                 reaches back that far (or the version is not one we have issued, in this epoch)
+        """
+        if version >> EPOCH_SHIFT != self.version >> EPOCH_SHIFT:
+            return None  # a version from some other history of the group
+        if not (self.first_version - 1 <= version <= self.version):
+            return None
+        latest = {}
+        for process_id, listener in self.log[version - self.first_version + 1:]:
+            latest[process_id] = listener
+        added = {process_id: listener for process_id, listener in latest.items() if listener is not None}
+        evicted = [process_id for process_id, listener in latest.items() if listener is None]
+        return added, evicted
+
+    def join_response(self, since_version):
+        """
+        What to send back to a JOIN.
+
+        :param since_version: group version the member already has (None if it has nothing)
+        :return: ('DELTA', version, added, evicted) when that is smaller than the group,
+                 otherwise ('SNAPSHOT', version, listeners_by_pid)
+        """
+        if since_version is not None and self.version - since_version <= len(self.listeners_by_pid):
+            changes = self.changes_since(since_version)
+            if changes is not None:
+                return ('DELTA', self.version) + changes
+        return 'SNAPSHOT', self.version, self.listeners_by_pid
+
+    def encoded_reply(self, since_version, versioned=True, binary=True):
+        """
+        Encoded reply to a JOIN. Full-group replies come from a cache that is only rebuilt after the group changes.
+
+        :param since_version: group version the member already has (None if it has nothing)
+        :param versioned: False for members that want the bare listeners_by_pid dictionary
+        :param binary: use the binary wire encoding (False to pickle)
+        :return: encoded bytes, ready to send
+        """
+        if versioned:
+            reply = self.join_response(since_version)
+            if reply[0] != 'SNAPSHOT':
+                return wire.encode(reply, binary)
+            kind = ('SNAPSHOT', binary)
+        else:
+            reply = self.listeners_by_pid
+            kind = ('GROUP', binary)
+        if self.encoded_version != self.version:
+            self.encoded.clear()
+            self.encoded_version = self.version
+        if kind not in self.encoded:
+            self.encoded[kind] = wire.encode(reply, binary)
+        return self.encoded[kind]
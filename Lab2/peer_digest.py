@@ -0,0 +1,108 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Constant-size summaries of a Lab2 peer list, so peers can tell whether their lists differ without sending them.
+
+Each (process_id, address) entry hashes to 64 bits and falls in one of BUCKETS buckets by its process id. A bucket's
+hash is the XOR of its entries' hashes, so adding or removing an entry is O(1) and the result does not depend on the
+order entries were added in. Two peers compare (count, XOR of all buckets); if that differs, one sends the other its
+bucket hashes and gets back just the entries in the buckets that differ.
+"""
+import hashlib
+import struct
+
+import wire
+
+BUCKETS = 16  # power of two
+PROCESS_ID = struct.Struct('!HI')
+ENTRY = struct.Struct('!HI4sH')
+
+
+def bucket_of(process_id):
+    """
+    :return: which bucket the given process id's entry is in (the same on every peer)
+    """
+    return hashlib.blake2b(PROCESS_ID.pack(*process_id), digest_size=1).digest()[0] % BUCKETS
+
+
+def entry_hash(process_id, address):
+    """
+    :return: 64-bit hash of one peer list entry (the same on every peer)
+    :raises ValueError: if the entry does not fit the wire's process id and (ipv4, port) layouts
+    """
+    if not (wire.is_process_id(process_id) and wire.is_address(address)):
+        raise ValueError('Malformed peer list entry: {!r}: {!r}'.format(process_id, address))
+    packed = ENTRY.pack(process_id[0], process_id[1], wire.packed_ipv4(address[0]), address[1])
+    return int.from_bytes(hashlib.blake2b(packed, digest_size=8).digest(), 'big')
+
+
+class PeerDigest(object):
+    """
+    Incrementally maintained bucketed hash of a peer list.
+
+    >>> a = PeerDigest({(10, 1000000): ('127.0.0.1', 5000), (20, 2000000): ('127.0.0.1', 5001)})
+    >>> b = PeerDigest({(20, 2000000): ('127.0.0.1', 5001)})
+    >>> a.summary() == b.summary()
+    False
+    >>> b.add((10, 1000000), ('127.0.0.1', 5000))
+    >>> a.summary() == b.summary()
+    True
+    >>> b.remove((10, 1000000), ('127.0.0.1', 5000))
+    >>> a.differing(b.buckets) == [bucket_of((10, 1000000))]
+    True
+    >>> b.add((30, 3000000), ('localhost', 5002))  # only addresses every peer would hash the same way
+    Traceback (most recent call last):
+    ...
+    ValueError: Malformed peer list entry: (30, 3000000): ('localhost', 5002)
+    """
+
+    def __init__(self, peers=None):
+        """
+        :param peers: {process_id: address} to start with
+        """
+        self.buckets = [0] * BUCKETS
+        self.members = [set() for _ in range(BUCKETS)]  # process ids in each bucket
+        self.count = 0
+        self.hashes = {}  # entry hash indexed by (process_id, address), so nothing is hashed twice
+        for process_id, address in (peers or {}).items():
+            self.add(process_id, address)
+
+    def add(self, process_id, address):
+        """
+        Account for an entry added to the peer list.
+        """
+        key = (process_id, address)
+        if key not in self.hashes:
+            self.hashes[key] = entry_hash(process_id, address)
+        bucket = bucket_of(process_id)
+        self.buckets[bucket] ^= self.hashes[key]
+        self.members[bucket].add(process_id)
+        self.count += 1
+
+    def remove(self, process_id, address):
+        """
+        Account for an entry removed from the peer list (the entry must have been added).
+        """
+        bucket = bucket_of(process_id)
+        self.buckets[bucket] ^= self.hashes.pop((process_id, address))
+        self.members[bucket].discard(process_id)
+        self.count -= 1
+
+    def summary(self):
+        """
+        :return: (number of entries, 64-bit hash of them all), which is what peers exchange on every message
+        """
+        combined = 0
+        for bucket in self.buckets:
+            combined ^= bucket
+        return self.count, combined
+
+    def differing(self, buckets):
+        """
+        :param buckets: another peer's bucket hashes
+        :return: indexes of the buckets that differ from ours
+        """
+        return [i for i in range(BUCKETS) if i >= len(buckets) or buckets[i] != self.buckets[i]]
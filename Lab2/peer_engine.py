@@ -0,0 +1,521 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+Event-driven messaging between the Lab2 peers.
+
+One thread runs a selector loop that owns every socket: the listener, the connections other peers opened to us, and
+at most one persistent outgoing connection to each peer, which is reused for every message we send it. Messages are
+one-way, framed and wire-encoded; a reply (such as OK to an ELECTION) is just a message sent back the other way.
+Timers run on the same thread, so the election state machine never needs a lock.
+
+Resource use does not grow with the size of the group: there is one thread whatever happens, at most max_connections
+sockets, and at most max_queued bytes waiting to go to any one peer (a peer that falls that far behind is treated as
+unreachable). To make room for a new connection the least recently used idle one is closed, never one with messages
+still to write; if every connection is busy, messages to a new peer wait until one finishes (and new incoming
+connections wait in the listen backlog).
+
+An idle outgoing connection can just be closed, but one a peer opened to us may have messages in flight, and closing
+a socket with unread data resets it and throws them away. So we only shut down our side of it (which the peer reads
+as EOF): the peer stops queueing on it, finishes writing what it has and closes, and we keep reading until then.
+"""
+import collections
+import errno
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+import traceback
+
+import wire
+from framing import FrameReader, FrameWriter
+
+BACKLOG = 128  # socket listen arg
+MAX_CONNECTIONS = 256  # open peer connections (both directions) before the least recently used idle one is closed
+MAX_QUEUED = 1 << 20  # bytes waiting to be written to one peer before we give up on it
+CONNECT_TIMEOUT = 1.5  # seconds to establish an outgoing connection
+CLOSE_TIMEOUT = 5.0  # seconds for a peer to finish with a connection we have shut down before we close it anyway
+POLL_INTERVAL = 0.5  # longest time to block in select
+
+
+class Timer(object):
+    """
+    A callback scheduled on the engine's loop.
+    """
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Stop the callback from running (if it has not already).
+        """
+        self.cancelled = True
+
+
+class Connection(object):
+    """
+    One peer connection: outgoing ones know the peer's identity, incoming ones are only read from.
+    """
+
+    def __init__(self, sock, identity=None, connecting=False):
+        self.sock = sock
+        self.identity = identity
+        self.reader = FrameReader()
+        self.writer = FrameWriter()
+        self.connecting = connecting  # non-blocking connect still in progress
+        self.timer = None  # connect timeout
+        self.events = selectors.EVENT_WRITE if connecting else selectors.EVENT_READ
+        self.closing = False  # on its way out: takes no new messages (see PeerEngine.shut_down and finish)
+        self.closed = False
+
+    def idle(self):
+        """
+        :return: True if nothing is being written to this connection (by us)
+        """
+        return not self.connecting and not self.writer and not self.closing
+
+
+class PeerEngine(object):
+    """
+    Selector loop carrying one-way messages between peers over persistent connections.
+
+    on_message(message) is called for every message received and on_unreachable(identity) whenever a peer we are
+    sending to cannot be reached (connection refused, reset, timed out, or too far behind), and so anything queued to
+    it was lost. Both are called on the loop thread, as are the callbacks given to call_soon and call_later; send and
+    call_later must only be called from the loop thread, call_soon from anywhere. An exception from any of them is
+    printed and the loop carries on, since it is the only thread that can answer the other peers.
+
+    Sends to more peers than max_connections all get there, a few connections at a time:
+
+    >>> received = []
+    >>> peers = [PeerEngine('localhost', 0, received.append) for _ in range(20)]
+    >>> lost = []
+    >>> engine = PeerEngine('localhost', 0, print, lost.append, max_connections=4)
+    >>> for peer in peers + [engine]:
+    ...     peer.start()
+    >>> for i, peer in enumerate(peers):
+    ...     engine.call_soon(engine.send, i, peer.address, ['ALIVE', i])
+    >>> deadline = time.monotonic() + 5
+    >>> while len(received) < len(peers) and time.monotonic() < deadline:
+    ...     time.sleep(0.01)
+    >>> for peer in peers + [engine]:
+    ...     peer.stop()
+    >>> sorted(message[1] for message in received), lost
+    ([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19], [])
+
+    So do messages from more peers than max_connections, with incoming connections handed back without losing any:
+
+    >>> received = []
+    >>> engine = PeerEngine('localhost', 0, received.append, max_connections=4)
+    >>> peers = [PeerEngine('localhost', 0, print, lost.append) for _ in range(20)]
+    >>> for peer in peers + [engine]:
+    ...     peer.start()
+    >>> for i, peer in enumerate(peers):
+    ...     for j in range(10):
+    ...         peer.call_soon(peer.send, 'engine', engine.address, ['ALIVE', i, j])
+    >>> deadline = time.monotonic() + 10
+    >>> while len(received) < 200 and time.monotonic() < deadline:
+    ...     time.sleep(0.01)
+    >>> for peer in peers + [engine]:
+    ...     peer.stop()
+    >>> len(received), len(set(map(tuple, received))), lost
+    (200, 200, [])
+
+    A callback that raises does not stop the loop:
+
+    >>> engine = PeerEngine('localhost', 0, print)
+    >>> engine.start()
+    >>> engine.call_soon(int, 'not a number'); time.sleep(0.5)
+    peer engine: int failed
+    >>> engine.thread.is_alive()
+    True
+    >>> engine.stop()
+    """
+
+    def __init__(self, host, port, on_message, on_unreachable=None, max_connections=MAX_CONNECTIONS,
+                 max_queued=MAX_QUEUED, connect_timeout=CONNECT_TIMEOUT):
+        """
+        :param host: host to listen on
+        :param port: port to listen on (0 for any)
+        :param on_message: function (message) called for every message received
+        :param on_unreachable: function (identity) called when a peer cannot be sent to
+        :param max_connections: open peer connections before the least recently used idle one is closed
+        :param max_queued: bytes waiting to go to one peer before we give up on it
+        :param connect_timeout: seconds to establish an outgoing connection
+        """
+        self.on_message = on_message
+        self.on_unreachable = on_unreachable
+        self.max_connections = max_connections
+        self.max_queued = max_queued
+        self.connect_timeout = connect_timeout
+        self.selector = selectors.DefaultSelector()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(BACKLOG)
+        self.listener.setblocking(False)
+        self.address = self.listener.getsockname()
+        self.selector.register(self.listener, selectors.EVENT_READ, 'accept')
+        self.waker, self.wake_sock = socket.socketpair()  # call_soon from other threads writes to wake_sock
+        self.waker.setblocking(False)
+        self.selector.register(self.waker, selectors.EVENT_READ, 'wake')
+        self.outgoing = {}  # Connection indexed by peer identity
+        self.waiting = collections.OrderedDict()  # (address, [frames]) to peers waiting for a free connection slot
+        self.accepting = True  # False while the listener is unregistered for want of a slot
+        self.closing = set()  # incoming connections we have shut down, waiting for the peer to close them
+        self.recent = collections.OrderedDict()  # every open Connection, least recently used first
+        self.timers = []  # heap of (when, sequence, Timer)
+        self.sequence = itertools.count()  # tie breaker for timers due at the same time
+        self.ready = collections.deque()  # (callback, args) posted by call_soon
+        self.ready_lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """
+        Run the loop on a thread of its own.
+        """
+        self.thread = threading.Thread(target=self.run, name='peer-engine')
+        self.thread.start()
+
+    def run(self):
+        """
+        Run the loop until stop() is called.
+        """
+        self.running = True
+        while self.running:
+            timeout = POLL_INTERVAL
+            if self.timers:
+                timeout = max(0.0, min(timeout, self.timers[0][0] - self.time()))
+            for key, mask in self.selector.select(timeout):
+                if key.data == 'accept':
+                    self.accept()
+                elif key.data == 'wake':
+                    self.drain_wakeups()
+                else:
+                    if mask & selectors.EVENT_WRITE:
+                        self.write(key.data)
+                    if mask & selectors.EVENT_READ:
+                        self.read(key.data)
+            self.run_ready()
+            self.run_timers()
+        self.close()
+
+    def stop(self):
+        """
+        Ask the loop to finish (from any thread).
+        """
+        self.call_soon(setattr, self, 'running', False)
+
+    @staticmethod
+    def time():
+        """
+        :return: the clock timers are scheduled on
+        """
+        return time.monotonic()
+
+    def call_soon(self, callback, *args):
+        """
+        Run callback(*args) on the loop thread as soon as possible. Safe to call from any thread.
+        """
+        with self.ready_lock:
+            self.ready.append((callback, args))
+        try:
+            self.wake_sock.send(b'\0')
+        except OSError:
+            pass  # wakeup already pending (buffer full) or we are shutting down
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run callback(*args) on the loop thread after delay seconds.
+
+        :return: Timer that can be cancelled
+        """
+        timer = Timer(self.time() + delay, callback, args)
+        heapq.heappush(self.timers, (timer.when, next(self.sequence), timer))
+        return timer
+
+    def send(self, identity, address, message):
+        """
+        Queue a message to the given peer on our persistent connection to it, connecting first if need be.
+
+        :param identity: the peer's process id
+        :param address: the peer's listener (host, port)
+        :param message: anything wire can encode
+        """
+        frame = wire.encode(message)
+        conn = self.outgoing.get(identity)
+        if conn is None:
+            waiting = self.waiting.get(identity)
+            if waiting is None and not self.make_room():
+                waiting = self.waiting[identity] = (address, [])
+            if waiting is not None:
+                waiting[1].append(frame)
+                if sum(len(queued) for queued in waiting[1]) > self.max_queued:
+                    del self.waiting[identity]
+                    self.unreachable(identity)
+                return
+            conn = self.connect(identity, address)
+            if conn is None:
+                return
+        conn.writer.queue(frame)
+        if len(conn.writer) > self.max_queued:
+            self.fail(conn)
+            return
+        self.recent.move_to_end(conn)
+        if not conn.connecting:
+            self.write(conn)
+
+    def connect(self, identity, address):
+        """
+        Start a non-blocking connection to a peer.
+
+        :return: the new Connection, or None if it failed straight away (after reporting the peer unreachable)
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        conn = Connection(sock, identity, connecting=True)
+        code = sock.connect_ex(address)
+        if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            self.unreachable(identity)
+            return None
+        self.add(conn)
+        self.outgoing[identity] = conn
+        conn.timer = self.call_later(self.connect_timeout, self.connect_timed_out, conn)
+        return conn
+
+    def connect_timed_out(self, conn):
+        if conn.connecting and not conn.closed:
+            self.fail(conn)
+
+    def accept(self):
+        """
+        Accept every pending connection from a peer (while there is room for it).
+        """
+        while True:
+            if not self.make_room():
+                self.selector.unregister(self.listener)  # leave the rest in the backlog until a slot frees up
+                self.accepting = False
+                return
+            try:
+                sock, _ = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return  # e.g. out of file descriptors; the peer will retry
+            sock.setblocking(False)
+            self.add(Connection(sock))
+
+    def make_room(self):
+        """
+        Make sure there is a free connection slot, closing the least recently used idle outgoing connection if need
+        be. Failing that, start handing back the least recently used incoming one, whose slot frees up (and is
+        given to whoever is waiting) once the peer has closed it.
+
+        :return: False if there is no slot free right now
+        """
+        if len(self.recent) < self.max_connections:
+            return True
+        incoming = None
+        for conn in self.recent:
+            if conn.idle():
+                if conn.identity is not None:
+                    self.drop(conn, admit=False)  # nothing in flight on it; the slot is our caller's
+                    return True
+                if incoming is None:
+                    incoming = conn
+        if incoming is not None and not self.closing:
+            self.shut_down(incoming)
+        return False
+
+    def shut_down(self, conn):
+        """
+        Ask the peer to close an incoming connection by shutting down our side of it, reading until it does.
+        """
+        try:
+            conn.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            self.drop(conn)
+            return
+        conn.closing = True
+        self.closing.add(conn)
+        conn.timer = self.call_later(CLOSE_TIMEOUT, self.close_timed_out, conn)
+
+    def close_timed_out(self, conn):
+        if not conn.closed:
+            self.drop(conn)
+
+    def finish(self, conn):
+        """
+        The peer has shut down an outgoing connection: send new messages on a new one, and close this one once
+        what is queued on it has been written.
+        """
+        if self.outgoing.get(conn.identity) is conn:
+            del self.outgoing[conn.identity]
+        conn.closing = True
+        conn.events = selectors.EVENT_WRITE  # nothing more to read
+        self.selector.modify(conn.sock, conn.events, conn)
+
+    def add(self, conn):
+        """
+        Register a new connection (make_room first).
+        """
+        self.recent[conn] = None
+        self.selector.register(conn.sock, conn.events, conn)
+
+    def admit_waiting(self):
+        """
+        Use any free connection slots for the peers waiting on one, then for incoming connections.
+        """
+        while self.waiting and self.make_room():
+            identity, (address, frames) = self.waiting.popitem(last=False)
+            conn = self.connect(identity, address)
+            if conn is not None:
+                for frame in frames:
+                    conn.writer.queue(frame)
+        if not self.accepting and not self.waiting and self.make_room():
+            self.selector.register(self.listener, selectors.EVENT_READ, 'accept')
+            self.accepting = True
+
+    def read(self, conn):
+        """
+        Deliver whatever messages have arrived on the given connection.
+        """
+        if conn.closed:
+            return
+        try:
+            payloads, eof = conn.reader.read_from(conn.sock)
+        except (OSError, ValueError):
+            self.fail(conn)
+            return
+        if payloads:
+            self.recent.move_to_end(conn)
+        for payload in payloads:
+            try:
+                message = wire.decode(payload, allow_pickle=False)  # every peer speaks binary
+            except ValueError:
+                continue  # garbage from some peer is no reason to stop talking to the rest
+            self.guard(self.on_message, (message,))
+        if eof:
+            if conn.writer and conn.identity is not None:
+                self.finish(conn)  # the peer wants the slot back, but is still reading what we have to send
+            else:
+                self.drop(conn)
+
+    def write(self, conn):
+        """
+        Finish connecting if need be, then write as much of the queued messages as the socket will take.
+        """
+        if conn.closed:
+            return
+        try:
+            if conn.connecting:
+                code = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code:
+                    raise OSError(code, 'connect failed')
+                conn.connecting = False
+                conn.timer.cancel()
+            conn.writer.write_to(conn.sock)
+        except OSError:
+            self.fail(conn)
+            return
+        if conn.closing and not conn.writer:
+            self.drop(conn)
+            return
+        events = (0 if conn.closing else selectors.EVENT_READ) | (selectors.EVENT_WRITE if conn.writer else 0)
+        if events != conn.events:
+            conn.events = events
+            self.selector.modify(conn.sock, events, conn)
+        if not conn.writer and (self.waiting or not self.accepting):
+            self.admit_waiting()  # this one is idle now, so can make way
+
+    def fail(self, conn):
+        """
+        Drop a connection that broke, telling the owner if it was one we were sending on.
+        """
+        self.drop(conn)
+        if conn.identity is not None:
+            self.unreachable(conn.identity)
+
+    def unreachable(self, identity):
+        if self.on_unreachable is not None:
+            self.guard(self.on_unreachable, (identity,))
+
+    @staticmethod
+    def guard(callback, args):
+        """
+        Run callback(*args), printing rather than raising whatever it raises so the loop keeps going.
+        """
+        try:
+            callback(*args)
+        except Exception:
+            print('peer engine: {} failed'.format(getattr(callback, '__qualname__', callback)))
+            traceback.print_exc()
+
+    def drop(self, conn, admit=True):
+        """
+        Unregister and close the given connection (anything still queued on it is lost).
+
+        :param admit: whether to hand the freed slot to a peer waiting for one
+        """
+        if conn.closed:
+            return
+        conn.closed = True
+        if conn.timer is not None:
+            conn.timer.cancel()
+        if conn.identity is not None and self.outgoing.get(conn.identity) is conn:
+            del self.outgoing[conn.identity]
+        self.recent.pop(conn, None)
+        self.closing.discard(conn)
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+        if admit and (self.waiting or not self.accepting):
+            self.admit_waiting()
+
+    def drain_wakeups(self):
+        try:
+            while self.waker.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def run_ready(self):
+        """
+        Run the callbacks posted with call_soon.
+        """
+        with self.ready_lock:
+            ready, self.ready = self.ready, collections.deque()
+        for callback, args in ready:
+            self.guard(callback, args)
+
+    def run_timers(self):
+        """
+        Run the timers that are due.
+        """
+        now = self.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                self.guard(timer.callback, timer.args)
+
+    def close(self):
+        """
+        Close every socket. Called by run() on its way out.
+        """
+        self.waiting.clear()
+        self.accepting = True  # nothing to admit on the way out
+        for conn in list(self.recent):
+            self.drop(conn)
+        self.selector.close()
+        self.listener.close()
+        self.waker.close()
+        self.wake_sock.close()
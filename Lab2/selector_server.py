@@ -0,0 +1,186 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-02
+
+Event-driven alternative to socketserver.TCPServer for the request/response daemons.
+
+A single thread multiplexes every client connection through a selector, so one slow or stalled client
+no longer holds up everybody queued behind it. Each connection gets a deadline; connections that go
+that long without delivering a request are dropped.
+
+This module is duplicated in Lab1 and Lab2 so that each lab stays runnable on its own; keep the copies identical.
+"""
+import collections
+import selectors
+import socket
+import time
+
+from framing import MAX_REQUEST, FrameReader, FrameWriter
+
+BACKLOG = 1024  # socket listen arg
+READ_TIMEOUT = 5.0  # seconds a client has to send its next request (or take our reply)
+
+
+class Connection(object):
+    """
+    Per-client state for the SelectorServer.
+    """
+
+    def __init__(self, sock, address, deadline):
+        self.sock = sock
+        self.address = address
+        self.deadline = deadline
+        self.reader = FrameReader(MAX_REQUEST)  # requests are small; do not let a client make us buffer more
+        self.writer = FrameWriter()
+        self.events = selectors.EVENT_READ
+        self.eof = False  # client has finished sending
+        self.closed = False
+
+
+class SelectorServer(object):
+    """
+    Serves a framed request/response protocol on a listening socket with one selector loop.
+
+    The respond callable is given each request payload and the client address and returns the reply payload.
+    Clients may pipeline any number of requests on a connection; replies go back in order and the connection
+    is closed once the client has closed its side and every reply has been written.
+    """
+
+    def __init__(self, server_address, respond, read_timeout=READ_TIMEOUT, backlog=BACKLOG):
+        """
+        :param server_address: (host, port) to listen on
+        :param respond: function (request_payload, client_address) -> reply_payload
+        :param read_timeout: seconds each connection may sit idle before it is dropped
+        :param backlog: socket listen arg
+        """
+        self.respond = respond
+        self.read_timeout = read_timeout
+        self.selector = selectors.DefaultSelector()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(server_address)
+        self.listener.listen(backlog)
+        self.listener.setblocking(False)
+        self.server_address = self.listener.getsockname()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        # (deadline, connection) pairs; every deadline is now + read_timeout, so arrival order is deadline order
+        self.deadlines = collections.deque()
+        self.running = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Run the selector loop until shutdown() is called.
+
+        :param poll_interval: longest time to block in select (so shutdown and deadlines are noticed)
+        """
+        self.running = True
+        while self.running:
+            self.expire(time.monotonic())
+            timeout = poll_interval
+            if self.deadlines:
+                timeout = max(0.0, min(timeout, self.deadlines[0][0] - time.monotonic()))
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    self.accept()
+                    continue
+                if mask & selectors.EVENT_READ:
+                    self.read(key.data)
+                if mask & selectors.EVENT_WRITE:
+                    self.write(key.data)
+
+    def shutdown(self):
+        """
+        Ask serve_forever to return after its current iteration.
+        """
+        self.running = False
+
+    def close(self):
+        """
+        Close the listener and every open client connection.
+        """
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                self.drop(key.data)
+        self.selector.close()
+        self.listener.close()
+
+    def accept(self):
+        """
+        Accept every pending connection on the listener.
+        """
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            conn = Connection(sock, address, time.monotonic() + self.read_timeout)
+            self.deadlines.append((conn.deadline, conn))
+            self.selector.register(sock, conn.events, conn)
+
+    def read(self, conn):
+        """
+        Read whatever requests have arrived on the given connection and queue up their replies.
+        """
+        if conn.closed:
+            return
+        try:
+            requests, conn.eof = conn.reader.read_from(conn.sock)
+        except (OSError, ValueError):
+            self.drop(conn)
+            return
+        for payload in requests:
+            conn.writer.queue(self.respond(payload, conn.address))
+        if requests:
+            conn.deadline = time.monotonic() + self.read_timeout
+            self.deadlines.append((conn.deadline, conn))
+        self.write(conn)
+
+    def write(self, conn):
+        """
+        Write as much of the pending replies as the socket will take, then adjust what we wait for.
+        """
+        if conn.closed:
+            return
+        try:
+            conn.writer.write_to(conn.sock)
+        except OSError:
+            self.drop(conn)
+            return
+        events = (0 if conn.eof else selectors.EVENT_READ) | (selectors.EVENT_WRITE if conn.writer else 0)
+        if not events:
+            self.drop(conn)
+        elif events != conn.events:
+            conn.events = events
+            self.selector.modify(conn.sock, events, conn)
+
+    def expire(self, now):
+        """
+        Drop the connections whose deadline has passed.
+        """
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, conn = self.deadlines.popleft()
+            if deadline == conn.deadline:
+                self.drop(conn)
+
+    def drop(self, conn):
+        """
+        Unregister and close the given connection.
+        """
+        if conn.closed:
+            return
+        conn.closed = True
+        self.selector.unregister(conn.sock)
+        try:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        conn.sock.close()
@@ -0,0 +1,177 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: f19-01
+
+In-memory tracing of Lab2 election traffic.
+
+Every message sent and received, every failed delivery and every state transition goes into a fixed-size ring buffer as a tuple (no
+formatting, no I/O), and the latencies that matter are folded into histograms as they happen: how long each type of
+message took to handle, how long each request (ELECTION, GRANT, PULL) waited for its reply, and how long a peer spent
+in each state. dump() writes the lot as JSON, when asked to or at exit, for offline analysis.
+"""
+import collections
+import json
+import os
+import time
+
+CAPACITY = 65536  # most recent events kept
+BUCKETS = 32  # histogram buckets: [0, 1) us, [1, 2) us, [2, 4) us, ... [2**30, inf) us
+REPLIES = {'ELECTION': 'OK', 'GRANT': 'COORDINATOR', 'PULL': 'PUSH'}  # request -> the reply it is timed against
+REQUESTS = {reply: request for request, reply in REPLIES.items()}
+MAX_PENDING = 4096  # requests awaiting a reply that we keep the send time of
+
+
+class Histogram(object):
+    """
+    Latencies in power-of-two microsecond buckets, so recording one is O(1) and the memory is fixed.
+
+    >>> h = Histogram()
+    >>> for seconds in (0.000003, 0.0001, 0.0001, 0.002):
+    ...     h.add(seconds)
+    >>> h.count, h.percentile(50), h.percentile(100), h.max
+    (4, 0.128, 2.048, 0.002)
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0  # seconds
+        self.max = 0.0  # seconds
+
+    def add(self, seconds):
+        """
+        Record one latency.
+        """
+        bucket = int(seconds * 1e6).bit_length() if seconds > 0 else 0
+        self.counts[bucket if bucket < BUCKETS else BUCKETS - 1] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        :param p: percentile (0 to 100)
+        :return: upper bound in milliseconds of the bucket the p-th percentile latency falls in (None if empty)
+        """
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return (1 << bucket) / 1000
+        return (1 << (BUCKETS - 1)) / 1000
+
+    def to_dict(self):
+        """
+        :return: summary and non-empty buckets (indexed by their upper bound in microseconds), for JSON
+        """
+        return {'count': self.count,
+                'mean_ms': round(self.total / self.count * 1000, 3) if self.count else None,
+                'max_ms': round(self.max * 1000, 3),
+                'p50_ms': self.percentile(50), 'p90_ms': self.percentile(90), 'p99_ms': self.percentile(99),
+                'buckets_us': {1 << bucket: count for bucket, count in enumerate(self.counts) if count}}
+
+
+class Tracer(object):
+    """
+    Ring buffer of one peer's events plus its latency histograms.
+
+    Meant to be called from the one thread that runs the peer's state machine; dump() may be called from any
+    thread (it only takes copies, which the GIL makes atomic).
+
+    >>> clock = iter([0.0, 0.001, 0.004, 0.0045, 0.005, 0.006, 0.007]).__next__
+    >>> tracer = Tracer(clock=clock)
+    >>> tracer.sent('ELECTION', (1, 2))
+    >>> tracer.transition('WAIT_OK')
+    >>> tracer.received('OK', (1, 2), tracer.now())
+    >>> tracer.unreachable((3, 4))
+    >>> tracer.replies['ELECTION'].count, tracer.states['IDLE'].max, len(tracer.events), tracer.snapshot()['unreachable']
+    (1, 0.004, 4, {'(3, 4)': 1})
+    """
+
+    def __init__(self, capacity=CAPACITY, clock=time.monotonic, state='IDLE'):
+        """
+        :param capacity: most recent events kept
+        :param clock: function returning seconds (the peer's transport time, virtual in the simulator)
+        :param state: the state the peer starts in
+        """
+        self.events = collections.deque(maxlen=capacity)  # (time, 'send'|'recv'|'lost'|'state', protocol or state, peer, ...)
+        self.now = clock
+        self.handling = collections.defaultdict(Histogram)  # seconds to handle each type of message received
+        self.replies = collections.defaultdict(Histogram)  # seconds from each type of request to its reply
+        self.states = collections.defaultdict(Histogram)  # seconds spent in each state
+        self.pending = {}  # send time of requests awaiting a reply, indexed by (peer, reply protocol)
+        self.unreachable_counts = collections.Counter()  # failed deliveries indexed by peer
+        self.state = state
+        self.state_since = clock()
+
+    def sent(self, protocol, peer):
+        """
+        We queued a message for a peer.
+        """
+        now = self.now()
+        self.events.append((now, 'send', protocol, peer))
+        reply = REPLIES.get(protocol)
+        if reply is not None:
+            if len(self.pending) >= MAX_PENDING:
+                self.pending.clear()
+            self.pending[(peer, reply)] = now
+
+    def received(self, protocol, peer, started):
+        """
+        We finished handling a message from a peer.
+
+        :param started: time (on our clock) we started handling it
+        """
+        now = self.now()
+        self.events.append((started, 'recv', protocol, peer, now - started))
+        self.handling[protocol].add(now - started)
+        sent = self.pending.pop((peer, protocol), None)
+        if sent is not None:
+            self.replies[REQUESTS[protocol]].add(started - sent)
+
+    def unreachable(self, peer):
+        """
+        The transport could not deliver to a peer.
+        """
+        self.events.append((self.now(), 'lost', None, peer))
+        self.unreachable_counts[peer] += 1
+
+    def transition(self, state):
+        """
+        The peer moved to a new state.
+
+        :param state: name of the state
+        """
+        now = self.now()
+        self.states[self.state].add(now - self.state_since)
+        self.events.append((now, 'state', state, self.state))
+        self.state = state
+        self.state_since = now
+
+    def snapshot(self):
+        """
+        :return: the events and histograms so far, as JSON-ready data (wall_time pairs our clock's time with the
+                 time of day, to line up dumps from different peers)
+        """
+        events = list(self.events)
+        return {'time': self.now(), 'wall_time': time.time(), 'capacity': self.events.maxlen, 'state': self.state,
+                'handling': {protocol: h.to_dict() for protocol, h in dict(self.handling).items()},
+                'replies': {protocol: h.to_dict() for protocol, h in dict(self.replies).items()},
+                'states': {state: h.to_dict() for state, h in dict(self.states).items()},
+                'unreachable': {str(peer): count for peer, count in dict(self.unreachable_counts).items()},
+                'events': events}
+
+    def dump(self, path):
+        """
+        Write snapshot() to a JSON file (replacing it as a whole, so a reader never sees half of one).
+        """
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(self.snapshot(), f, default=str)
+        os.replace(temp, path)
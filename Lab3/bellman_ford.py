@@ -3,8 +3,24 @@ CPSC 5520, Seattle University
 This is free and unencumbered software released into the public domain.
 :Authors: Nicholas Jones
 :Version: fq19-01
+
+Two interchangeable engines: BellmanFord walks the graph's dicts in plain Python, VectorBellmanFord (which needs
+numpy) does each relaxation pass as a handful of array operations. Both take the same graph and return the same
+(dist, prev, neg_edge); an origin of None means a virtual super-source with a 0-weight edge to every vertex, so
+negative cycles are found wherever they are. IncrementalBellmanFord keeps one engine's answer up to date as edges
+change. negative_cycle follows prev from the edge a run reports to the negative cycle (arbitrage opportunity)
+behind it, and find_disjoint_cycles lists vertex-disjoint negative cycles that between them touch every negative
+cycle in the graph, most profitable first.
 """
 
+from collections import deque
+import math
+
+try:
+	import numpy as np
+except ImportError: # only VectorBellmanFord needs it
+	np = None
+
 class BellmanFord(object):
 	
 	def __init__(self, init_graph):
@@ -16,20 +32,26 @@ class BellmanFord(object):
 	
 	def shortest_paths(self, origin, tolerance=0):
 		"""
+		:param origin: vertex to find the shortest paths from, or None for a virtual super-source
+		:param tolerance: how much shorter a path has to be to count as shorter
+		:return: (dist, prev, neg_edge): distance and previous vertex by vertex, and an edge (from, to) that can
+			still be relaxed after V-1 passes (so is on or leads from a negative cycle), or None
 		"""
 		# construct a list of distances
 		dist = {}
 		prev = {}
 		
-		# initialize the shortest distance to infinity and previous vertex to None
+		# initialize the shortest distance to infinity (0 from the super-source) and previous vertex to None
 		for vertex in self.graph:
-			dist[vertex] = float("Inf")
+			dist[vertex] = float("Inf") if origin is not None else 0
 			prev[vertex] = None
 		
 		# the shortest distance to the origin from the origin is 0
-		dist[origin] = 0
+		if origin is not None:
+			dist[origin] = 0
+		passes = self.vertices - 1 if origin is not None else self.vertices # the super-source is one more vertex
 		
-		for i in range(self.vertices - 1):
+		for i in range(passes):
 			for curr1 in self.graph:
 				for curr2 in self.graph[curr1]:
 					weight = self.graph[curr1][curr2]["price"]
@@ -48,4 +70,421 @@ class BellmanFord(object):
 					# we found a negative path, return it
 					return dist, prev, (curr1, curr2)
 					
-		return dist, prev, None
\ No newline at end of file
+		return dist, prev, None
+
+class VectorBellmanFord(object):
+	"""
+	Bellman-Ford over edge arrays built once from the graph: each pass relaxes every edge at once, and the passes
+	stop as soon as one changes nothing (in which case there is no negative cycle to look for).
+	
+	>>> engine = VectorBellmanFord if np is not None else BellmanFord # numpy is optional, so are these examples
+	>>> graph = {'USD': {'EUR': {'price': 0.1}}, 'EUR': {'USD': {'price': -0.1}, 'GBP': {'price': 0.2}},
+	...          'GBP': {'USD': {'price': -0.5}}}
+	>>> dist, prev, neg_edge = engine(graph).shortest_paths('USD', 1e-12)
+	>>> neg_edge is not None, BellmanFord(graph).shortest_paths('USD', 1e-12)[2] is not None
+	(True, True)
+	>>> del graph['GBP']['USD']
+	>>> engine(graph).shortest_paths('USD') == BellmanFord(graph).shortest_paths('USD')
+	True
+	"""
+	
+	def __init__(self, init_graph):
+		"""
+		:param init_graph: the graph to use, {from: {to: {"price": weight, ...}}} as for BellmanFord
+		"""
+		if np is None:
+			raise ImportError("VectorBellmanFord needs numpy")
+		self.graph = init_graph
+		
+		# give every vertex an index (in the graph's order, then any that only appear as destinations)
+		self.names = list(init_graph)
+		self.index = {name: i for i, name in enumerate(self.names)}
+		for curr1 in init_graph:
+			for curr2 in init_graph[curr1]:
+				if curr2 not in self.index:
+					self.index[curr2] = len(self.names)
+					self.names.append(curr2)
+		self.vertices = len(self.names)
+		
+		# edges in the graph's order, which is the order the final check reports a violating edge in
+		src, dst, weight = [], [], []
+		for curr1 in init_graph:
+			for curr2 in init_graph[curr1]:
+				src.append(self.index[curr1])
+				dst.append(self.index[curr2])
+				weight.append(init_graph[curr1][curr2]["price"])
+		self.src = np.array(src, dtype=np.intp)
+		self.dst = np.array(dst, dtype=np.intp)
+		self.weight = np.array(weight, dtype=np.float64)
+		
+		# the same edges grouped by destination, so the best way into each vertex is one reduceat
+		order = np.argsort(self.dst, kind="stable")
+		self.by_dst_src = self.src[order]
+		self.by_dst_weight = self.weight[order]
+		by_dst = self.dst[order]
+		self.starts = np.flatnonzero(np.r_[True, by_dst[1:] != by_dst[:-1]]) if len(order) else order
+		self.targets = by_dst[self.starts]
+		self.positions = np.arange(len(order))
+	
+	def shortest_paths(self, origin, tolerance=0):
+		"""
+		:param origin: vertex to find the shortest paths from
+		:param tolerance: how much shorter a path has to be to count as shorter
+		:return: (dist, prev, neg_edge) as for BellmanFord: distance and previous vertex by vertex, and an edge
+			(from, to) that can still be relaxed after V-1 passes (so is on or leads from a negative cycle), or None
+		"""
+		if origin is not None and origin not in self.index: # nothing to relax from it
+			dist = dict.fromkeys(self.names, math.inf)
+			prev = dict.fromkeys(self.names)
+			dist[origin] = 0
+			prev[origin] = None
+			return dist, prev, None
+		
+		prev = np.full(self.vertices, -1, dtype=np.intp)
+		if origin is None: # a 0-weight edge from the super-source to every vertex
+			dist = np.zeros(self.vertices)
+		else:
+			dist = np.full(self.vertices, np.inf)
+			dist[self.index[origin]] = 0
+		
+		if len(self.src):
+			for i in range(self.vertices if origin is None else self.vertices - 1):
+				cand = dist[self.by_dst_src] + self.by_dst_weight
+				best = np.minimum.reduceat(cand, self.starts)
+				improved = best + tolerance < dist[self.targets]
+				if not improved.any():
+					break
+				# which edge gave each target its best distance (the first one, if there is a tie)
+				hits = np.where(cand == np.repeat(best, np.diff(np.r_[self.starts, len(cand)])), self.positions,
+						len(cand))
+				first = np.minimum.reduceat(hits, self.starts)[improved]
+				dist[self.targets[improved]] = best[improved]
+				prev[self.targets[improved]] = self.by_dst_src[first]
+			
+		# negative path detection
+		if len(self.src):
+			violating = np.flatnonzero(dist[self.src] + self.weight + tolerance < dist[self.dst])
+		else:
+			violating = ()
+		neg_edge = None
+		if len(violating):
+			neg_edge = (self.names[self.src[violating[0]]], self.names[self.dst[violating[0]]])
+		
+		names = self.names
+		return (dict(zip(names, dist.tolist())),
+				{names[i]: (names[p] if p >= 0 else None) for i, p in enumerate(prev.tolist())}, neg_edge)
+
+class IncrementalBellmanFord(object):
+	"""
+	Shortest paths from one origin kept up to date as edges change, instead of rerunning Bellman-Ford.
+	
+	The caller changes the graph in place and reports each edge it added, re-weighted or deleted with
+	edge_changed. shortest_paths then only does the work the changes call for: the subtrees of the shortest-path
+	tree hanging off a changed tree edge are reset and re-seeded from their other incoming edges, and relaxation
+	spreads out (a queue, as in SPFA) from those and from the changed edges alone. A relaxation that would make
+	a vertex its own ancestor closes a negative cycle, which is reported as (dist, prev, neg_edge) like the engines
+	do. It starts over with a full run of the engine the first time, after a negative cycle (the distances mean
+	nothing then), and if the incremental work grows past what a full run would cost.
+	
+	>>> graph = {'USD': {'EUR': {'price': 0.1}}, 'EUR': {'USD': {'price': -0.1}}}
+	>>> detector = IncrementalBellmanFord(graph, 'USD', 1e-12)
+	>>> detector.shortest_paths()[2] is None
+	True
+	>>> graph['EUR']['GBP'] = {'price': 0.2}
+	>>> graph['GBP'] = {'USD': {'price': -0.5}}
+	>>> detector.edge_changed('EUR', 'GBP'); detector.edge_changed('GBP', 'USD')
+	>>> detector.shortest_paths()[2] is not None, detector.full_runs
+	(True, 1)
+	>>> graph['GBP']['USD']['price'] = -0.25
+	>>> detector.edge_changed('GBP', 'USD')
+	>>> dist, prev, neg_edge = detector.shortest_paths()
+	>>> neg_edge, round(dist['GBP'], 6), detector.full_runs
+	(None, 0.3, 2)
+	>>> del graph['EUR']['GBP']
+	>>> detector.edge_changed('EUR', 'GBP')
+	>>> dist, prev, neg_edge = detector.shortest_paths()
+	>>> neg_edge, dist['GBP'], prev['GBP'], detector.full_runs
+	(None, inf, None, 2)
+	"""
+	
+	def __init__(self, graph, origin, tolerance=0, engine=BellmanFord):
+		"""
+		:param graph: the graph to follow, {from: {to: {"price": weight, ...}}}; changed in place by the caller
+		:param origin: vertex to find the shortest paths from, or None for a virtual super-source
+		:param tolerance: how much shorter a path has to be to count as shorter
+		:param engine: BellmanFord or VectorBellmanFord, for the full runs
+		"""
+		self.graph = graph
+		self.origin = origin
+		self.tolerance = tolerance
+		self.engine = engine
+		self.unreached = math.inf if origin is not None else 0 # distance of a vertex with no path to it yet
+		self.dist = {}
+		self.prev = {}
+		self.neg_edge = None
+		self.incoming = {} # vertices with an edge to each vertex
+		self.changed = set() # edges (from, to) changed since the last shortest_paths
+		self.full = True # the next shortest_paths has to start over
+		self.full_runs = 0
+	
+	def edge_changed(self, curr1, curr2):
+		"""
+		Note that the edge curr1 -> curr2 was added, re-weighted or deleted in the graph.
+		"""
+		self.changed.add((curr1, curr2))
+	
+	def shortest_paths(self):
+		"""
+		:return: (dist, prev, neg_edge) as for BellmanFord.shortest_paths (the dicts are ours, do not change them)
+		"""
+		changed, self.changed = self.changed, set()
+		if self.full or self.neg_edge is not None or not self.update(changed):
+			self.recompute()
+		return self.dist, self.prev, self.neg_edge
+	
+	def recompute(self):
+		self.dist, self.prev, self.neg_edge = self.engine(self.graph).shortest_paths(self.origin, self.tolerance)
+		self.incoming = {}
+		for curr1 in self.graph:
+			for curr2 in self.graph[curr1]:
+				self.incoming.setdefault(curr2, set()).add(curr1)
+		self.full = False
+		self.full_runs += 1
+	
+	def update(self, changed):
+		"""
+		Bring dist and prev up to date with the changed edges.
+		
+		:return: False if it gave up (too much work), leaving a full recompute to do
+		"""
+		dist, prev, graph = self.dist, self.prev, self.graph
+		for curr1, curr2 in changed:
+			for vertex in (curr1, curr2):
+				if vertex not in dist:
+					dist[vertex] = self.unreached
+					prev[vertex] = None
+			if curr2 in graph.get(curr1, ()):
+				self.incoming.setdefault(curr2, set()).add(curr1)
+			else:
+				self.incoming.get(curr2, set()).discard(curr1)
+		
+		# the shortest paths through a changed tree edge may be gone: forget everything below it
+		reset = {curr2 for curr1, curr2 in changed if prev.get(curr2) == curr1}
+		if reset:
+			children = {}
+			for vertex, parent in prev.items():
+				if parent is not None:
+					children.setdefault(parent, []).append(vertex)
+			stack = list(reset)
+			reset = set()
+			while stack:
+				vertex = stack.pop()
+				if vertex not in reset:
+					reset.add(vertex)
+					stack.extend(children.get(vertex, ()))
+			for vertex in reset:
+				dist[vertex] = self.unreached
+				prev[vertex] = None
+		
+		# relax outwards from the changed edges and from the other ways into the vertices just reset
+		budget = len(dist) * max(1, sum(len(edges) for edges in graph.values())) # what a full run would cost
+		queue = deque()
+		queued = set()
+		candidates = list(changed)
+		for vertex in reset:
+			candidates.extend((parent, vertex) for parent in self.incoming.get(vertex, ()) if parent not in reset)
+		for curr1, curr2 in candidates:
+			if self.relax(curr1, curr2) and curr2 not in queued:
+				queue.append(curr2)
+				queued.add(curr2)
+		if self.origin is None: # the super-source's edge makes every vertex just reset a new way in to its neighbours
+			for vertex in reset - queued:
+				queue.append(vertex)
+				queued.add(vertex)
+		while queue and self.neg_edge is None:
+			curr1 = queue.popleft()
+			queued.discard(curr1)
+			for curr2 in graph.get(curr1, ()):
+				budget -= 1
+				if self.relax(curr1, curr2) and curr2 not in queued:
+					queue.append(curr2)
+					queued.add(curr2)
+			if budget < 0:
+				return False
+		return True
+	
+	def relax(self, curr1, curr2):
+		"""
+		:return: True if the edge curr1 -> curr2 (if it is still there) gave curr2 a shorter distance
+		"""
+		edge = self.graph.get(curr1, {}).get(curr2)
+		if edge is None or self.dist[curr1] == math.inf:
+			return False
+		distance = self.dist[curr1] + edge["price"]
+		if not distance + self.tolerance < self.dist[curr2]:
+			return False
+		
+		# if curr2 is already on the way to curr1, this edge closes a negative cycle
+		ancestor = curr1
+		for i in range(len(self.dist)):
+			if ancestor is None:
+				break
+			if ancestor == curr2:
+				self.neg_edge = (curr1, curr2)
+				break
+			ancestor = self.prev[ancestor]
+		
+		self.dist[curr2] = distance
+		self.prev[curr2] = curr1
+		return self.neg_edge is None
+
+def find_disjoint_cycles(graph, tolerance=0):
+	"""
+	Find a set of vertex-disjoint negative cycles (arbitrage opportunities), wherever they are, in one run.
+	
+	A virtual super-source starts every vertex at distance 0, and edges are relaxed from a queue of vertices whose
+	distance just dropped (as in SPFA) rather than in V-1 full passes. Every V relaxations the predecessor graph
+	is checked for cycles, each of which is a negative cycle; each one found is recorded and its vertices are left
+	out from then on, so the rest of the graph can settle and give up its own cycles. The result is the cycles
+	found that way, each in trading order, ranked by the profit it makes.
+	
+	Cycles that share a currency with one already found are not listed. There can be exponentially many simple
+	negative cycles, so listing them all is not an option on a live feed, and overlapping ones are not separate
+	opportunities anyway: trading round one moves the quotes the other depends on. Disjoint cycles can all be traded
+	at once, and every negative cycle in the graph shares a currency with one of those listed.
+	
+	>>> rates = {('USD', 'EUR'): 0.9, ('EUR', 'JPY'): 125.0, ('JPY', 'USD'): 0.009, ('GBP', 'CHF'): 1.3,
+	...          ('CHF', 'AUD'): 1.5, ('AUD', 'GBP'): 0.52}
+	>>> graph = {}
+	>>> for (curr1, curr2), rate in rates.items():
+	...     graph.setdefault(curr1, {})[curr2] = {"price": -math.log(rate)}
+	...     graph.setdefault(curr2, {})[curr1] = {"price": math.log(rate)}
+	>>> [(round(profit, 4), cycle) for profit, cycle in find_disjoint_cycles(graph, 1e-12)]
+	[(0.014, ['AUD', 'GBP', 'CHF', 'AUD']), (0.0125, ['EUR', 'JPY', 'USD', 'EUR'])]
+	
+	:param graph: {from: {to: {"price": weight, ...}}} where weight is -log(exchange rate)
+	:param tolerance: how much shorter a path has to be to count as shorter
+	:return: [(profit, cycle)], most profitable first, where profit is the fraction gained by trading once around
+		the cycle and cycle is [start, ..., start] (starting from its alphabetically first vertex)
+	"""
+	dist = {}
+	prev = {}
+	for curr1 in graph:
+		dist[curr1] = 0
+		prev[curr1] = None
+		for curr2 in graph[curr1]:
+			dist[curr2] = 0
+			prev[curr2] = None
+	
+	done = set() # vertices on a cycle already found
+	cycles = []
+	queue = deque(dist)
+	queued = set(dist)
+	relaxations = 0
+	while queue:
+		curr1 = queue.popleft()
+		queued.discard(curr1)
+		if curr1 in done:
+			continue
+		for curr2, edge in graph.get(curr1, {}).items():
+			distance = dist[curr1] + edge["price"]
+			if distance + tolerance < dist[curr2] and curr2 not in done:
+				dist[curr2] = distance
+				prev[curr2] = curr1
+				if curr2 not in queued:
+					queue.append(curr2)
+					queued.add(curr2)
+				relaxations += 1
+				if relaxations >= len(dist):
+					relaxations = 0
+					cycles.extend(predecessor_cycles(prev, done))
+	cycles.extend(predecessor_cycles(prev, done))
+	
+	ranked = [(math.exp(-cycle_weight(graph, cycle)) - 1, cycle) for cycle in cycles]
+	ranked.sort(key=lambda found: found[0], reverse=True)
+	return ranked
+
+def negative_cycle(graph, prev, neg_edge, tolerance=0):
+	"""
+	Find the negative cycle behind an edge that a shortest-paths run could still relax, from that run's prev alone.
+	
+	Relaxing neg_edge once more and walking back from its far end along prev lands on a cycle within V steps;
+	that is O(V), where find_disjoint_cycles looks over the whole graph. The cycle is only returned if the graph
+	as it stands says it is negative: prev can be out of date by a relaxation or two when the tolerance is cut
+	close, and then the caller has to look further.
+	
+	>>> graph = {'USD': {'EUR': {'price': 0.1}}, 'EUR': {'USD': {'price': -0.1}, 'GBP': {'price': 0.2}},
+	...          'GBP': {'USD': {'price': -0.5}}}
+	>>> dist, prev, neg_edge = BellmanFord(graph).shortest_paths(None, 1e-12)
+	>>> profit, cycle = negative_cycle(graph, prev, neg_edge, 1e-12)
+	>>> round(profit, 4), cycle
+	(0.2214, ['EUR', 'GBP', 'USD', 'EUR'])
+	>>> graph['GBP']['USD']['price'] = -0.25
+	>>> print(negative_cycle(graph, prev, neg_edge, 1e-12))
+	None
+	
+	:param graph: {from: {to: {"price": weight, ...}}} where weight is -log(exchange rate)
+	:param prev: previous vertex by vertex, as a shortest-paths run left it (not changed)
+	:param neg_edge: the edge (from, to) that run could still relax
+	:param tolerance: how much more than break-even a cycle has to make to count
+	:return: (profit, cycle) as for find_disjoint_cycles, or None if there is no negative cycle there
+	"""
+	curr1, curr2 = neg_edge
+	
+	# walk back V steps from curr2, as though prev[curr2] were already curr1, to be sure of being on the cycle
+	vertex = curr2
+	for i in range(len(prev)):
+		vertex = curr1 if vertex == curr2 else prev.get(vertex)
+		if vertex is None: # the chain ran out: no cycle this way
+			return None
+	
+	cycle = [vertex]
+	step = curr1 if vertex == curr2 else prev[vertex]
+	while step != vertex:
+		cycle.append(step)
+		step = curr1 if step == curr2 else prev[step]
+	cycle.reverse() # we walked it backwards
+	start = cycle.index(min(cycle))
+	cycle = cycle[start:] + cycle[:start]
+	cycle.append(cycle[0])
+	
+	for i in range(len(cycle) - 1):
+		if cycle[i + 1] not in graph.get(cycle[i], {}): # prev still has an edge the graph has lost
+			return None
+	weight = cycle_weight(graph, cycle)
+	if not weight + tolerance < 0:
+		return None
+	return math.exp(-weight) - 1, cycle
+
+def cycle_weight(graph, cycle):
+	"""
+	:return: the total weight of the edges around cycle, [start, ..., start] (negative if trading round it pays)
+	"""
+	return sum(graph[cycle[i]][cycle[i + 1]]["price"] for i in range(len(cycle) - 1))
+
+def predecessor_cycles(prev, done):
+	"""
+	Find the cycles in a predecessor graph (each vertex has at most one predecessor, so this is O(V)).
+	
+	:param prev: previous vertex by vertex
+	:param done: vertices to leave out; the vertices of the cycles found are added to it
+	:return: the cycles not involving vertices in done, each as [start, ..., start] in the direction of the edges
+	"""
+	cycles = []
+	visited = set()
+	for vertex in prev:
+		path = {} # position on the current walk by vertex
+		walk = []
+		while vertex is not None and vertex not in done and vertex not in visited:
+			path[vertex] = len(walk)
+			walk.append(vertex)
+			visited.add(vertex)
+			vertex = prev[vertex]
+		if vertex in path: # walked back onto this walk: the part from there on is a cycle
+			cycle = walk[path[vertex]:]
+			cycle.reverse() # we walked it backwards
+			start = cycle.index(min(cycle))
+			cycle = cycle[start:] + cycle[:start]
+			done.update(cycle)
+			cycles.append(cycle + cycle[:1])
+	return cycles
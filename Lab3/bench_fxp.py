@@ -0,0 +1,97 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: fq19-01
+
+Microbenchmark of encoding and decoding Forex Provider messages.
+
+Encodes a full message of quotes the way the provider used to (bytes concatenation, an array per field), with
+marshal_message (quote dicts) and with marshal_quotes (columns, and NumPy columns if NumPy is installed), then
+decodes it with demarshal_message and demarshal_batch, and prints the time per message for each.
+
+Usage: python bench_fxp.py [QUOTES]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import fxp_bytes
+import fxp_bytes_subscriber
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MIN_SECONDS = 0.2  # run each case at least this long
+CROSSES = ('GBP/USD', 'USD/JPY', 'EUR/USD', 'USD/CHF', 'AUD/USD', 'EUR/JPY', 'GBP/CAD')
+
+
+def quotes(count):
+    """
+    :return: list of quote dicts like the provider publishes
+    """
+    rng = random.Random(0)
+    start = datetime(2019, 11, 1)
+    return [{'timestamp': start + timedelta(microseconds=rng.randrange(10 ** 9)), 'cross': rng.choice(CROSSES),
+             'price': rng.uniform(0.5, 150.0)} for _ in range(count)]
+
+
+def concatenated(quote_sequence):
+    """
+    The encoding as it was done before marshal_quotes: a new bytes object per field appended, float epoch math.
+    """
+    message = bytes()
+    padding = b'\x00' * 10
+    for quote in quote_sequence:
+        micros = (quote['timestamp'] - datetime(1970, 1, 1)).total_seconds() * fxp_bytes.MICROS_PER_SECOND
+        message += int(micros).to_bytes(8, 'big')
+        message += quote['cross'][0:3].encode('utf-8')
+        message += quote['cross'][4:7].encode('utf-8')
+        message += fxp_bytes.serialize_price(quote['price'])
+        message += padding
+    return message
+
+
+def per_call(function, *args):
+    """
+    :return: seconds per call of function(*args)
+    """
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < MIN_SECONDS:
+        for _ in range(10):
+            function(*args)
+        count += 10
+        elapsed = time.perf_counter() - start
+    return elapsed / count
+
+
+def main(count):
+    sequence = quotes(count)
+    crosses = [quote['cross'] for quote in sequence]
+    prices = [quote['price'] for quote in sequence]
+    timestamps = [fxp_bytes.micros_since_epoch(quote['timestamp']) for quote in sequence]
+    message = fxp_bytes.marshal_message(sequence)
+    assert fxp_bytes.marshal_quotes(crosses, prices, timestamps) == message
+    assert concatenated(sequence) == message
+    assert fxp_bytes_subscriber.demarshal_batch(message)[2] == prices
+
+    cases = [('encode concatenated', concatenated, sequence),
+             ('encode marshal_message', fxp_bytes.marshal_message, sequence),
+             ('encode marshal_quotes', fxp_bytes.marshal_quotes, crosses, prices, timestamps)]
+    if np is not None:
+        cases.append(('encode marshal_quotes numpy', fxp_bytes.marshal_quotes, np.array(crosses), np.array(prices),
+                      np.array(timestamps, dtype=np.int64)))
+    cases += [('decode demarshal_message', fxp_bytes_subscriber.demarshal_message, message),
+              ('decode demarshal_batch', fxp_bytes_subscriber.demarshal_batch, message)]
+    print('{} quotes per message, {} bytes'.format(count, len(message)))
+    for name, function, *args in cases:
+        print('{:<30} {:>9.2f}us'.format(name, per_call(function, *args) * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else fxp_bytes.MAX_QUOTES_PER_MESSAGE)
@@ -5,11 +5,21 @@ Forex Provider
 This module contains useful marshalling functions for manipulating Forex Provider packet contents.
 """
 import ipaddress
+import itertools
+import struct
 from array import array
-from datetime import datetime
+from datetime import datetime, timedelta
 
 MAX_QUOTES_PER_MESSAGE = 50
 MICROS_PER_SECOND = 1_000_000
+QUOTE_SIZE = 32  # bytes per quote record: timestamp, cross, price and 10 bytes of zero padding
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+TIMESTAMP_AND_CROSS = struct.Struct('>Q6s')  # at the start of a record: big-endian microseconds, both currencies
+PRICE = struct.Struct('<d')  # 14 bytes into a record: the price, as an ieee754 double on a little-endian machine
+PRICE_OFFSET = TIMESTAMP_AND_CROSS.size
+MAX_CROSSES = 4096  # encoded crosses to remember
+encoded_crosses = {}  # 6-byte encoding indexed by 'XXX/YYY'
 
 
 def serialize_price(x: float) -> bytes:
@@ -55,11 +65,34 @@ def serialize_utcdatetime(utc: datetime) -> bytes:
     :param utc: timestamp to convert to desired byte format
     :return: 8-byte stream
     """
-    epoch = datetime(1970, 1, 1)
-    micros = (utc - epoch).total_seconds() * MICROS_PER_SECOND
-    a = array('L', [int(micros)])
-    a.byteswap()  # convert to big-endian
-    return a.tobytes()
+    return micros_since_epoch(utc).to_bytes(8, 'big')
+
+
+def micros_since_epoch(utc: datetime) -> int:
+    """
+    Exact number of microseconds from 00:00:00 UTC on 1 January 1970 to the given UTC datetime (integer arithmetic
+    throughout, so no rounding through float seconds).
+
+    >>> micros_since_epoch(datetime(2006, 1, 2))
+    1136160000000000
+
+    :param utc: naive datetime in UTC
+    :return: microseconds
+    """
+    return (utc - EPOCH) // ONE_MICROSECOND
+
+
+def encode_cross(cross: str) -> bytes:
+    """
+    :param cross: 'XXX/YYY'
+    :return: the 6 bytes the cross is sent as (remembered, since there are only so many crosses)
+    """
+    encoded = encoded_crosses.get(cross)
+    if encoded is None:
+        if len(encoded_crosses) >= MAX_CROSSES:
+            encoded_crosses.clear()
+        encoded = encoded_crosses[cross] = (cross[0:3] + cross[4:7]).encode('utf-8')
+    return encoded
 
 
 def marshal_message(quote_sequence) -> bytes:
@@ -80,16 +113,43 @@ def marshal_message(quote_sequence) -> bytes:
     """
     if len(quote_sequence) > MAX_QUOTES_PER_MESSAGE:
         raise ValueError('max quotes exceeded for a single message')
-    message = bytes()
-    default_time = serialize_utcdatetime(datetime.utcnow())
-    padding = b'\x00' * 10  # 10 bytes of zeros
-    for quote in quote_sequence:
-        if 'timestamp' in quote:
-            message += serialize_utcdatetime(quote['timestamp'])
-        else:
-            message += default_time
-        message += quote['cross'][0:3].encode('utf-8')
-        message += quote['cross'][4:7].encode('utf-8')
-        message += serialize_price(quote['price'])
-        message += padding
-    return message
+    default_time = micros_since_epoch(datetime.utcnow())
+    return marshal_quotes([quote['cross'] for quote in quote_sequence], [quote['price'] for quote in quote_sequence],
+                          [quote['timestamp'] if 'timestamp' in quote else default_time for quote in quote_sequence])
+
+
+def marshal_quotes(crosses, prices, timestamps=None) -> bytes:
+    """
+    Construct the byte stream for a message from columns of quotes, packing every record straight into one
+    preallocated buffer.
+
+    >>> b = marshal_message([{'timestamp': datetime(2006,1,2), 'cross': 'GBP/USD', 'price': 1.22041},
+    ...                      {'timestamp': datetime(2006,1,1), 'cross': 'USD/JPY', 'price': 108.2755}])
+    >>> marshal_quotes(['GBP/USD', 'USD/JPY'], [1.22041, 108.2755], [1136160000000000, datetime(2006, 1, 1)]) == b
+    True
+
+    :param crosses: sequence of 'XXX/YYY'
+    :param prices: sequence of numbers (a list, an array, a NumPy array, ...)
+    :param timestamps: sequence of UTC datetimes or integer microseconds since the epoch (such as a NumPy int64
+                       array), or None to stamp every quote with the current time
+    :return: byte stream to send in UDP message
+    """
+    count = len(crosses)
+    if count > MAX_QUOTES_PER_MESSAGE:
+        raise ValueError('max quotes exceeded for a single message')
+    if len(prices) != count or (timestamps is not None and len(timestamps) != count):
+        raise ValueError('quote columns must all be the same length')
+    if timestamps is None:
+        timestamps = itertools.repeat(micros_since_epoch(datetime.utcnow()), count)
+    # NumPy (and array) columns convert to lists of plain numbers in one C call, much faster to iterate over
+    crosses, prices, timestamps = (column.tolist() if hasattr(column, 'tolist') else column
+                                   for column in (crosses, prices, timestamps))
+    message = bytearray(count * QUOTE_SIZE)  # starts out all zeros, so the padding is already there
+    offset = 0
+    for cross, price, timestamp in zip(crosses, prices, timestamps):
+        if isinstance(timestamp, datetime):
+            timestamp = micros_since_epoch(timestamp)
+        TIMESTAMP_AND_CROSS.pack_into(message, offset, timestamp, encode_cross(cross))
+        PRICE.pack_into(message, offset + PRICE_OFFSET, price)
+        offset += QUOTE_SIZE
+    return bytes(message)
@@ -8,8 +8,16 @@ This is free and unencumbered software released into the public domain.
 from array import array
 import ipaddress
 from datetime import datetime
+import struct
 
 MICROS_PER_SECOND = 1_000_000
+QUOTE_SIZE = 32 # bytes in each quote record
+MAX_QUOTES_PER_MESSAGE = 50 # most quotes the provider puts in one datagram
+MAX_MESSAGE_SIZE = MAX_QUOTES_PER_MESSAGE * QUOTE_SIZE # so the largest datagram to expect, in bytes
+TIMESTAMP_AND_CROSS = struct.Struct(">Q6s18x") # microseconds since the epoch (big-endian), then both currencies
+PRICE = struct.Struct("<14xd10x") # the price is a little-endian double
+MAX_CROSSES = 4096 # decoded crosses to remember
+crosses_seen = {} # (currency, currency) indexed by the 6 bytes they were sent as
 
 def deserialize_price(b: bytes) -> float:
 	"""
@@ -66,4 +74,31 @@ def demarshal_message(b: bytes) -> list:
 		
 		quotes.append(quote)
 		
-	return quotes
\ No newline at end of file
+	return quotes
+
+def demarshal_batch(b: bytes) -> (list, list, list):
+	"""
+	Convert from bytes into columns of quotes, decoding every record in a few C-level passes over the buffer
+	(no copies, no per-quote datetimes or dicts).
+	
+	>>> message = bytes.fromhex('00040954dd354000') + b'GBPUSD' + bytes.fromhex('bb61dba2cc86f33f') + bytes(10)
+	>>> demarshal_batch(message + message[:20])  # a partial record at the end is ignored
+	([1136160000.0], [('GBP', 'USD')], [1.22041])
+	
+	:param b: the bytes to be demarshaled (a whole datagram of 32-byte records)
+	:return: (timestamps as seconds since the epoch UTC, crosses as (currency, currency), prices)
+	"""
+	view = memoryview(b)
+	view = view[:len(view) - len(view) % QUOTE_SIZE]
+	timestamps = []
+	crosses = []
+	for micros, cross in TIMESTAMP_AND_CROSS.iter_unpack(view):
+		timestamps.append(micros / MICROS_PER_SECOND)
+		currencies = crosses_seen.get(cross)
+		if currencies is None:
+			if len(crosses_seen) >= MAX_CROSSES:
+				crosses_seen.clear()
+			currencies = crosses_seen[cross] = (cross[:3].decode("utf-8"), cross[3:].decode("utf-8"))
+		crosses.append(currencies)
+	prices = [price for price, in PRICE.iter_unpack(view)]
+	return timestamps, crosses, prices
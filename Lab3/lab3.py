@@ -6,7 +6,7 @@ Collaborated with Pabi and
 :Version: fq19-01
 """
 
-from datetime import datetime, timedelta
+from datetime import datetime
 import socket
 import sys
 import threading
@@ -15,118 +15,235 @@ import math
 
 import fxp_bytes
 import fxp_bytes_subscriber as fxp_bytes_s
-from bellman_ford import BellmanFord
+import bellman_ford
+from bellman_ford import BellmanFord, IncrementalBellmanFord, VectorBellmanFord, find_disjoint_cycles, negative_cycle
+from quote_expiry import QuoteExpiry
 
 LISTENER_ADDRESS = (socket.gethostbyname(socket.gethostname()), 12345) # start up a listener on port 12345
 SUBSCRIPTION_CYCLE = 10 * 60 # ten minutes
-MESSAGE_BUFFER = 0.1 # 100ms
 QUOTE_TIMEOUT = 1.5 # consider quotes stale after this many seconds
+EVALUATION_INTERVAL = 0.1 # look for arbitrage at most this often (seconds); quotes in between are coalesced
+RECV_BUFFER = 1 << 20 # bytes of socket receive buffer to ask for, so bursts queue rather than drop
+# ask the kernel for a running count of datagrams it dropped on our socket (only Linux has it)
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40 if sys.platform.startswith("linux") else None)
 DEFAULT_TRADE_AMT = 100 # the default amount to make a currency exchange with
+ENGINES = {"python": BellmanFord, "numpy": VectorBellmanFord} # interchangeable Bellman-Ford implementations
+DEFAULT_ENGINE = "python" if bellman_ford.np is None else "numpy" # the vectorized one when numpy is installed
 
 class Lab3(object):
 	
-	def __init__(self, provider):
+	def __init__(self, provider, engine=DEFAULT_ENGINE, interval=EVALUATION_INTERVAL, recv_buffer=RECV_BUFFER):
 		"""
 		:param provider: the address (host, port tuple) of the provider
+		:param engine: which Bellman-Ford implementation to use when starting over (see ENGINES)
+		:param interval: the least time between looks for arbitrage, in seconds
+		:param recv_buffer: bytes of socket receive buffer to ask for
 		"""
 		self.provider_address = provider
+		self.interval = interval
+		self.recv_buffer = recv_buffer
+		self.latest = {} # timestamp of the latest quote taken by (sender address, cross (currencies sorted))
+		self.lock = threading.Lock() # guards pending and the counters, between the receiver and the evaluator
+		self.pending = {} # the latest quote not yet in the graph by cross (currencies sorted), latest wins
+		self.quotes_ready = threading.Event() # set when there is something in pending
+		self.received = 0 # quotes taken from the provider
+		self.coalesced = 0 # of those, quotes replaced by (or older than) another for the cross before evaluation
+		self.evaluated = 0 # quotes put into the graph
+		self.evaluations = 0 # looks for arbitrage
+		self.datagrams = 0 # datagrams received
+		self.truncated = 0 # of those, ones cut short (or not a whole number of quotes)
+		self.out_of_order = 0 # of those, ones with a quote no newer than one already taken from its sender for its cross
+		self.kernel_dropped = 0 # datagrams the kernel dropped for want of buffer space (Linux only)
 		self.graph = {}
+		self.expiry = QuoteExpiry(self.graph) # the graph's quotes, oldest first
+		# from a virtual super-source, so cycles anywhere in the graph count; told about every edge we change
+		self.detector = IncrementalBellmanFord(self.graph, None, 1e-12, ENGINES[engine])
 		
 	def listen(self):
 		"""
 		Binds the listening socket and receives a message, then processes it
 		"""
+		listener = self.open_listener(LISTENER_ADDRESS)
+		
+		while True:
+			# wait for a message, then hand its quotes to the evaluator
+			byte_msg, truncated, sender = self.receive(listener)
+			self.take_quotes(byte_msg, truncated, sender)
+	
+	def open_listener(self, address):
+		"""
+		Bind a UDP socket with a receive buffer of recv_buffer bytes (as far as the system allows)
+		:param address: where to have the quotes sent
+		:return: the socket
+		"""
 		listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-		listener.bind(LISTENER_ADDRESS)
+		listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+		if SO_RXQ_OVFL is not None:
+			listener.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+		listener.bind(address)
 		
-		last_time = datetime.now() + (datetime.utcnow() - datetime.now())
+		granted = listener.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+		if granted < self.recv_buffer: # Linux reports double what it was asked for, as it counts its overhead
+			self.pr_log("Asked for a {} byte receive buffer, got {}".format(self.recv_buffer, granted))
+		return listener
+	
+	def receive(self, listener):
+		"""
+		Wait for a datagram, with room for the largest message the provider sends (and a byte to spare, to spot a
+		larger one), noting how many the kernel has dropped when it says
+		:param listener: the socket from open_listener
+		:return: (the datagram, whether it was cut short, the address it came from)
+		"""
+		if SO_RXQ_OVFL is None:
+			byte_msg, address = listener.recvfrom(fxp_bytes_s.MAX_MESSAGE_SIZE + 1)
+			return byte_msg, len(byte_msg) > fxp_bytes_s.MAX_MESSAGE_SIZE, address
 		
-		while True:
-			# wait for a message, unmarshal when one is received
-			byte_msg = listener.recv(1024)
-			demarshaled = fxp_bytes_s.demarshal_message(byte_msg)
+		byte_msg, ancdata, flags, address = listener.recvmsg(fxp_bytes_s.MAX_MESSAGE_SIZE + 1, socket.CMSG_SPACE(4))
+		for level, kind, data in ancdata:
+			if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL: # dropped before this one was queued
+				self.kernel_dropped = max(self.kernel_dropped, int.from_bytes(data[:4], sys.byteorder))
+		return byte_msg, bool(flags & socket.MSG_TRUNC) or len(byte_msg) > fxp_bytes_s.MAX_MESSAGE_SIZE, address
+	
+	def take_quotes(self, byte_msg, truncated=False, sender=None):
+		"""
+		Unmarshal a message and queue its quotes for the evaluator, ignoring any no newer than the latest quote
+		taken from the same sender for their cross (the graph is left alone, so this is quick enough to keep up
+		with the socket)
+		:param byte_msg: the datagram from the provider
+		:param truncated: whether the datagram was cut short on the way in
+		:param sender: the address it came from (each provider's timestamps are only comparable with its own)
+		"""
+		timestamps, crosses, prices = fxp_bytes_s.demarshal_batch(byte_msg)
+		ignored = 0
+		
+		with self.lock:
+			self.datagrams += 1
+			if truncated or len(byte_msg) % fxp_bytes_s.QUOTE_SIZE:
+				self.truncated += 1
 			
-			for quote in demarshaled: # process each quote individually
-				timestamp = quote["timestamp"]
-				diff = (last_time - timestamp).total_seconds()
+			for timestamp, currencies, price in zip(timestamps, crosses, prices):
+				# the order only matters within one provider's cross (either way round), so check it there
+				key = currencies if currencies[0] < currencies[1] else (currencies[1], currencies[0])
+				if self.latest.get((sender, key), float("-inf")) >= timestamp:
+					ignored += 1
+					continue
+				self.latest[(sender, key)] = timestamp
+				self.received += 1
 				
-				# if the new message is at least MESSAGE_BUFFER newer than the last message, process it
-				if diff < MESSAGE_BUFFER:
-					currencies = quote["cross"].split("/")
-					self.pr_log("{} {} {}".format(currencies[0], currencies[1], quote["price"]))
-					
-					# update the graph using the new quote and change last_time to reflect new message
-					self.add_to_graph(currencies, quote)
-					last_time = quote["timestamp"]
-				else:
-					self.pr_log("Ignoring out-of-sequence message")
-			
-			stale = self.cleanup_graph()
-			if stale > 0:
-				pr_log("Removed {} stale quotes".format(stale))
+				# only the latest quote for each cross is worth putting in the graph
+				if key in self.pending:
+					self.coalesced += 1
+				self.pending[key] = (currencies, timestamp, price)
 			
-			bf = BellmanFord(self.graph)
-			dist, prev, neg_edge = bf.shortest_paths('USD', 1e-12)
-			if not neg_edge is None:
-				self.print_arbitrage(prev, 'USD')
+			if ignored:
+				self.out_of_order += 1
+		
+		if ignored:
+			self.pr_log("Ignoring {} out-of-sequence quotes".format(ignored))
+		self.quotes_ready.set()
+	
+	def evaluate(self):
+		"""
+		Put the queued quotes in the graph, drop stale ones from it, then print any arbitrage opportunities it has
+		"""
+		with self.lock:
+			pending, self.pending = self.pending, {}
+			self.evaluated += len(pending)
+			self.evaluations += 1
+		
+		for currencies, timestamp, price in pending.values():
+			self.pr_log("{} {} {}".format(currencies[0], currencies[1], price))
+			self.add_to_graph(currencies, timestamp, price)
+		
+		stale = self.cleanup_graph()
+		if stale:
+			self.pr_log("Removed {} stale quotes".format(len(stale)))
+		
+		dist, prev, neg_edge = self.detector.shortest_paths()
+		if not neg_edge is None:
+			# the cycle is almost always right there on the detector's prev chain; search the whole graph if not
+			found = negative_cycle(self.graph, prev, neg_edge, 1e-12)
+			cycles = [found] if found is not None else find_disjoint_cycles(self.graph, 1e-12) # most profitable first
+			for profit, cycle in cycles:
+				self.print_arbitrage(cycle, 'USD')
+	
+	def evaluate_forever(self):
+		"""
+		Evaluates whenever there are new quotes (or stale ones to drop), but no more than once every interval
+		"""
+		while True:
+			self.quotes_ready.wait(QUOTE_TIMEOUT)
+			self.quotes_ready.clear()
+			self.evaluate()
+			time.sleep(self.interval) # anything that comes in meanwhile is coalesced
+	
+	def counts(self):
+		"""
+		:return: quotes received, coalesced and evaluated so far, and the number of evaluations
+		"""
+		with self.lock:
+			return self.received, self.coalesced, self.evaluated, self.evaluations
+	
+	def losses(self):
+		"""
+		:return: datagrams received, truncated, out of order, and dropped by the kernel so far
+		"""
+		with self.lock:
+			return self.datagrams, self.truncated, self.out_of_order, self.kernel_dropped
 			
-	def add_to_graph(self, currencies, quote):
+	def add_to_graph(self, currencies, timestamp, price):
 		"""
 		Adds the provided quote to the graph of quotes (along with inverse)
-		:param quote: the quote to add to be added to the graph
+		:param currencies: the quote's cross, as (currency, currency)
+		:param timestamp: when the quote was made, in seconds since the epoch (UTC)
+		:param price: the quoted exchange rate
 		"""
-		rate = -1 * math.log(quote["price"])
+		rate = -1 * math.log(price)
 		
 		# add the curr1 -> curr2 edge
 		if not currencies[0] in self.graph:
 			self.graph[currencies[0]] = {}
 		
-		self.graph[currencies[0]][currencies[1]] = {"timestamp": quote["timestamp"], "price": rate}
+		self.graph[currencies[0]][currencies[1]] = {"timestamp": timestamp, "price": rate}
+		self.detector.edge_changed(currencies[0], currencies[1])
 		
 		# add the curr2 -> curr1 edge (inverse exchange rate)
 		if not currencies[1] in self.graph:
 			self.graph[currencies[1]] = {}
 		
-		self.graph[currencies[1]][currencies[0]] = {"timestamp": quote["timestamp"], "price": -1 * rate}
+		self.graph[currencies[1]][currencies[0]] = {"timestamp": timestamp, "price": -1 * rate}
+		self.detector.edge_changed(currencies[1], currencies[0])
+		self.expiry.quoted(currencies, timestamp)
 		
 	def cleanup_graph(self):
 		"""
-		Remove any "stale" edges that have been around for longer than QUOTE_TIMEOUT
+		Remove any "stale" quotes (both edges of the cross) that have been around for longer than QUOTE_TIMEOUT
+		:return: the crosses removed, as (currency, currency)
 		"""
-		stale_cutoff = datetime.now() - timedelta(seconds=QUOTE_TIMEOUT)
-		stale_count = 0
-		
-		for curr1 in self.graph:
-			for curr2 in self.graph[curr1]:
-				# remove the quote if it is considered stale
-				if self.graph[curr1][curr2]["timestamp"] <= stale_cutoff:
-					del self.graph[curr1][curr2]
-					stale_count += 1
-					
-		return stale_count
+		stale = self.expiry.evict(time.time() - QUOTE_TIMEOUT)
+		for curr1, curr2 in stale:
+			self.detector.edge_changed(curr1, curr2)
+			self.detector.edge_changed(curr2, curr1)
+		return stale
 	
-	def print_arbitrage(self, prev, origin, init_value=DEFAULT_TRADE_AMT):
+	def print_arbitrage(self, cycle, origin, init_value=DEFAULT_TRADE_AMT):
 		"""
 		Print the arbitrage opportunity step by step
-		:param prev: the dictionary of previous locations for each vertex
-		:param origin: where we are starting the trade from
-		:param init_value: the initial amount of money to exchange (in origin currency)
+		:param cycle: the currencies to trade through, in order, as [start, ..., start]
+		:param origin: where we would rather start the trade from (if it is on the cycle)
+		:param init_value: the initial amount of money to exchange (in the starting currency)
 		"""
 		
-		# iterate through prev from end to beginning
-		steps = [origin]
-		last_step = prev[origin]
-		
-		while not last_step == origin:
-			steps.append(last_step)
-			last_step = prev[last_step]
-		
-		# we start at origin so throw that in, then reverse to get forward order
+		# go round the cycle from origin if it is on it
+		steps = cycle[:-1]
+		if origin in steps:
+			start = steps.index(origin)
+			steps = steps[start:] + steps[:start]
+		origin = steps[0]
 		steps.append(origin)
-		steps.reverse()
 		
 		# print the list of steps in a readable format
-		print("From 100 {}".format(origin))
+		print("From {} {}".format(init_value, origin))
 		
 		value = init_value
 		last = origin
@@ -149,6 +266,8 @@ class Lab3(object):
 		Sends the subscription message to the provider every SUBSCRIPTION_CYCLE amount of seconds
 		"""
 		while True:
+			self.pr_log("Received {} quotes, coalesced {}, evaluated {} in {} evaluations".format(*self.counts()))
+			self.pr_log("Received {} datagrams, {} truncated, {} out of order, {} dropped".format(*self.losses()))
 			self.pr_log("Sending SUBSCRIBE to {}".format(self.provider_address))
 			
 			# connect to the socket and send our address information
@@ -162,9 +281,12 @@ class Lab3(object):
 		
 	def run(self):
 		"""
-		Starts up the listener and subscriber threads in that order
+		Starts up the evaluator, listener and subscriber threads in that order
 		(to ensure that the listener is running when the subscriber sends out data - or close to that)
 		"""
+		evaluator_thr = threading.Thread(target=self.evaluate_forever)
+		evaluator_thr.start()
+		
 		listener_thr = threading.Thread(target=self.listen)
 		listener_thr.start()
 		
@@ -179,10 +301,10 @@ class Lab3(object):
 		print("["+str(datetime.now())+"]", msg)
 		
 if __name__ == "__main__":
-	if len(sys.argv) != 3:
-		print("Usage: python lab3.py [provider_host] [provider_port]")
+	if len(sys.argv) not in (3, 4) or sys.argv[3:] not in ([], ["python"], ["numpy"]):
+		print("Usage: python lab3.py [provider_host] [provider_port] [python|numpy]")
 		exit(1)
 		
 	address = (sys.argv[1], int(sys.argv[2]))
-	subscriber = Lab3(address)
+	subscriber = Lab3(address, (sys.argv[3:] or [DEFAULT_ENGINE])[0])
 	subscriber.run()
\ No newline at end of file
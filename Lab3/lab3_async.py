@@ -0,0 +1,134 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: fq19-01
+
+Lab3 subscriber on an asyncio event loop, for several Forex Providers at once.
+
+One UDP socket is subscribed to every provider and their feeds go into a single rate table (the Lab3 graph), so
+arbitrage across venues is found too. Each time the socket is readable, every datagram already waiting on it is
+read and its quotes queued, and detection is scheduled to run over the coalesced quotes no more than once every
+interval, rather than once per datagram. Subscriptions are renewed on a timer task, all on one thread.
+"""
+
+import asyncio
+import sys
+
+import fxp_bytes_subscriber as fxp_bytes_s
+from lab3 import Lab3, LISTENER_ADDRESS, SUBSCRIPTION_CYCLE, DEFAULT_ENGINE, EVALUATION_INTERVAL, RECV_BUFFER
+
+MAX_DRAIN = 256 # most datagrams to take per wakeup, so renewals are not held up by a flood
+
+class SubscriberProtocol(asyncio.DatagramProtocol):
+	"""
+	Hands datagrams to an AsyncLab3, with whatever else is waiting on the socket.
+	"""
+
+	def __init__(self, subscriber, sock):
+		"""
+		:param subscriber: the AsyncLab3 to give the datagrams to
+		:param sock: the (non-blocking) socket the transport reads from
+		"""
+		self.subscriber = subscriber
+		self.sock = sock
+
+	def datagram_received(self, data, addr):
+		batch = [(data, len(data) > fxp_bytes_s.MAX_MESSAGE_SIZE, addr)]
+		while len(batch) < MAX_DRAIN:
+			try:
+				batch.append(self.subscriber.receive(self.sock))
+			except (BlockingIOError, InterruptedError):
+				break
+		self.subscriber.take_batch(batch)
+
+	def error_received(self, exc):
+		self.subscriber.pr_log("Receive failed: {}".format(exc))
+
+class AsyncLab3(Lab3):
+
+	def __init__(self, providers, engine=DEFAULT_ENGINE, listener_address=LISTENER_ADDRESS,
+			interval=EVALUATION_INTERVAL, recv_buffer=RECV_BUFFER):
+		"""
+		:param providers: the addresses (host, port tuples) of the providers to subscribe to
+		:param engine: which Bellman-Ford implementation to use when starting over (see lab3.ENGINES)
+		:param listener_address: where to have the quotes sent
+		:param interval: the least time between looks for arbitrage, in seconds
+		:param recv_buffer: bytes of socket receive buffer to ask for
+		"""
+		super().__init__(providers[0], engine, interval, recv_buffer)
+		self.providers = list(providers)
+		self.listener_address = listener_address
+		self.transport = None
+		self.evaluation = None # the scheduled call to evaluate, if there is one
+		self.last_evaluation = float("-inf") # event loop time of the latest evaluation
+		self.batches = 0
+
+	def take_batch(self, batch):
+		"""
+		Queue the quotes from every datagram in the batch, and schedule a look for arbitrage if none is due
+		:param batch: [(datagram, whether it was cut short, the address it came from)]
+		"""
+		for byte_msg, truncated, sender in batch:
+			self.take_quotes(byte_msg, truncated, sender)
+		self.batches += 1
+		
+		if self.evaluation is None:
+			loop = asyncio.get_running_loop()
+			delay = max(0.0, self.last_evaluation + self.interval - loop.time())
+			self.evaluation = loop.call_later(delay, self.evaluate_due)
+	
+	def evaluate_due(self):
+		"""
+		Look for arbitrage over the quotes queued since the last time
+		"""
+		self.evaluation = None
+		self.last_evaluation = asyncio.get_running_loop().time()
+		self.evaluate()
+
+	async def subscribe_forever(self):
+		"""
+		Sends the subscription message to every provider every SUBSCRIPTION_CYCLE amount of seconds
+		"""
+		serialized_addr = fxp_bytes_s.serialize_address(self.listener_address)
+		while True:
+			for provider in self.providers:
+				self.pr_log("Sending SUBSCRIBE to {}".format(provider))
+				self.transport.sendto(serialized_addr, provider)
+			await asyncio.sleep(SUBSCRIPTION_CYCLE)
+
+	async def serve(self):
+		"""
+		Bind the listening socket, subscribe to the providers and take quotes until cancelled
+		"""
+		sock = self.open_listener(self.listener_address)
+		sock.setblocking(False)
+		loop = asyncio.get_running_loop()
+		self.transport, protocol = await loop.create_datagram_endpoint(lambda: SubscriberProtocol(self, sock),
+				sock=sock)
+		try:
+			await self.subscribe_forever()
+		finally:
+			self.transport.close()
+
+	def run(self):
+		"""
+		Runs the event loop on this thread until interrupted
+		"""
+		try:
+			asyncio.run(self.serve())
+		except KeyboardInterrupt:
+			self.pr_log("Took {} datagrams in {} batches".format(self.datagrams, self.batches))
+			self.pr_log("Received {} quotes, coalesced {}, evaluated {} in {} evaluations".format(*self.counts()))
+			self.pr_log("Received {} datagrams, {} truncated, {} out of order, {} dropped".format(*self.losses()))
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2:
+		print("Usage: python lab3_async.py provider_host:provider_port [provider_host:provider_port ...]")
+		exit(1)
+
+	addresses = []
+	for arg in sys.argv[1:]:
+		host, port = arg.rsplit(":", 1)
+		addresses.append((host, int(port)))
+	AsyncLab3(addresses).run()
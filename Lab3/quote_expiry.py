@@ -0,0 +1,88 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Nicholas Jones
+:Version: fq19-01
+
+Expiry-ordered index of the quotes in the Lab3 rate table, so stale quotes can be evicted without scanning the
+whole graph.
+
+Every quote added to the graph pushes (timestamp, cross) onto a min-heap. Evicting pops from the front of the heap
+only while the oldest entry is past the cutoff, so it costs O(k log n) for the k quotes that expired. A cross that
+is quoted again is not looked for in the heap: its old entry is left there and skipped when it comes up, because
+the graph's timestamp for the cross no longer matches it. The heap is rebuilt from the live crosses if the skipped
+entries ever outnumber them, which keeps it O(crosses) in size.
+"""
+
+import heapq
+
+class QuoteExpiry(object):
+	"""
+	Evict quotes from a rate table {from: {to: {"timestamp": seconds, "price": weight}}} once they get too old.
+	Both directions of a cross are added together with the same timestamp, and expire together.
+
+	>>> graph = {'GBP': {'USD': {'timestamp': 10.0}}, 'USD': {'GBP': {'timestamp': 10.0}}}
+	>>> expiry = QuoteExpiry(graph)
+	>>> expiry.quoted(('GBP', 'USD'), 10.0)
+	>>> graph['USD']['JPY'] = {'timestamp': 11.0}; graph['JPY'] = {'USD': {'timestamp': 11.0}}
+	>>> expiry.quoted(('USD', 'JPY'), 11.0)
+	>>> graph['GBP']['USD']['timestamp'] = graph['USD']['GBP']['timestamp'] = 12.0
+	>>> expiry.quoted(('USD', 'GBP'), 12.0)  # the same cross, quoted the other way round
+	>>> expiry.evict(11.5), graph
+	([('USD', 'JPY')], {'GBP': {'USD': {'timestamp': 12.0}}, 'USD': {'GBP': {'timestamp': 12.0}}, 'JPY': {}})
+	>>> expiry.evict(12.0), graph['GBP'], len(expiry)
+	([('USD', 'GBP')], {}, 0)
+	"""
+
+	def __init__(self, graph):
+		"""
+		:param graph: the rate table to evict from; changed in place by the caller and by evict
+		"""
+		self.graph = graph
+		self.heap = [] # (timestamp, (currency, currency)), oldest first; some may be out of date
+		self.live = {} # timestamp of the latest quote by cross, with the currencies sorted
+
+	def __len__(self):
+		"""
+		:return: the number of crosses with a quote in the table
+		"""
+		return len(self.live)
+
+	def quoted(self, currencies, timestamp):
+		"""
+		Note that the cross was just (re)quoted in the graph, both ways, at timestamp.
+		:param currencies: the quote's cross, as (currency, currency)
+		:param timestamp: when the quote was made, in seconds since the epoch (UTC)
+		"""
+		self.live[tuple(sorted(currencies))] = timestamp
+		heapq.heappush(self.heap, (timestamp, currencies))
+		if len(self.heap) > 2 * len(self.live) + 16: # mostly out-of-date entries: start afresh
+			self.heap = [(timestamp, currencies) for currencies, timestamp in self.live.items()]
+			heapq.heapify(self.heap)
+
+	def evict(self, cutoff):
+		"""
+		Remove both directions of every cross last quoted at or before cutoff from the graph.
+		:param cutoff: quotes with a timestamp at or before this (seconds since the epoch, UTC) are stale
+		:return: the crosses removed, oldest first, as (currency, currency) in the order they were last quoted
+		"""
+		expired = []
+		heap, live = self.heap, self.live
+		while heap and heap[0][0] <= cutoff:
+			timestamp, currencies = heapq.heappop(heap)
+			key = tuple(sorted(currencies))
+			if live.get(key) != timestamp or self.timestamp(currencies) != timestamp:
+				continue # quoted again since (or already gone)
+			del live[key]
+			curr1, curr2 = currencies
+			del self.graph[curr1][curr2]
+			self.graph[curr2].pop(curr1, None)
+			expired.append(currencies)
+		return expired
+
+	def timestamp(self, currencies):
+		"""
+		:return: the graph's timestamp for the cross's edge as given, or None if it is not there
+		"""
+		edge = self.graph.get(currencies[0], {}).get(currencies[1])
+		return None if edge is None else edge["timestamp"]
@@ -9,15 +9,17 @@ Collaborated with Pabi
 import sys
 import threading
 import socket
-import pickle
 import hashlib
 
+import framing
+import wire
+
 
 M = 3  # FIXME: Test environment, normally = hashlib.sha1().digest_size * 8
 NODES = 2**M
-BUFFER_SIZE = 4096	# socket recv arg
 BACKLOG = 100  # socket listen arg
 TEST_BASE = 43544  # for testing use port numbers on localhost at TEST_BASE+n
+READ_TIMEOUT = 5  # seconds to wait for a request once a client has connected
 
 
 class ModRange(object):
@@ -190,8 +192,7 @@ class ChordNode(object):
 		with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
 			try:
 				sock.connect(address)
-				sock.sendall(pickle.dumps((procedure, arg1, arg2)))
-				return pickle.loads(sock.recv(BUFFER_SIZE))
+				return wire.request(sock, (procedure, arg1, arg2))
 			except Exception as e:
 				return None
 
@@ -206,20 +207,53 @@ class ChordNode(object):
 		
 		while True:
 			conn, addr = listen_sock.accept()
-			procedure, arg1, arg2 = pickle.loads(conn.recv(BUFFER_SIZE))
 			
-			handle_thr = threading.Thread(target=self.handle_conn, args=(conn, procedure, arg1, arg2))
+			# read the request on the handler thread, so a slow or broken client cannot hold up the others
+			handle_thr = threading.Thread(target=self.handle_conn, args=(conn,))
 			handle_thr.start()
 			
-	def handle_conn(self, conn, procedure, arg1, arg2):
+	def handle_conn(self, conn):
+		"""
+		Read one (procedure, arg1, arg2) request from the connection, answer it and close the connection
+		:param conn: the accepted connection
+		"""
+		try:
+			try:
+				conn.settimeout(READ_TIMEOUT)
+				payload = framing.recv_frame(conn, framing.MAX_REQUEST)
+				if payload is None: # connected and hung up without asking anything
+					return
+				procedure, arg1, arg2 = wire.decode(payload, allow_pickle=False) # every node speaks binary
+				if type(procedure) is not str:
+					raise TypeError("procedure name must be a str, not {}".format(type(procedure).__name__))
+			except (OSError, ValueError, TypeError) as e: # cut off, timed out, garbled or not a 3-tuple
+				print("Dropped bad request: {}".format(e))
+				return
+			
+			try:
+				self.dispatch(conn, procedure, arg1, arg2)
+			except Exception as e: # a broken procedure costs this request, not the socket or the node
+				print("Request {} failed: {!r}".format(procedure, e))
+		finally:
+			# close the connection when we're done handling
+			conn.close()
+	
+	def dispatch(self, conn, procedure, arg1, arg2):
+		"""
+		Call the requested procedure and send back its result
+		:param conn: the connection the request came in on
+		:param procedure: name of the procedure
+		:param arg1: its first argument, if any
+		:param arg2: its second argument, if any
+		"""
 		if procedure == 'successor':
-			conn.sendall(pickle.dumps(self.finger[1].node))
+			framing.send_frame(conn, wire.encode(self.finger[1].node))
 		elif procedure == 'predecessor':
 			if arg1:
 				self.predecessor = arg1
-				conn.sendall(pickle.dumps('OK'))
+				framing.send_frame(conn, wire.encode('OK'))
 			else:
-				conn.sendall(pickle.dumps(self.predecessor))
+				framing.send_frame(conn, wire.encode(self.predecessor))
 		elif hasattr(self, procedure):
 			print (procedure, arg1, arg2)
 			proc_method = getattr(self, procedure)
@@ -232,13 +266,10 @@ class ChordNode(object):
 			else:
 				result = proc_method()
 				
-			# send the result back and then close the connection
-			conn.sendall(pickle.dumps(result))
+			# send the result back
+			framing.send_frame(conn, wire.encode(result))
 		else:
 			print("Received invalid message")
-		
-		# close the connection when we're done handling
-		conn.close()
 
 
 if __name__ == '__main__':